@@ -9,11 +9,11 @@ from .events import (ConnectionMade, ConnectionLost, delProperty, defSwitchVecto
 
 from .propertyvectors import ClientEvent
 
-from .propertymembers import getfloat
+from .propertymembers import getfloat, BLOBFile
 
 version = "0.9.2"
 
-__all__ = ["version", "IPyClient", "ClientEvent", "getfloat", "ConnectionMade", "ConnectionLost",
+__all__ = ["version", "IPyClient", "ClientEvent", "getfloat", "BLOBFile", "ConnectionMade", "ConnectionLost",
            "delProperty", "defSwitchVector", "defTextVector", "defNumberVector", "defLightVector", "defBLOBVector",
            "setSwitchVector", "setTextVector", "setNumberVector", "setLightVector", "setBLOBVector", "Message", "VectorTimeOut"]
 
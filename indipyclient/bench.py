@@ -0,0 +1,1034 @@
+"""
+Benchmarks for indipyclient, run with
+
+python -m indipyclient.bench
+
+As default, this starts an in-process stand-in INDI server, FakeServer, on the
+loopback interface, and runs IPyClient and QueClient with each receive engine
+against its load, reporting messages/s, bytes/s, update latency percentiles,
+memory peak and event loop lag. The exit status is non-zero if any client fails
+to receive all the data, so this can be used as a release check.
+
+With --micro, this instead compares the time taken by the receive engines to
+parse a generated stream of INDI traffic, times event creation, timestamp
+parsing and creating new vectors to send, and checks that the parser backends
+produce identical messages from the same traffic, that new vectors rendered
+from vector templates are identical to those created by ElementTree, that
+setBLOBVectors sent by the FakeServer are received intact, and that
+the connection keepalive timers fire at their deadlines, on a virtual clock.
+
+With --replay, a recording made with IPyClient.record_session is replayed
+into each receive engine.
+
+With --priority, BLOB uploads are queued to the FakeServer, and a switch vector
+abort is sent behind them, measuring the time for the abort to arrive at the
+server, with the abort sent at transmit priority "bulk", so waiting behind the
+uploads, and at priority "control".
+
+With --lifecycle, clients are shut down while connected to the FakeServer, and
+while waiting to reconnect, and while an upload is blocked by a FakeServer
+which has stopped reading, measuring the time and processor time taken to
+stop, and the FakeServer drops the connection, measuring the time taken to
+reconnect. The exit status is non-zero if any shutdown takes more than 50ms.
+"""
+
+
+import asyncio, time, argparse, base64, collections, statistics, sys, tracemalloc, selectors, concurrent.futures, tempfile, pathlib
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+import xml.etree.ElementTree as ET
+
+from datetime import datetime, timezone, timedelta
+
+from .ipyclient import IPyClient, Device
+
+from .rxparser import PullParser, ExpatParser, Record, BLOBSink
+
+from .propertymembers import _parse_timestamp, BLOBSource, BLOBFile
+
+from .recorder import Replayer
+
+from .fakeserver import FakeServer
+
+from .queclient import QueClient
+
+
+def make_traffic(devices=4, vectors=8, updates=10000):
+    """Returns bytes of INDI traffic, defining devices x vectors number vectors
+       followed by updates setNumberVector messages, together with the
+       number of messages in the traffic"""
+    timestamp = datetime.now(tz=timezone.utc).replace(tzinfo=None).isoformat(sep='T')
+    messages = []
+    for d in range(devices):
+        for v in range(vectors):
+            messages.append(f'<defNumberVector device="device{d}" name="vector{v}" state="Ok" perm="rw" timestamp="{timestamp}">\n'
+                            f'  <defNumber name="x" format="%.2f" min="0" max="1000" step="0">0</defNumber>\n'
+                            f'  <defNumber name="y" format="%.2f" min="0" max="1000" step="0">0</defNumber>\n'
+                            '</defNumberVector>\n')
+    for u in range(updates):
+        d = u % devices
+        v = (u // devices) % vectors
+        messages.append(f'<setNumberVector device="device{d}" name="vector{v}" state="Ok" timestamp="{timestamp}">\n'
+                        f'  <oneNumber name="x">{u % 1000}.5</oneNumber>\n'
+                        f'  <oneNumber name="y">{u % 997}.25</oneNumber>\n'
+                        '</setNumberVector>\n')
+    return "".join(messages).encode(), len(messages)
+
+
+def make_mixed_traffic(repeats=50):
+    """Returns bytes of INDI traffic containing each type of message, with
+       escaped text, empty members, BLOBs and some malformed data, which
+       the parser backends should skip in the same way"""
+    timestamp = datetime.now(tz=timezone.utc).replace(tzinfo=None).isoformat(sep='T')
+    blob = base64.standard_b64encode(bytes(range(256))*4).decode()
+    messages = []
+    for r in range(repeats):
+        messages.append(f'<defSwitchVector device="dev" name="switch{r}" label="Switch &amp; things" group="g" state="Idle" perm="rw" rule="OneOfMany" timeout="0" timestamp="{timestamp}">'
+                        '<defSwitch name="on" label="On">On</defSwitch><defSwitch name="off">\n  Off\n</defSwitch></defSwitchVector>\n')
+        messages.append(f'<defTextVector device="dev" name="text{r}" perm="rw" state="Ok">'
+                        '<defText name="a">&lt;text&gt; &#65;</defText><defText name="b"></defText></defTextVector>')
+        messages.append(f'<defLightVector device="dev" name="light{r}" state="Alert"><defLight name="l">Busy</defLight></defLightVector>')
+        messages.append(f'<defBLOBVector device="dev" name="blob{r}" perm="ro" state="Idle"><defBLOB name="b" /></defBLOBVector>')
+        messages.append(f'<setTextVector device="dev" name="text{r}" timestamp="{timestamp}">'
+                        f'<oneText name="a">update {r}</oneText><oneText name="b" /></setTextVector>')
+        messages.append(f'<setBLOBVector device="dev" name="blob{r}" state="Ok"><oneBLOB name="b" size="1024" format=".bin">'
+                        f'{blob[:200]}\n{blob[200:]}</oneBLOB></setBLOBVector>')
+        messages.append(f'<message device="dev" message="note {r}" timestamp="{timestamp}"/>')
+        if r % 5 == 0:
+            # malformed data, a truncated message followed by an invalid tag
+            messages.append('<setTextVector device="dev" name="broken"><oneText name="a">no end')
+            messages.append('<<bad attr=>')
+        messages.append(f'<delProperty device="dev" name="light{r}"/>\n')
+    messages.append('<getProperties version="1.7"/>')
+    return "".join(messages).encode()
+
+
+def _parsed(parser, data, blocksize):
+    "Feed data to the parser in blocks, returns the messages parsed, as bytes"
+    parsed = []
+    for index in range(0, len(data), blocksize):
+        for element in parser.feed(data[index:index+blocksize]):
+            if isinstance(element, Record):
+                element = element.element()
+            # whitespace following the element is not part of the message
+            element.tail = None
+            parsed.append(ET.tostring(element))
+    return parsed
+
+
+def conformance(data, blocksizes=(1, 7, 100, 65536)):
+    """Parses data with the pullparser backend as reference, and the expat backend, each fed
+       with several block sizes, returns a list of (blocksize, index) of any messages which
+       differ from the reference, together with the number of reference messages"""
+    reference = _parsed(PullParser(), data, len(data))
+    failures = []
+    for blocksize in blocksizes:
+        for parsertype in (PullParser, ExpatParser):
+            parsed = _parsed(parsertype(), data, blocksize)
+            for index in range(max(len(parsed), len(reference))):
+                if index >= len(parsed) or index >= len(reference) or parsed[index] != reference[index]:
+                    failures.append((parsertype.__name__, blocksize, index))
+                    break
+    return failures, len(reference)
+
+
+async def _framing(data, count):
+    "Parse data with the default framing receive engine, returns the number of messages parsed"
+    client = IPyClient()
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    client._reader = reader
+    client._blobsink = BLOBSink(client)
+    # any object other than None indicates a connection
+    client._writer = object()
+    parsed = 0
+    for _ in range(count):
+        if await client._xmlinput() is None:
+            break
+        parsed += 1
+    client._writer = None
+    return parsed
+
+
+def bench_framing(data, count):
+    "Returns (seconds, messages parsed) for the framing receive engine"
+    start = time.perf_counter()
+    parsed = asyncio.run(_framing(data, count))
+    return time.perf_counter() - start, parsed
+
+
+def bench_pullparser(data, blocksize=65536, parsertype=PullParser):
+    "Returns (seconds, messages parsed) for the pullparser receive engine"
+    start = time.perf_counter()
+    parser = parsertype()
+    parsed = 0
+    for index in range(0, len(data), blocksize):
+        parsed += len(parser.feed(data[index:index+blocksize]))
+    return time.perf_counter() - start, parsed
+
+
+def bench_expat(data, blocksize=65536):
+    "Returns (seconds, messages parsed) for the expat receive engine"
+    return bench_pullparser(data, blocksize, ExpatParser)
+
+
+async def _events(elements, lazy):
+    "Apply the parsed elements to a client, creating events, returns the number of events"
+    client = IPyClient()
+    client.lazytimestamps = lazy
+    for element in elements:
+        await client._rxapply(element)
+    return len(elements)
+
+
+def bench_events(data, lazy=False):
+    """Returns (seconds, events created) for creating events from the parsed data,
+       and applying them to the vectors, with lazy timestamps if lazy is True"""
+    elements = ExpatParser().feed(data)
+    start = time.perf_counter()
+    created = asyncio.run(_events(elements, lazy))
+    return time.perf_counter() - start, created
+
+
+def _uncached_timestamp(timestamp_string):
+    "The timestamp parser previously used, parsing the whole string for every event, kept for comparison"
+    if timestamp_string:
+        try:
+            if '.' in timestamp_string:
+                timestamp_string, remainder = timestamp_string.rsplit('.', maxsplit=1)
+                if len(remainder) < 6:
+                    remainder = "{:<06}".format(remainder)
+                elif len(remainder) > 6:
+                    remainder = remainder[:6]
+                remainder = int(remainder)
+                timestamp = datetime.fromisoformat(timestamp_string)
+                timestamp = timestamp.replace(microsecond=remainder, tzinfo=timezone.utc)
+            else:
+                timestamp = datetime.fromisoformat(timestamp_string)
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+        except Exception:
+            timestamp = datetime.now(tz=timezone.utc)
+    else:
+        timestamp = datetime.now(tz=timezone.utc)
+    return timestamp
+
+
+def make_timestamps(rate=10000, seconds=5):
+    "Returns a list of timestamp strings, as sent by a server at rate events per second"
+    start = datetime.now(tz=timezone.utc).replace(tzinfo=None, microsecond=0)
+    return [(start + timedelta(seconds=n/rate)).isoformat(sep='T', timespec='milliseconds') for n in range(rate*seconds)]
+
+
+def bench_timestamps(timestamps):
+    """Returns a list of (name, microseconds per event) for the uncached and cached timestamp parsers,
+       and for lazy timestamps, which are kept as strings until accessed"""
+    results = []
+    for name, parser in (("uncached", _uncached_timestamp), ("cached", _parse_timestamp)):
+        start = time.perf_counter()
+        for timestamp in timestamps:
+            parser(timestamp)
+        results.append((name, (time.perf_counter() - start) * 1e6 / len(timestamps)))
+    # a lazy timestamp is only tested for truth when received
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        if timestamp:
+            pass
+    results.append(("lazy", (time.perf_counter() - start) * 1e6 / len(timestamps)))
+    return results
+
+
+# definitions of vectors whose names, when sent, need escaping
+_TEMPLATEDEFS = ('<defSwitchVector device="Mount &amp; &quot;Guider&quot;" name="TRACK&lt;1&gt;" state="Idle" perm="rw" rule="AnyOfMany">'
+                 '<defSwitch name="ON">Off</defSwitch><defSwitch name="OFF">On</defSwitch><defSwitch name="caf\u00e9 new">Off</defSwitch>'
+                 '</defSwitchVector>',
+                 '<defTextVector device="Mount &amp; &quot;Guider&quot;" name="SITE" state="Idle" perm="rw">'
+                 '<defText name="NAME">Obs</defText><defText name="NOTE"></defText><defText name="\u00e9&amp;&gt;">x</defText>'
+                 '</defTextVector>',
+                 '<defNumberVector device="Mount &amp; &quot;Guider&quot;" name="GUIDE" state="Idle" perm="rw">'
+                 '<defNumber name="RA" format="%.6f" min="-10" max="10" step="0">0</defNumber>'
+                 '<defNumber name="DEC" format="%.6f" min="-10" max="10" step="0">0</defNumber>'
+                 '</defNumberVector>',
+                 '<defBLOBVector device="Mount &amp; &quot;Guider&quot;" name="UPLOAD&amp;1" state="Idle" perm="rw">'
+                 '<defBLOB name="IMAGE" /><defBLOB name="caf\u00e9" />'
+                 '</defBLOBVector>')
+
+# member values sent to each vector
+_TEMPLATEVALUES = {"SwitchVector":({}, {"ON":"On"}, {"OFF":"Off", "ON":"On", "caf\u00e9 new":"On"}, {"ON":"maybe", "unknown":"On"}),
+                   "TextVector":({}, {"NAME":"a & b <c> \"d\" 'e'"}, {"NOTE":"", "NAME":"\u00e9\u6f22\r\n\t"}, {"\u00e9&>":"]]>"}),
+                   "NumberVector":({}, {"RA":1.25}, {"RA":-0.000001, "DEC":"12:30:45"}, {"DEC":3, "RA":""})}
+
+
+def _templatevectors():
+    "Returns a list of a switch, text, number and BLOB vector, defined from _TEMPLATEDEFS"
+    client = IPyClient()
+    device = Device("Mount & \"Guider\"", client)
+    vectors = []
+    for definition in _TEMPLATEDEFS:
+        event = device.rxvector(ET.fromstring(definition))
+        vectors.append(event.vector)
+    return vectors
+
+
+def template_conformance():
+    """Returns (failures, count) comparing new vectors rendered from vector templates, with
+       ET.tostring of the new vectors created with ElementTree, failures is a list of
+       (vectortype, members) which differ"""
+    timestamp = datetime(2024, 6, 1, 12, 30, 45, 123456)
+    builders = {"SwitchVector":("_newSwitchVector", "_newSwitchBytes"),
+                "TextVector":("_newTextVector", "_newTextBytes"),
+                "NumberVector":("_newNumberVector", "_newNumberBytes")}
+    failures = []
+    count = 0
+    for vector in _templatevectors():
+        if vector.vectortype == "BLOBVector":
+            continue
+        xmlbuilder, bytesbuilder = builders[vector.vectortype]
+        for members in _TEMPLATEVALUES[vector.vectortype]:
+            for sendtime in (timestamp, timestamp.replace(microsecond=0)):
+                count += 1
+                expected = ET.tostring(getattr(vector, xmlbuilder)(sendtime, members))
+                if getattr(vector, bytesbuilder)(sendtime, members) != expected:
+                    failures.append((vector.vectortype, members))
+    return failures, count
+
+
+def blob_conformance():
+    """Returns (failures, count) comparing newBLOBVectors as streamed, from the xml parts and the chunks of
+       encoded contents, with ET.tostring of the newBLOBVectors created with ElementTree, failures is a list
+       of the content lengths which differ"""
+    vector = _templatevectors()[3]
+    timestamp = datetime(2024, 6, 1, 12, 30, 45, 123456)
+    failures = []
+    count = 0
+    # lengths around the chunk size, and with each remainder modulo 3
+    for length in (1, 2, 3, 4, BLOBSource.CHUNKSIZE-1, BLOBSource.CHUNKSIZE, BLOBSource.CHUNKSIZE*2+1):
+        content = bytes(n % 251 for n in range(length))
+        members = {"IMAGE":(content, length, ".fits"), "caf\u00e9":(b"<&>", 0, "")}
+        expected = ET.tostring(vector._newBLOBVector(timestamp, members))
+        sources = [BLOBSource(content), BLOBSource(b"<&>")]
+        parts = vector._newBLOBParts(timestamp.isoformat(sep='T'), {"IMAGE":(length, ".fits"), "caf\u00e9":(3, "")})
+        streamed = [parts[0]]
+        for source, part in zip(sources, parts[1:]):
+            while chunk := source.read():
+                streamed.append(chunk)
+            streamed.append(part)
+        count += 1
+        if b''.join(streamed) != expected:
+            failures.append(length)
+    return failures, count
+
+
+class _CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+
+    "Counts the calls submitted to it"
+
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.count = 0
+
+    def submit(self, *args, **kwargs):
+        self.count += 1
+        return super().submit(*args, **kwargs)
+
+
+async def _blobreceive(port, engine, blobs, timeout, settings):
+    """Runs a client, with attributes set from the settings dictionary, against the FakeServer
+       until blobs setBLOBVectors are received, returns the SetBLOB events"""
+    received = []
+
+    class BLOBClient(IPyClient):
+
+        async def rxevent(self, event):
+            if event.eventtype == "SetBLOB":
+                received.append(event)
+                if len(received) == blobs:
+                    self.shutdown()
+
+    client = BLOBClient(indihost="127.0.0.1", indiport=port)
+    client.set_receive_engine(engine)
+    for name, value in settings.items():
+        setattr(client, name, value)
+    try:
+        await asyncio.wait_for(client.asyncrun(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    return received
+
+
+def _blobcontent(value, options):
+    "Returns the bytes of a received BLOB value, or None if it is not of the type given by the client options"
+    if "BLOBmemoryview" in options:
+        return bytes(value) if isinstance(value, memoryview) else None
+    if "BLOBstreaming" in options:
+        return value.read() if isinstance(value, BLOBFile) else None
+    return value if isinstance(value, bytes) else None
+
+
+def blob_receive_conformance(blobsize=200000, blobs=3, timeout=20):
+    """Returns (failures, count) receiving setBLOBVectors from the FakeServer with each receive engine,
+       and with the client BLOB options, checking the type and value of each event, and of the vector
+       member, against the content sent, failures is a list of (engine, options, description)"""
+    content = (bytes(range(256)) * (blobsize // 256 + 1))[:blobsize]
+    failures = []
+    count = 0
+    for engine in ("framing", "pullparser", "expat"):
+        # options name, and a function given a folder returning the client attributes to set
+        for options, settings in (("default", lambda folder: {}),
+                                  ("BLOBexecutor", lambda folder: {"BLOBexecutor":_CountingExecutor()}),
+                                  ("BLOBmemoryview", lambda folder: {"BLOBmemoryview":True}),
+                                  ("BLOBfolder BLOBmemoryview", lambda folder: {"BLOBfolder":folder, "BLOBmemoryview":True}),
+                                  ("BLOBfolder BLOBstreaming", lambda folder: {"BLOBfolder":folder, "BLOBstreaming":True}),
+                                  ("BLOBfolder BLOBstreaming BLOBmemoryview",
+                                        lambda folder: {"BLOBfolder":folder, "BLOBstreaming":True, "BLOBmemoryview":True})):
+            with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as folder:
+                settings = settings(folder)
+                server = FakeServer(devices=1, vectors=1, updates=10, blobsize=blobsize, blobs=blobs)
+                port = server.start()
+                try:
+                    received = asyncio.run(_blobreceive(port, engine, blobs, timeout, settings))
+                finally:
+                    server.stop()
+                    if "BLOBexecutor" in settings:
+                        settings["BLOBexecutor"].shutdown()
+                count += 1
+                if len(received) != blobs:
+                    failures.append((engine, options, f"{len(received)} of {blobs} BLOBs received"))
+                    continue
+                if ("BLOBexecutor" in settings) and (settings["BLOBexecutor"].count < blobs):
+                    failures.append((engine, options, "BLOBs were not decoded in the executor"))
+                    continue
+                for event in received:
+                    member = event.vector.member("image")
+                    eventcontent = _blobcontent(event["image"], options)
+                    if eventcontent is None:
+                        failures.append((engine, options, f"event value is of type {type(event['image']).__name__}"))
+                    elif eventcontent != content:
+                        failures.append((engine, options, "event value differs from the content sent"))
+                    elif _blobcontent(member.membervalue, options) != content:
+                        failures.append((engine, options, "member value differs from the content sent"))
+                    elif ("BLOBfolder" in settings) and not (pathlib.Path(folder) / member.filename).is_file():
+                        failures.append((engine, options, "member filename is not a file in the BLOBfolder"))
+                    elif (member.blobsize, member.blobformat) != (blobsize, ".bin"):
+                        failures.append((engine, options, "member size and format differ from those sent"))
+                    else:
+                        continue
+                    break
+                # release any views of the saved files
+                received.clear()
+    return failures, count
+
+
+class _VirtualSelector:
+
+    "Wraps a selector, so when no events are ready, rather than waiting, the virtual clock of the loop moves on"
+
+    def __init__(self, loop, selector):
+        self._loop = loop
+        self._selector = selector
+
+    def select(self, timeout=None):
+        ready = self._selector.select(0)
+        if (not ready) and timeout:
+            self._loop.virtualtime += timeout
+        return ready
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class _VirtualLoop(asyncio.SelectorEventLoop):
+
+    "An event loop with a virtual clock, which moves straight to the next timer when nothing else is ready"
+
+    def __init__(self):
+        self.virtualtime = 0.0
+        super().__init__(_VirtualSelector(self, selectors.DefaultSelector()))
+
+    def time(self):
+        return self.virtualtime
+
+
+class _VirtualWriter:
+
+    "Used in place of an asyncio.StreamWriter, records the loop time of each message written, and of closing"
+
+    def __init__(self, reader):
+        self._reader = reader
+        # list of (loop time, tag)
+        self.written = []
+        self.closed = None
+
+    def write(self, data):
+        now = asyncio.get_running_loop().time()
+        for tag in (b'getProperties', b'enableBLOB', b'newNumberVector'):
+            if data.startswith(b'<' + tag):
+                self.written.append((now, tag.decode()))
+
+    def writelines(self, data):
+        for item in data:
+            self.write(item)
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return self.closed is not None
+
+    def close(self):
+        if self.closed is None:
+            self.closed = asyncio.get_running_loop().time()
+            self._reader.feed_eof()
+
+    async def wait_closed(self):
+        pass
+
+
+async def _keepalive(writers):
+    """Runs a client with an in-memory connection, which receives a definition 12 seconds after connecting,
+       and nothing further"""
+    client = IPyClient()
+    reader = asyncio.StreamReader()
+
+    async def connect():
+        writer = _VirtualWriter(reader)
+        writers.append(writer)
+        return reader, writer
+
+    async def define():
+        await asyncio.sleep(12)
+        reader.feed_data(b'<defNumberVector device="device0" name="vector0" state="Ok" perm="rw" timeout="1">'
+                         b'<defNumber name="x" format="%.2f" min="0" max="0" step="0">0</defNumber>'
+                         b'</defNumberVector>')
+        # wait for the connection to time out
+        while writers[0].closed is None:
+            await asyncio.sleep(1)
+        client.shutdown()
+
+    client._connector = connect
+    await asyncio.gather(client.asyncrun(), define())
+
+
+def keepalive_conformance(tolerance=0.001):
+    """Runs a client on an event loop with a virtual clock, and checks the getProperties retries every five seconds
+       while no devices are known, the getProperties sent after idle_timeout, and the connection closed after
+       respond_timeout, occur within tolerance seconds of their deadlines. Returns a list of failures, each
+       (description, expected time, actual time), and the number of timers checked."""
+    writers = []
+    loop = _VirtualLoop()
+    try:
+        loop.run_until_complete(_keepalive(writers))
+    finally:
+        loop.close()
+    # with default timeouts, idle_timeout is 20 and respond_timeout 40 seconds. Retries are sent at 0, 5 and 10
+    # seconds, a definition is received at 12, so the connection is idle at 32, and again at 52, and as the
+    # getProperties at 32 receives no response, the connection times out at 72
+    expected = [(0.0, "getProperties"), (5.0, "getProperties"), (10.0, "getProperties"),
+                (32.0, "getProperties"), (52.0, "getProperties")]
+    failures = []
+    written = writers[0].written
+    for index, (seconds, tag) in enumerate(expected):
+        if index >= len(written):
+            failures.append((f"{tag} not sent", seconds, None))
+        elif written[index][1] != tag:
+            failures.append((f"{written[index][1]} sent in place of {tag}", seconds, written[index][0]))
+        elif abs(written[index][0] - seconds) > tolerance:
+            failures.append((f"{tag} sent", seconds, written[index][0]))
+    if len(written) > len(expected):
+        failures.append((f"unexpected {written[len(expected)][1]}", None, written[len(expected)][0]))
+    closed = writers[0].closed
+    if (closed is None) or (abs(closed - 72.0) > tolerance):
+        failures.append(("connection timed out", 72.0, closed))
+    return failures, len(expected) + 1
+
+
+def bench_templates(count=100000):
+    """Returns a list of (name, microseconds per send) for creating the bytes of a newNumberVector
+       of two members with ElementTree, and with the vector template"""
+    vector = _templatevectors()[2]
+    timestamp = datetime.now(tz=timezone.utc)
+    results = []
+    start = time.perf_counter()
+    for n in range(count):
+        ET.tostring(vector._newNumberVector(timestamp, {"RA":n*1e-6, "DEC":-n*1e-6}))
+    results.append(("ElementTree", (time.perf_counter() - start) * 1e6 / count))
+    start = time.perf_counter()
+    for n in range(count):
+        vector._newNumberBytes(timestamp, {"RA":n*1e-6, "DEC":-n*1e-6})
+    results.append(("template", (time.perf_counter() - start) * 1e6 / count))
+    return results
+
+
+class _CountingClient(IPyClient):
+
+    "Counts the events received"
+
+    def __init__(self, **clientdata):
+        super().__init__(**clientdata)
+        self.count = 0
+
+    async def rxevent(self, event):
+        self.count += 1
+
+
+async def _replay(path, engine):
+    "Replays the recording at maximum speed into a client, returns (seconds, events)"
+    replayer = Replayer(path, speed=None)
+    client = _CountingClient()
+    client.set_receive_engine(engine)
+    replayer.attach(client)
+    start = time.perf_counter()
+    running = asyncio.create_task(client.asyncrun())
+    await replayer.finished.wait()
+    # the client does not report when the data is handled, so wait until events stop arriving
+    count = -1
+    while count != client.count:
+        count = client.count
+        finished = time.perf_counter()
+        await asyncio.sleep(0.02)
+    client.shutdown()
+    await running
+    return finished - start, count
+
+
+def bench_replay(path, engine="framing"):
+    """Returns (seconds, events) for a client with the given receive engine to
+       handle the received data of a recording made with IPyClient.record_session"""
+    return asyncio.run(_replay(path, engine))
+
+
+def _benchclass(clientclass):
+    "Returns a subclass of clientclass, which measures the events received"
+
+    class BenchClient(clientclass):
+
+        def __init__(self, updates, blobs, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # the number of updates and BLOBs expected
+            self.expected = (updates, blobs)
+            self.updates = 0
+            self.blobs = 0
+            self.events = 0
+            self.latencies = []
+            self.started = None
+            self.finished = None
+
+        async def rxevent(self, event):
+            await super().rxevent(event)
+            if self.started is None:
+                self.started = time.perf_counter()
+            self.events += 1
+            if event.eventtype == "Set":
+                self.latencies.append(time.perf_counter() - float(event["sent"]))
+                self.updates += 1
+            elif event.eventtype == "SetBLOB":
+                self.blobs += 1
+            else:
+                return
+            if "rxque" in self.clientdata:
+                # discard the QueClient items, as no consumer is running
+                self.clientdata["rxque"].clear()
+            if (self.updates, self.blobs) == self.expected:
+                self.finished = time.perf_counter()
+                self.shutdown()
+
+    return BenchClient
+
+
+async def _looplag(lags, interval=0.005):
+    "Appends to lags the lateness in seconds of each wake up from asyncio.sleep(interval)"
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+
+
+async def _load(clientclass, engine, port, updates, blobs, timeout, blobexecutor=None):
+    "Runs a client against the FakeServer, with BLOBs decoded in blobexecutor if given, returns the client"
+    benchclass = _benchclass(clientclass)
+    if clientclass is QueClient:
+        client = benchclass(updates, blobs, collections.deque(), collections.deque(), indihost="127.0.0.1", indiport=port)
+    else:
+        client = benchclass(updates, blobs, indihost="127.0.0.1", indiport=port)
+    client.set_receive_engine(engine)
+    client.BLOBexecutor = blobexecutor
+    lags = []
+    monitor = asyncio.create_task(_looplag(lags))
+    try:
+        await asyncio.wait_for(client.asyncrun(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        monitor.cancel()
+    client.lags = lags
+    return client
+
+
+def _percentiles(values):
+    "Returns the 50th, 95th and 99th percentiles of values, in milliseconds"
+    if len(values) < 2:
+        return (0.0, 0.0, 0.0)
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return (cuts[49]*1000, cuts[94]*1000, cuts[98]*1000)
+
+
+def bench_load(clientclass=IPyClient, engine="framing", devices=4, vectors=8, updates=20000, rate=0,
+               blobsize=0, blobs=0, floods=0, timeout=60, trace=False, blobexecutor=False):
+    """Runs the client class, IPyClient or QueClient, with the given receive engine against a FakeServer
+       with the given load, and returns a dictionary of results. If trace is True, the memory peak is
+       measured with tracemalloc, which slows the run, otherwise it is the process peak resident size.
+       If blobexecutor is True, received BLOBs are decoded in a ThreadPoolExecutor, set as the client BLOBexecutor.
+       messages_per_second is the rate of events received by the client, bytes_per_second is the
+       data sent by the server over the same time, which is the data received by a complete run."""
+    server = FakeServer(devices, vectors, updates, rate, blobsize, blobs, floods)
+    port = server.start()
+    if trace:
+        tracemalloc.start()
+    executor = concurrent.futures.ThreadPoolExecutor() if blobexecutor else None
+    try:
+        client = asyncio.run(_load(clientclass, engine, port, updates, server.blobs, timeout, executor))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if trace:
+            memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        server.stop()
+    if not trace:
+        if resource is None:
+            memory = 0
+        else:
+            # ru_maxrss is in kilobytes on Linux
+            memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    complete = client.finished is not None
+    seconds = (client.finished or time.perf_counter()) - (client.started or time.perf_counter())
+    seconds = max(seconds, 1e-9)
+    return {"client": clientclass.__name__,
+            "engine": engine,
+            "complete": complete,
+            "events": client.events,
+            "seconds": seconds,
+            "messages_per_second": client.events / seconds,
+            "bytes_per_second": server.bytes_sent / seconds,
+            "latency": _percentiles(client.latencies),
+            "looplag": _percentiles(client.lags) + (max(client.lags, default=0.0)*1000,),
+            "memory": memory}
+
+
+async def _priority(port, priority, blobsize, uploads):
+    """Queues uploads BLOBs to the FakeServer, then sends an abort at the given priority,
+       and returns the time.perf_counter() value when the abort was sent"""
+    client = IPyClient(indihost="127.0.0.1", indiport=port)
+    client.set_tx_priority("device0", "abort", priority)
+    run = asyncio.create_task(client.asyncrun())
+    try:
+        while ("device0" not in client) or ("upload" not in client["device0"]) or ("abort" not in client["device0"]):
+            await asyncio.sleep(0.01)
+        content = bytes(range(256)) * (blobsize // 256)
+        sends = [asyncio.create_task(client.send_newVector("device0", "upload", members={"file":(content, 0, ".bin")}))
+                 for upload in range(uploads)]
+        # allow the uploads to be queued
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        await client.send_newVector("device0", "abort", members={"stop":"On"})
+        await asyncio.gather(*sends)
+        # allow the server to read everything
+        while client.txbuffered:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+    finally:
+        client.shutdown()
+        await run
+    return start
+
+
+def bench_priority(blobsize=16000000, uploads=4, timeout=60):
+    """Returns a list of (priority, abort seconds, uploads seconds, uploads ahead), for an abort sent
+       at priorities "bulk" and "control", while uploads BLOBs of blobsize bytes are queued. The seconds
+       are from sending the abort, to the abort arriving at the FakeServer, and to the last upload arriving,
+       and uploads ahead is the number of uploads which arrived before the abort."""
+    results = []
+    for priority in ("bulk", "control"):
+        server = FakeServer(devices=1, vectors=1, updates=0, uploads=True)
+        port = server.start()
+        try:
+            start = asyncio.run(asyncio.wait_for(_priority(port, priority, blobsize, uploads), timeout))
+        finally:
+            server.stop()
+        arrivals = server.arrivals
+        abort = [seconds for seconds, vectortype in arrivals if vectortype == "Switch"]
+        blobs = [seconds for seconds, vectortype in arrivals if vectortype == "BLOB"]
+        if not abort or (len(blobs) != uploads):
+            raise RuntimeError(f"The FakeServer received {len(abort)} aborts and {len(blobs)} uploads")
+        # the arrivals are in the order received
+        ahead = [vectortype for seconds, vectortype in arrivals].index("Switch")
+        results.append((priority, abort[0] - start, max(blobs) - start, ahead))
+    return results
+
+
+def _lifecycleclass(clientclass):
+    "Returns a subclass of clientclass, which records the time of each connection made"
+
+    class LifecycleClient(clientclass):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # time.perf_counter() of each ConnectionMade event
+            self.connections = []
+            self.connected_event = asyncio.Event()
+
+        async def rxevent(self, event):
+            await super().rxevent(event)
+            if "rxque" in self.clientdata:
+                # discard the QueClient items, as no consumer is running
+                self.clientdata["rxque"].clear()
+            if event.eventtype == "ConnectionMade":
+                self.connections.append(time.perf_counter())
+                self.connected_event.set()
+
+    return LifecycleClient
+
+
+def _lifecycleclient(clientclass, queuetype, port):
+    "Returns a client of clientclass, a QueClient having queues of queuetype"
+    lifecycleclass = _lifecycleclass(clientclass)
+    if clientclass is QueClient:
+        return lifecycleclass(queuetype(), collections.deque(), indihost="127.0.0.1", indiport=port)
+    return lifecycleclass(indihost="127.0.0.1", indiport=port)
+
+
+async def _shutdown(clientclass, queuetype, port, state):
+    """Runs a client until its connection_state is the given state, then shuts it down,
+       and returns (seconds, processor seconds) taken from the shutdown call to asyncrun ending"""
+    client = _lifecycleclient(clientclass, queuetype, port)
+    client.set_reconnect(60)
+    run = asyncio.create_task(client.asyncrun())
+    while client.connection_state != state:
+        await asyncio.sleep(0.01)
+    # let the client settle into the state
+    await asyncio.sleep(0.2)
+    cpu = time.process_time()
+    start = time.perf_counter()
+    client.shutdown()
+    await run
+    return time.perf_counter() - start, time.process_time() - cpu
+
+
+async def _stalled(port, blobsize):
+    """Runs a client, sends a BLOB of blobsize bytes to a FakeServer which has stopped reading, then shuts
+       the client down, and returns (seconds, processor seconds) taken from the shutdown call to asyncrun ending"""
+    client = _lifecycleclient(IPyClient, None, port)
+    run = asyncio.create_task(client.asyncrun())
+    while ("device0" not in client) or ("upload" not in client["device0"]):
+        await asyncio.sleep(0.01)
+    content = bytes(blobsize)
+    send = asyncio.create_task(client.send_newVector("device0", "upload", members={"file":(content, 0, ".bin")}))
+    # let the connection buffers fill
+    await asyncio.sleep(0.5)
+    cpu = time.process_time()
+    start = time.perf_counter()
+    client.shutdown()
+    await run
+    seconds, cpu = time.perf_counter() - start, time.process_time() - cpu
+    await send
+    return seconds, cpu
+
+
+async def _reconnect(port, server):
+    """Runs a client, drops its connection from the FakeServer, and returns (seconds, processor seconds)
+       taken from the connection being dropped to the client reconnecting"""
+    client = _lifecycleclient(IPyClient, None, port)
+    client.set_reconnect(0.001)
+    run = asyncio.create_task(client.asyncrun())
+    try:
+        await client.connected_event.wait()
+        client.connected_event.clear()
+        await asyncio.sleep(0.2)
+        cpu = time.process_time()
+        start = time.perf_counter()
+        server.disconnect()
+        await client.connected_event.wait()
+        return client.connections[-1] - start, time.process_time() - cpu
+    finally:
+        client.shutdown()
+        await run
+
+
+def bench_lifecycle(timeout=60):
+    """Returns a list of (description, seconds, processor seconds), for clients shut down while connected,
+       while the server has stopped reading, and while waiting to reconnect, and for a client reconnecting after the connection is dropped"""
+    results = []
+    server = FakeServer(devices=1, vectors=1, updates=0)
+    port = server.start()
+    try:
+        for clientclass, queuetype in ((IPyClient, None), (QueClient, collections.deque), (QueClient, asyncio.Queue)):
+            name = clientclass.__name__
+            if queuetype is not None:
+                name += f"({queuetype.__name__})"
+            seconds, cpu = asyncio.run(asyncio.wait_for(_shutdown(clientclass, queuetype, port, "connected"), timeout))
+            results.append((f"{name} shutdown while connected", seconds, cpu))
+        seconds, cpu = asyncio.run(asyncio.wait_for(_reconnect(port, server), timeout))
+        results.append(("IPyClient reconnect after the connection is dropped", seconds, cpu))
+    finally:
+        server.stop()
+    server = FakeServer(devices=1, vectors=1, updates=0, uploads=True, stalled=True)
+    port = server.start()
+    try:
+        seconds, cpu = asyncio.run(asyncio.wait_for(_stalled(port, 50000000), timeout))
+        results.append(("IPyClient shutdown while the server has stopped reading", seconds, cpu))
+    finally:
+        server.stop()
+    # the port is now closed, so connections are refused, and the clients wait to reconnect
+    for clientclass, queuetype in ((IPyClient, None), (QueClient, asyncio.Queue)):
+        name = clientclass.__name__
+        if queuetype is not None:
+            name += f"({queuetype.__name__})"
+        seconds, cpu = asyncio.run(asyncio.wait_for(_shutdown(clientclass, queuetype, port, "waiting"), timeout))
+        results.append((f"{name} shutdown while waiting to reconnect", seconds, cpu))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m indipyclient.bench",
+                                     description="Benchmarks indipyclient against an in-process stand-in INDI server.")
+    parser.add_argument("--devices", type=int, default=4, help="Number of devices.")
+    parser.add_argument("--vectors", type=int, default=8, help="Number of number vectors per device.")
+    parser.add_argument("--updates", type=int, default=20000, help="Number of setNumberVector messages.")
+    parser.add_argument("--rate", type=int, default=0, help="Updates per second, zero for as fast as possible.")
+    parser.add_argument("--blobsize", type=int, default=0, help="Size in bytes of each BLOB sent.")
+    parser.add_argument("--blobs", type=int, default=0, help="Number of BLOBs sent during the updates.")
+    parser.add_argument("--floods", type=int, default=0, help="Number of further floods of definitions sent during the updates.")
+    parser.add_argument("--engine", choices=("framing", "pullparser", "expat"), action="append",
+                        help="Receive engine to run, may be repeated, default all.")
+    parser.add_argument("--client", choices=("IPyClient", "QueClient"), action="append",
+                        help="Client to run, may be repeated, default both.")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds allowed for each run.")
+    parser.add_argument("--blobexecutor", action="store_true", help="Decode received BLOBs in a ThreadPoolExecutor, set as the client BLOBexecutor.")
+    parser.add_argument("--tracemalloc", action="store_true", help="Measure the memory peak with tracemalloc, which slows the runs.")
+    parser.add_argument("--micro", action="store_true", help="Run the parser, event and timestamp micro-benchmarks instead.")
+    parser.add_argument("--blocksize", type=int, default=65536, help="Block size read by the pullparser and expat engines in the micro-benchmarks.")
+    parser.add_argument("--replay", help="Path of a recording, made with IPyClient.record_session, to replay into each receive engine.")
+    parser.add_argument("--priority", action="store_true",
+                        help="Measure the latency of an abort sent while BLOB uploads are queued, using --blobsize and --blobs, default 16MB and 4.")
+    parser.add_argument("--lifecycle", action="store_true",
+                        help="Measure the time and processor time taken to shut down, and to reconnect.")
+    args = parser.parse_args()
+
+    if args.lifecycle:
+        failed = False
+        for description, seconds, cpu in bench_lifecycle(args.timeout):
+            print(f"{description:>55}: {seconds*1000:7.2f}ms, processor {cpu*1000:7.2f}ms")
+            if description.endswith("reconnect after the connection is dropped"):
+                continue
+            if seconds > 0.05:
+                failed = True
+        if failed:
+            print("FAILED: a shutdown took more than 50ms")
+            sys.exit(1)
+        return
+
+    if args.priority:
+        blobsize = args.blobsize or 16000000
+        uploads = args.blobs or 4
+        print(f"Abort sent while {uploads} uploads of {blobsize} bytes are queued")
+        for priority, abort, total, ahead in bench_priority(blobsize, uploads, args.timeout):
+            print(f"{priority:>10}: abort arrived in {abort*1000:.1f}ms, after {ahead} uploads, "
+                  f"all uploads arrived in {total*1000:.1f}ms")
+        return
+
+    if not (args.micro or args.replay):
+        engines = args.engine or ("framing", "pullparser", "expat")
+        clients = args.client or ("IPyClient", "QueClient")
+        print(f"FakeServer: {args.devices} devices x {args.vectors} vectors, {args.updates} updates at "
+              f"{args.rate or 'maximum'} per second, {args.blobs} BLOBs of {args.blobsize} bytes, {args.floods} floods")
+        failed = False
+        for clientname in clients:
+            clientclass = QueClient if clientname == "QueClient" else IPyClient
+            for engine in engines:
+                result = bench_load(clientclass, engine, args.devices, args.vectors, args.updates, args.rate,
+                                    args.blobsize, args.blobs, args.floods, args.timeout, args.tracemalloc, args.blobexecutor)
+                status = "" if result["complete"] else " INCOMPLETE"
+                failed = failed or not result["complete"]
+                print(f"{result['client']:>10} {result['engine']:>10}:{status} {result['events']} events in {result['seconds']:.3f}s, "
+                      f"{result['messages_per_second']:.0f} msg/s, {result['bytes_per_second']/1e6:.2f} MB/s\n"
+                      f"{'':>22}latency ms p50 {result['latency'][0]:.2f} p95 {result['latency'][1]:.2f} p99 {result['latency'][2]:.2f}, "
+                      f"loop lag ms p99 {result['looplag'][2]:.2f} max {result['looplag'][3]:.2f}, "
+                      f"memory peak {result['memory']/1e6:.1f} MB")
+        if failed:
+            sys.exit(1)
+        return
+
+    if args.replay:
+        for engine in ("framing", "pullparser", "expat"):
+            seconds, count = bench_replay(args.replay, engine)
+            print(f"{engine:>12}: {count} events in {seconds:.3f}s, {count/seconds:.0f} events/s")
+        return
+
+    data, count = make_traffic(args.devices, args.vectors, args.updates)
+    print(f"Parsing {count} messages, {len(data)} bytes")
+    for name, (seconds, parsed) in (("framing", bench_framing(data, count)),
+                                    ("pullparser", bench_pullparser(data, args.blocksize)),
+                                    ("expat", bench_expat(data, args.blocksize))):
+        print(f"{name:>12}: {parsed} messages in {seconds:.3f}s, {parsed/seconds:.0f} messages/s")
+
+    for name, (seconds, created) in (("events", bench_events(data)),
+                                     ("lazy stamps", bench_events(data, lazy=True))):
+        print(f"{name:>12}: {created} events in {seconds:.3f}s, {created/seconds:.0f} events/s")
+
+    rate = args.rate or 10000
+    timestamps = make_timestamps(rate)
+    print(f"Parsing {len(timestamps)} timestamps, at {rate} events per second")
+    results = bench_timestamps(timestamps)
+    uncached = results[0][1]
+    for name, microseconds in results:
+        print(f"{name:>12}: {microseconds:.3f}us per event, {microseconds*rate/1e4:.2f}% of one core, "
+              f"saving {uncached-microseconds:.3f}us per event")
+
+    print("Creating newNumberVector bytes")
+    for name, microseconds in bench_templates():
+        print(f"{name:>12}: {microseconds:.3f}us per send")
+
+    failures, count = conformance(make_mixed_traffic())
+    if failures:
+        for parsertype, blocksize, index in failures:
+            print(f"Conformance failure: {parsertype} with blocksize {blocksize} differs at message {index}")
+        sys.exit(1)
+    print(f"Conformance: parser backends agree on {count} messages")
+
+    failures, count = template_conformance()
+    if failures:
+        for vectortype, members in failures:
+            print(f"Conformance failure: {vectortype} template differs from ElementTree sending {members}")
+        sys.exit(1)
+    print(f"Conformance: vector templates agree with ElementTree on {count} new vectors")
+
+    failures, count = blob_conformance()
+    if failures:
+        for length in failures:
+            print(f"Conformance failure: streamed newBLOBVector of {length} bytes differs from ElementTree")
+        sys.exit(1)
+    print(f"Conformance: streamed newBLOBVectors agree with ElementTree on {count} contents")
+
+    failures, count = blob_receive_conformance()
+    if failures:
+        for engine, options, description in failures:
+            print(f"Conformance failure: setBLOBVector received with the {engine} engine and {options} options, {description}")
+        sys.exit(1)
+    print(f"Conformance: setBLOBVectors received intact in {count} runs, of each receive engine with each set of BLOB options")
+
+    failures, count = keepalive_conformance()
+    if failures:
+        for description, expected, actual in failures:
+            print(f"Conformance failure: {description}, expected at {expected}s, actual {actual}s")
+        sys.exit(1)
+    print(f"Conformance: {count} keepalive timers fire within 1ms of their deadlines on a virtual clock")
+
+
+if __name__ == "__main__":
+    main()
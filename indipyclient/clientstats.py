@@ -0,0 +1,166 @@
+"""
+This module holds ClientStats, the counters and timers used by IPyClient when
+enabled with its set_stats method, and read with its stats method, and
+LatencyHistogram, which records the round trip times of new vectors sent.
+
+When disabled, the client holds None in place of a ClientStats, so the only cost
+on the hot path is a test of that attribute.
+"""
+
+import time, math
+
+
+# the stages measured, in the order data passes through the client
+STAGES = ("read", "framing", "parse", "event", "blobsave", "rxevent", "serialize", "drain")
+
+
+class LatencyHistogram:
+
+    """Counts round trip times, from a new vector being sent to the vector reply being received,
+       in buckets spaced logarithmically, BUCKETS to each doubling, from MINIMUM seconds. Percentiles
+       are given as the upper bound of the bucket holding them, so are within about 9% of the times recorded.
+       Timeouts, where no reply is received in time, are counted separately."""
+
+    MINIMUM = 0.0001
+    BUCKETS = 8
+
+    def __init__(self):
+        # list of counts, extended as longer times are recorded
+        self._counts = []
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.timeouts = 0
+
+    def add(self, seconds):
+        "Records a round trip time in seconds"
+        if seconds > self.MINIMUM:
+            index = int(math.log2(seconds / self.MINIMUM) * self.BUCKETS)
+        else:
+            index = 0
+        if index >= len(self._counts):
+            self._counts.extend([0] * (index + 1 - len(self._counts)))
+        self._counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def percentile(self, percent):
+        "Returns the round trip time in seconds below which the given percent of times lie, or None if no times are recorded"
+        if not self.count:
+            return
+        # the number of times at or below the percentile
+        rank = math.ceil(self.count * percent / 100)
+        cumulative = 0
+        for index, bucketcount in enumerate(self._counts):
+            cumulative += bucketcount
+            if cumulative >= rank:
+                break
+        # upper bound of the bucket, no more than the maximum recorded
+        return min(self.MINIMUM * 2 ** ((index + 1) / self.BUCKETS), self.maximum)
+
+    def snapshot(self):
+        """Returns a dictionary with keys "count", "mean", "max", "p50", "p95", "p99" and "timeouts",
+           the times being in seconds, and None if no times are recorded"""
+        return {"count":self.count,
+                "mean":self.total/self.count if self.count else None,
+                "max":self.maximum if self.count else None,
+                "p50":self.percentile(50),
+                "p95":self.percentile(95),
+                "p99":self.percentile(99),
+                "timeouts":self.timeouts}
+
+
+class ClientStats:
+
+    """Counters and timers for each stage of the client, and message counts for each device and vector.
+
+       |  read - each block of data read from the port, timed from the read starting, so including
+          any time waiting for the data to arrive, with the number of bytes
+       |  framing - splitting the data received into messages, with the framing receive engine
+       |  parse - parsing each message, or each block with the pullparser and expat receive engines
+       |  event - creating each event, and setting the received values into the vectors
+       |  blobsave - saving each received BLOB to a file, with the number of bytes
+       |  rxevent - each call to the rxevent method, or the rxevents method with a batch
+       |  serialize - converting each transmitted message to bytes, with the number of bytes
+       |  drain - waiting for the port to accept the transmitted messages, which are written together
+          when several are waiting, with the number of bytes
+
+       Round trip times of new vectors sent, and their timeouts, are recorded in a LatencyHistogram for each vector."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        "Clears all counts, and restarts the time since reset"
+        self._reset = time.monotonic()
+        # dictionary of stage to [count, seconds, bytes]
+        self._stages = {stage:[0, 0.0, 0] for stage in STAGES}
+        # dictionary of devicename to dictionary of vectorname to the number of messages received
+        self._devices = {}
+        # dictionary of (devicename, vectorname) to LatencyHistogram
+        self._latency = {}
+
+    def add(self, stage, seconds, nbytes=0):
+        "Adds one to the count of the stage, and the given seconds and bytes to its totals"
+        totals = self._stages[stage]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += nbytes
+
+    def received(self, devicename, vectorname):
+        "Counts a message received for the given device and vector, vectorname is None for a device message"
+        vectors = self._devices.get(devicename)
+        if vectors is None:
+            vectors = self._devices[devicename] = {}
+        vectors[vectorname] = vectors.get(vectorname, 0) + 1
+
+    def histogram(self, devicename, vectorname):
+        "Returns the LatencyHistogram of the given vector, creating it if it does not exist"
+        histogram = self._latency.get((devicename, vectorname))
+        if histogram is None:
+            histogram = self._latency[(devicename, vectorname)] = LatencyHistogram()
+        return histogram
+
+    def roundtrip(self, devicename, vectorname, seconds):
+        "Records the round trip time of a new vector sent, and the reply received"
+        self.histogram(devicename, vectorname).add(seconds)
+
+    def timedout(self, devicename, vectorname):
+        "Counts a new vector sent, which received no reply within its timeout"
+        self.histogram(devicename, vectorname).timeouts += 1
+
+    def latency(self, devicename, vectorname):
+        "Returns the LatencyHistogram snapshot dictionary of the given vector, or None if nothing has been sent"
+        histogram = self._latency.get((devicename, vectorname))
+        if histogram is None:
+            return
+        return histogram.snapshot()
+
+    def snapshot(self):
+        """Returns a dictionary of the current counts, with keys
+
+           |  "seconds" - the time since the stats were enabled or reset
+           |  "stages" - dictionary of stage name to a dictionary with keys "count", "seconds", "mean" and "bytes"
+           |  "devices" - dictionary of devicename to a dictionary with keys "messages", the total received
+              for the device, and "vectors", a dictionary of vectorname to the number received for that vector.
+              Messages not associated with a vector are counted with vectorname None.
+           |  "latency" - dictionary of devicename to a dictionary of vectorname to the LatencyHistogram snapshot
+              of round trip times, for each vector to which a new vector has been sent."""
+        stages = {}
+        for stage, (count, seconds, nbytes) in self._stages.items():
+            stages[stage] = {"count":count,
+                             "seconds":seconds,
+                             "mean":seconds/count if count else 0.0,
+                             "bytes":nbytes}
+        devices = {}
+        for devicename, vectors in self._devices.items():
+            devices[devicename] = {"messages":sum(vectors.values()), "vectors":dict(vectors)}
+        latency = {}
+        for (devicename, vectorname), histogram in self._latency.items():
+            latency.setdefault(devicename, {})[vectorname] = histogram.snapshot()
+        return {"seconds":time.monotonic() - self._reset,
+                "stages":stages,
+                "devices":devices,
+                "latency":latency}
@@ -11,34 +11,24 @@ import xml.etree.ElementTree as ET
 
 from . import propertyvectors
 
-from .propertymembers import ParseException, getfloat
+from .propertymembers import ParseException, getfloat, _parse_timestamp
 
+from .rxparser import Record
 
 
-def _parse_timestamp(timestamp_string):
-    """Parse a timestamp string and return a datetime object
-       If the given timestamp_string cannot be parsed, returns
-       the datetime for the current time. Everything is UTC"""
-    if timestamp_string:
+
+def decodeBLOBs(contents):
+    """Given a list of (membername, base64 text) tuples, returns a dictionary of
+       membername to decoded bytes, or to None if the text cannot be decoded.
+       This is used when BLOBs are decoded in an executor, so can be run in a
+       separate process."""
+    decoded = {}
+    for membername, text in contents:
         try:
-            if '.' in timestamp_string:
-                # remove fractional part, not supported by datetime.fromisoformat
-                timestamp_string, remainder = timestamp_string.rsplit('.', maxsplit=1)
-                if len(remainder) < 6:
-                    remainder = "{:<06}".format(remainder)
-                elif len(remainder) > 6:
-                    remainder = remainder[:6]
-                remainder = int(remainder)
-                timestamp = datetime.fromisoformat(timestamp_string)
-                timestamp = timestamp.replace(microsecond=remainder, tzinfo=timezone.utc)
-            else:
-                timestamp = datetime.fromisoformat(timestamp_string)
-                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            decoded[membername] = standard_b64decode(text.encode('ascii'))
         except Exception:
-            timestamp = datetime.now(tz=timezone.utc)
-    else:
-        timestamp = datetime.now(tz=timezone.utc)
-    return timestamp
+            decoded[membername] = None
+    return decoded
 
 
 class VectorTimeOut:
@@ -91,10 +81,40 @@ class Event:
         else:
             self.devicename = self.device.devicename
         self.root = root
-        self.timestamp = _parse_timestamp(root.get("timestamp"))
+        timestamp_string = root.get("timestamp")
+        if timestamp_string and client.lazytimestamps:
+            # keep the received string, parsed when the timestamp is accessed
+            self._timestamp = timestamp_string
+        else:
+            self._timestamp = _parse_timestamp(timestamp_string)
+
+    @property
+    def root(self):
+        """The received xml.etree.ElementTree element, with the expat receive engine
+           it is created from the received record when first accessed"""
+        if isinstance(self._root, Record):
+            self._root = self._root.element()
+        return self._root
+
+    @root.setter
+    def root(self, value):
+        self._root = value
+
+    @property
+    def timestamp(self):
+        if isinstance(self._timestamp, str):
+            self._timestamp = _parse_timestamp(self._timestamp)
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._timestamp = value
 
     def __str__(self):
-        return ET.tostring(self.root, encoding='unicode')
+        if isinstance(self._root, ET.Element):
+            return ET.tostring(self._root, encoding='unicode')
+        # a record created by the expat receive engine
+        return str(self._root)
 
 
 
@@ -492,6 +512,8 @@ class setVector(Event, UserDict):
         Event.__init__(self, root, device, client)
         UserDict.__init__(self)
         self.eventtype = "Set"
+        # if conflation is enabled, the number of earlier events for this vector this replaces
+        self.skipped = 0
         if self.devicename is None:
             raise ParseException("Missing device name in set vector")
         self.vectorname = root.get("name")
@@ -515,12 +537,50 @@ class setVector(Event, UserDict):
     def __setitem__(self, membername, value):
         raise KeyError
 
+    def _members(self, root):
+        """Returns a list of (membername, value) decoded from the received data, each value being
+           checked by the _checkvalue method of the subclass, so an invalid message is rejected whole."""
+        membertag = self._membertag
+        items = []
+        for member in root:
+            if member.tag != membertag:
+                raise ParseException(f"Invalid child tag of {root.tag}")
+            membername = member.get("name")
+            if not membername:
+                raise ParseException(f"Missing name in {membertag}")
+            value = member.text.strip() if member.text else ""
+            items.append((membername, self._checkvalue(value)))
+        return items
+
+    def _apply(self, root):
+        "Decodes and checks the members, then updates the vector"
+        self.vector = self.device.data[self.vectorname]
+        self._items = self._members(root)
+        self.data = dict(self._items)
+        # set changed values into self.vector
+        self.vector._setvector(self)
+
+    def _memberitems(self):
+        "Returns an iterable of (membername, value) used to update the vector"
+        return self._items
+
+    def _merge(self, earlier):
+        """Adds the members of an earlier event for the same vector, which this event replaces
+           when conflating, the values of this event taking precedence"""
+        merged = dict(earlier._memberitems())
+        merged.update(self._memberitems())
+        self._items = list(merged.items())
+        self.data = merged
+        self.skipped = earlier.skipped + 1
+
 
 
 class setSwitchVector(setVector):
     """The remote driver is setting a Switch vector property.
        This is a mapping of membername:value."""
 
+    _membertag = "oneSwitch"
+
     def __init__(self, root, device, client):
         setVector.__init__(self, root, device, client)
         try:
@@ -530,27 +590,15 @@ class setSwitchVector(setVector):
         except Exception:
             # dont update
             pass
-        # create a dictionary of member name to value
-        for member in root:
-            if member.tag == "oneSwitch":
-                membername = member.get("name")
-                if not membername:
-                    raise ParseException("Missing name in oneSwitch")
-                if not member.text:
-                    raise ParseException("Missing value in oneSwitch")
-                value = member.text.strip()
-                if value == "On":
-                    self.data[membername] = "On"
-                elif value == "Off":
-                    self.data[membername] = "Off"
-                else:
-                    raise ParseException("Invalid value in oneSwitch")
-            else:
-                raise ParseException("Invalid child tag of setSwitchVector")
-        properties = device.data
-        self.vector = properties[self.vectorname]
-        # set changed values into self.vector
-        self.vector._setvector(self)
+        self._apply(root)
+
+    def _checkvalue(self, value):
+        "Returns the received member value, or raises a ParseException if it is invalid"
+        if not value:
+            raise ParseException("Missing value in oneSwitch")
+        if value not in ("On", "Off"):
+            raise ParseException("Invalid value in oneSwitch")
+        return value
 
 
 class setTextVector(setVector):
@@ -558,6 +606,8 @@ class setTextVector(setVector):
     """The remote driver is setting a Text vector property.
        This is a mapping of membername:value."""
 
+    _membertag = "oneText"
+
     def __init__(self, root, device, client):
         setVector.__init__(self, root, device, client)
         try:
@@ -567,23 +617,11 @@ class setTextVector(setVector):
         except Exception:
             # dont update
             pass
-        # create a dictionary of member name to value
-        for member in root:
-            if member.tag == "oneText":
-                membername = member.get("name")
-                if not membername:
-                    raise ParseException("Missing name in oneText")
-                if not member.text:
-                    value = ""
-                else:
-                    value = member.text.strip()
-                self.data[membername] = value
-            else:
-                raise ParseException("Invalid child tag of setTextVector")
-        properties = device.data
-        self.vector = properties[self.vectorname]
-        # set changed values into self.vector
-        self.vector._setvector(self)
+        self._apply(root)
+
+    def _checkvalue(self, value):
+        "Returns the received member value, any text is valid"
+        return value
 
 
 class setNumberVector(setVector):
@@ -592,6 +630,8 @@ class setNumberVector(setVector):
        This is a mapping of membername:value.
        These number values are string values."""
 
+    _membertag = "oneNumber"
+
     def __init__(self, root, device, client):
         setVector.__init__(self, root, device, client)
         try:
@@ -601,29 +641,18 @@ class setNumberVector(setVector):
         except Exception:
             # dont update
             pass
-        # create a dictionary of member name to value
-        for member in root:
-            if member.tag == "oneNumber":
-                membername = member.get("name")
-                if not membername:
-                    raise ParseException("Missing name in oneNumber")
-                if not member.text:
-                    raise ParseException("Missing value in oneNumber")
-                membervalue = member.text.strip()
-                if not membervalue:
-                    raise ParseException("Missing value in oneNumber")
-                # test membervalue ok
-                try:
-                    getfloat(membervalue)
-                except TypeError:
-                    raise ParseException("Invalid number in setNumberVector")
-                self.data[membername] = membervalue
-            else:
-                raise ParseException("Invalid child tag of setNumberVector")
-        properties = device.data
-        self.vector = properties[self.vectorname]
-        # set changed values into self.vector
-        self.vector._setvector(self)
+        self._apply(root)
+
+    def _checkvalue(self, value):
+        "Returns the received member value, or raises a ParseException if it is invalid"
+        if not value:
+            raise ParseException("Missing value in oneNumber")
+        # test membervalue ok
+        try:
+            getfloat(value)
+        except TypeError:
+            raise ParseException("Invalid number in setNumberVector")
+        return value
 
 
 class setLightVector(setVector):
@@ -632,39 +661,34 @@ class setLightVector(setVector):
        This is a mapping of membername:value.
        Note, the timeout attribute will always be None"""
 
+    _membertag = "oneLight"
+
     def __init__(self, root, device, client):
         setVector.__init__(self, root, device, client)
-        # create a dictionary of member name to value
-        for member in root:
-            if member.tag == "oneLight":
-                membername = member.get("name")
-                if not membername:
-                    raise ParseException("Missing name in oneLight")
-                if not member.text:
-                    raise ParseException("Missing value in oneLight")
-                value = member.text.strip()
-                if value not in ('Idle','Ok','Busy','Alert'):
-                    raise ParseException("Invalid value in oneLight")
-                self.data[membername] = value
-            else:
-                raise ParseException("Invalid child tag of setLightVector")
-        properties = device.data
-        self.vector = properties[self.vectorname]
-        # set changed values into self.vector
-        self.vector._setvector(self)
+        self._apply(root)
+
+    def _checkvalue(self, value):
+        "Returns the received member value, or raises a ParseException if it is invalid"
+        if not value:
+            raise ParseException("Missing value in oneLight")
+        if value not in ('Idle','Ok','Busy','Alert'):
+            raise ParseException("Invalid value in oneLight")
+        return value
 
 
 class setBLOBVector(setVector):
 
     """The remote driver is setting a BLOB vector property.
        This is a mapping of membername:value, where value is a
-       bytes object, taken from the received xml and b64 decoded
+       bytes object, taken from the received xml and b64 decoded,
+       or if BLOBs are being streamed to the BLOBfolder, a BLOBFile
+       object giving the saved filename and a read() method.
        This event has further attribute sizeformat being a dictionary
        of membername:(size, format) and which are then set into the target
        members as blobsize and blobformat attributes."""
 
 
-    def __init__(self, root, device, client):
+    def __init__(self, root, device, client, decoded=None):
         setVector.__init__(self, root, device, client)
         self.eventtype = "SetBLOB"
         try:
@@ -678,30 +702,76 @@ class setBLOBVector(setVector):
         # and dictionary sizeformat
         # with key member name and value being a tuple of size, format
         self.sizeformat = {}
-        for member in root:
-            if member.tag == "oneBLOB":
-                membername = member.get("name")
-                if not membername:
-                    raise ParseException("Missing name in oneBLOB")
-                membersize = member.get("size")
-                if not membersize:
-                    raise ParseException("Missing size in oneBLOB")
-                try:
-                    membersize = int(membersize)
-                except Exception:
-                    raise ParseException("Invalid size in oneBLOB")
-                memberformat = member.get("format")
-                if not memberformat:
-                    raise ParseException("Missing format in oneBLOB")
-                if not member.text:
-                    raise ParseException("Missing value in oneBLOB")
-                try:
-                    self.data[membername] = standard_b64decode(member.text.encode('ascii'))
-                except Exception:
-                    raise ParseException("Unable to decode oneBLOB contents")
-                self.sizeformat[membername] = (membersize, memberformat)
-            else:
-                raise ParseException("Invalid child tag of setBLOBVector")
+        # dictionary of membername to the path of each BLOB streamed to a file, which are
+        # renamed once all members are valid, or removed if the event fails
+        streamed = {}
+        try:
+            for member in root:
+                if member.tag == "oneBLOB":
+                    membername = member.get("name")
+                    if not membername:
+                        raise ParseException("Missing name in oneBLOB")
+                    membersize = member.get("size")
+                    if not membersize:
+                        raise ParseException("Missing size in oneBLOB")
+                    try:
+                        membersize = int(membersize)
+                    except Exception:
+                        raise ParseException("Invalid size in oneBLOB")
+                    memberformat = member.get("format")
+                    if not memberformat:
+                        raise ParseException("Missing format in oneBLOB")
+                    if not member.text:
+                        raise ParseException("Missing value in oneBLOB")
+                    if member.text.startswith("#"):
+                        # the content has been streamed to a file, and replaced by a reference
+                        path = client._streamedpath(member.text)
+                        if path is None:
+                            raise ParseException("Unable to decode oneBLOB contents")
+                        streamed[membername] = path
+                        self.sizeformat[membername] = (membersize, memberformat)
+                        continue
+                    if decoded and (membername in decoded):
+                        # already decoded by the client BLOBexecutor
+                        if decoded[membername] is None:
+                            raise ParseException("Unable to decode oneBLOB contents")
+                        self.data[membername] = decoded[membername]
+                        self.sizeformat[membername] = (membersize, memberformat)
+                        continue
+                    try:
+                        self.data[membername] = standard_b64decode(member.text.encode('ascii'))
+                    except Exception:
+                        raise ParseException("Unable to decode oneBLOB contents")
+                    self.sizeformat[membername] = (membersize, memberformat)
+                else:
+                    raise ParseException("Invalid child tag of setBLOBVector")
+            # all members are valid, so give the streamed files their names
+            for membername, path in list(streamed.items()):
+                blobfile = client._streamedBLOB(path, membername, self.timestamp, self.sizeformat[membername][1])
+                streamed[membername] = blobfile.path
+                self.data[membername] = blobfile
+        except Exception:
+            # remove the files of this event, including any not yet claimed
+            for member in root:
+                if member.text and member.text.startswith("#"):
+                    path = client._streamedpath(member.text)
+                    if path is not None:
+                        path.unlink(missing_ok=True)
+            for path in streamed.values():
+                path.unlink(missing_ok=True)
+            raise
         self.vector = device[self.vectorname]
         # set changed values into self.vector
         self.vector._setvector(self)
+
+    def _memberitems(self):
+        "Returns an iterable of (membername, value) used to update the vector"
+        return self.data.items()
+
+    def _merge(self, earlier):
+        """Adds the members, and their sizes and formats, of an earlier event for the same vector,
+           which this event replaces when conflating, the values of this event taking precedence"""
+        setVector._merge(self, earlier)
+        sizeformat = dict(earlier.sizeformat)
+        sizeformat.update(self.sizeformat)
+        self.sizeformat = sizeformat
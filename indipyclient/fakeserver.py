@@ -0,0 +1,278 @@
+"""
+This module contains FakeServer, an in-process stand-in for an INDI service,
+used by the benchmarks run with
+
+python -m indipyclient.bench
+
+It runs its own event loop in a separate thread, listening on the loopback
+interface, so no network is needed, and generates a configurable load.
+
+On every getProperties received, it sends a definition of all its vectors,
+being for each device a number of number vectors, and a BLOB vector. After the
+first getProperties, it sends setNumberVector updates, at a given rate or as
+fast as the client accepts them, and optionally BLOBs, and further floods of
+definitions spread through the updates.
+
+Each number vector has members "x" and "sent", where "sent" is the value of
+time.perf_counter() when the update was written, so a client in the same
+process can measure the latency of each update.
+
+This is a stand-in for measurement only, it does not act on enableBLOB or
+new vectors sent by the client. If uploads are enabled, it also defines for
+each device a switch vector "abort" and a BLOB vector "upload", which the
+client can send to, and records the time at which each new vector is received.
+"""
+
+import asyncio, threading, time, base64, re
+
+from datetime import datetime, timezone
+
+
+# the end tag of a new vector received
+_NEWEND = re.compile(rb'</new(\w+)Vector>')
+
+
+class FakeServer:
+
+    """A stand-in INDI service with devices x vectors number vectors, sending updates setNumberVector
+       messages in total, at rate updates per second, or as fast as possible if rate is zero.
+
+       If blobs is given, that number of setBLOBVectors, each of blobsize bytes, are sent spread
+       through the updates. If floods is given, that number of further definitions of all vectors
+       are also sent spread through the updates.
+
+       If uploads is True, each device also has a writable switch vector "abort", with member "stop",
+       and a writable BLOB vector "upload", with member "file". The attribute arrivals is then a list of
+       (time.perf_counter(), vectortype) for each new vector received, where vectortype is such as
+       "Switch" or "BLOB", in the order received.
+
+       If stalled is True, the server stops reading from each client after its first getProperties, as
+       a server which has hung, so data sent by the client fills the connection buffers.
+
+       Call start() to run the server in a thread, which returns the port, and stop() to end it.
+       disconnect() closes the connections to all clients, while the server continues to listen.
+       The attributes bytes_sent and messages_sent count the data written."""
+
+    def __init__(self, devices=4, vectors=8, updates=10000, rate=0, blobsize=0, blobs=0, floods=0, uploads=False, stalled=False):
+        self.devices = devices
+        self.vectors = vectors
+        self.updates = updates
+        self.rate = rate
+        self.blobsize = blobsize
+        self.blobs = blobs if blobsize else 0
+        self.floods = floods
+        self.uploads = uploads
+        self.stalled = stalled
+        self.arrivals = []
+        self.port = None
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        # the writers of the connected clients
+        self._writers = set()
+        if self.blobs:
+            content = (bytes(range(256)) * (blobsize // 256 + 1))[:blobsize]
+            self._blobtext = base64.standard_b64encode(content).decode()
+
+
+    def _timestamp(self):
+        return datetime.now(tz=timezone.utc).replace(tzinfo=None).isoformat(sep='T')
+
+
+    def _definitions(self):
+        "Returns bytes defining all vectors, and the number of messages"
+        timestamp = self._timestamp()
+        messages = []
+        for d in range(self.devices):
+            for v in range(self.vectors):
+                messages.append(f'<defNumberVector device="device{d}" name="vector{v}" label="Vector {v}" group="Numbers" '
+                                f'state="Ok" perm="ro" timestamp="{timestamp}">\n'
+                                '  <defNumber name="x" format="%.2f" min="0" max="1000" step="0">0</defNumber>\n'
+                                '  <defNumber name="sent" format="%.6f" min="0" max="0" step="0">0</defNumber>\n'
+                                '</defNumberVector>\n')
+            if self.blobs:
+                messages.append(f'<defBLOBVector device="device{d}" name="blob" label="BLOB" group="BLOBs" '
+                                f'state="Ok" perm="ro" timestamp="{timestamp}">\n'
+                                '  <defBLOB name="image" />\n'
+                                '</defBLOBVector>\n')
+            if self.uploads:
+                messages.append(f'<defSwitchVector device="device{d}" name="abort" label="Abort" group="Uploads" '
+                                f'state="Ok" perm="rw" rule="AtMostOne" timestamp="{timestamp}">\n'
+                                '  <defSwitch name="stop">Off</defSwitch>\n'
+                                '</defSwitchVector>\n')
+                messages.append(f'<defBLOBVector device="device{d}" name="upload" label="Upload" group="Uploads" '
+                                f'state="Ok" perm="rw" timestamp="{timestamp}">\n'
+                                '  <defBLOB name="file" />\n'
+                                '</defBLOBVector>\n')
+        return "".join(messages).encode(), len(messages)
+
+
+    def _update(self, u, timestamp, sent):
+        "Returns the string of update number u"
+        d = u % self.devices
+        v = (u // self.devices) % self.vectors
+        return (f'<setNumberVector device="device{d}" name="vector{v}" state="Ok" timestamp="{timestamp}">\n'
+                f'  <oneNumber name="x">{u % 1000}.5</oneNumber>\n'
+                f'  <oneNumber name="sent">{sent!r}</oneNumber>\n'
+                '</setNumberVector>\n')
+
+
+    def _blob(self, b, timestamp):
+        "Returns bytes of BLOB number b"
+        return (f'<setBLOBVector device="device{b % self.devices}" name="blob" state="Ok" timestamp="{timestamp}">\n'
+                f'  <oneBLOB name="image" size="{self.blobsize}" format=".bin">{self._blobtext}</oneBLOB>\n'
+                '</setBLOBVector>\n').encode()
+
+
+    async def _write(self, writer, data, count):
+        writer.write(data)
+        self.bytes_sent += len(data)
+        self.messages_sent += count
+        await writer.drain()
+
+
+    async def _handle(self, reader, writer):
+        "Serves a connected client"
+        # set on each getProperties received
+        requested = asyncio.Event()
+        requests = 0
+
+        async def listen():
+            nonlocal requests
+            # the end of the previous block, in case an end tag is split between blocks
+            tail = b''
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                count = data.count(b'<getProperties')
+                if count:
+                    requests += count
+                    requested.set()
+                    if self.stalled:
+                        # never read again, until the connection is closed
+                        await asyncio.get_running_loop().create_future()
+                if self.uploads:
+                    now = time.perf_counter()
+                    block = tail + data
+                    for match in _NEWEND.finditer(block):
+                        # an end tag wholly within the tail has already been recorded
+                        if match.end() > len(tail):
+                            self.arrivals.append((now, match.group(1).decode()))
+                    tail = block[-32:]
+
+        listening = asyncio.create_task(listen())
+        self._writers.add(writer)
+        try:
+            await requested.wait()
+            await self._send(writer, requested, lambda: requests)
+            # leave the connection open until the client closes it
+            await listening
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            listening.cancel()
+            writer.close()
+
+
+    async def _send(self, writer, requested, requests):
+        "Sends definitions, then the updates"
+        answered = 0
+        sentfloods = 0
+        sentblobs = 0
+        # with a rate set, the updates due are sent every 10ms, otherwise updates
+        # are sent in groups of 100 as fast as the client accepts them
+        start = time.perf_counter()
+        u = 0
+        while True:
+            if answered < requests():
+                # a getProperties has been received, answer with a flood of definitions
+                answered = requests()
+                await self._write(writer, *self._definitions())
+            if u >= self.updates:
+                break
+            if self.rate:
+                # send the updates due by now
+                due = min(int((time.perf_counter() - start) * self.rate) + 1, self.updates)
+                if due <= u:
+                    await asyncio.sleep(0.01)
+                    continue
+            else:
+                due = min(u + 100, self.updates)
+            timestamp = self._timestamp()
+            sent = time.perf_counter()
+            data = "".join(self._update(n, timestamp, sent) for n in range(u, due)).encode()
+            count = due - u
+            u = due
+            # BLOBs and floods are spread evenly through the updates
+            while self.blobs and (sentblobs < self.blobs) and (u >= (sentblobs + 1) * self.updates // (self.blobs + 1)):
+                data += self._blob(sentblobs, timestamp)
+                sentblobs += 1
+                count += 1
+            await self._write(writer, data, count)
+            while self.floods and (sentfloods < self.floods) and (u >= (sentfloods + 1) * self.updates // (self.floods + 1)):
+                await self._write(writer, *self._definitions())
+                sentfloods += 1
+        # any remaining BLOBs
+        while sentblobs < self.blobs:
+            await self._write(writer, self._blob(sentblobs, self._timestamp()), 1)
+            sentblobs += 1
+        # continue to answer getProperties
+        while True:
+            if answered < requests():
+                answered = requests()
+                await self._write(writer, *self._definitions())
+                continue
+            requested.clear()
+            await requested.wait()
+
+
+    def _run(self, host, port):
+        "Runs the server event loop, in the server thread"
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, host, port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            # cancel the connection handlers
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+
+
+    def start(self, host="127.0.0.1", port=0):
+        "Starts the server in a thread, and returns the port it is listening on"
+        self._thread = threading.Thread(target=self._run, args=(host, port), daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self.port
+
+
+    def _disconnect(self):
+        "Closes the client connections, in the server thread"
+        for writer in self._writers:
+            writer.close()
+
+
+    def disconnect(self):
+        "Closes the connections to all clients, which may then reconnect"
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._disconnect)
+
+
+    def stop(self):
+        "Stops the server, and waits for its thread to end"
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -1,33 +1,21 @@
 
 
-import collections, asyncio, time, copy, json, pathlib, logging
+import collections, asyncio, time, copy, json, pathlib, logging, random
 
 from datetime import datetime, timezone
 
 import xml.etree.ElementTree as ET
 
-from . import events
+from . import events, wirelog, recorder
 
-from .propertymembers import ParseException
+from .clientstats import ClientStats
 
-logger = logging.getLogger(__name__)
+from .propertymembers import ParseException, BLOBFile, mapfile
+
+from .rxparser import TAGS, IncrementalParser, PullParser, ExpatParser, Record, BLOBSink
 
+logger = logging.getLogger(__name__)
 
-# All xml data received from the driver should be contained in one of the following tags
-TAGS = (b'message',
-        b'delProperty',
-        b'defSwitchVector',
-        b'setSwitchVector',
-        b'defLightVector',
-        b'setLightVector',
-        b'defTextVector',
-        b'setTextVector',
-        b'defNumberVector',
-        b'setNumberVector',
-        b'defBLOBVector',
-        b'setBLOBVector',
-        b'getProperties'       # for snooping
-       )
 
 DEFTAGS = ( 'defSwitchVector',
             'defLightVector',
@@ -45,6 +33,9 @@ _STARTTAGS = tuple(b'<' + tag for tag in TAGS)
 # _ENDTAGS is a tuple of ( b'</defTextVector>', ...  ) data received will be tested to end with such an endtag
 _ENDTAGS = tuple(b'</' + tag + b'>' for tag in TAGS)
 
+# the transmit priorities, in the order written, set by IPyClient.set_tx_priority
+PRIORITIES = ("control", "normal", "bulk")
+
 
 
 def _makestart(element):
@@ -94,6 +85,25 @@ class IPyClient(collections.UserDict):
         self._writer = None
         self._reader = None
 
+        # Transmitted data is added to a deque for each priority, as tuples of (bytes, future, key),
+        # and written by the _run_tx task, which writes all waiting data together, in priority order,
+        # then sets each future result to True, or to False if the connection closed before the data
+        # was written. key is the (devicename, vectorname) of a new vector, or None
+        self._txqueues = {priority:collections.deque() for priority in PRIORITIES}
+        # set when data is added to self._txqueues
+        self._txready = asyncio.Event()
+        # the number of bytes in self._txqueues, not counting any BLOBs being streamed
+        self._txqueuedbytes = 0
+        # set when all data in self._txqueues has been written and drained
+        self._txdrained = asyncio.Event()
+        # dictionary of (devicename, vectorname) to priority, set by set_tx_priority
+        self._txpriority = {}
+        # set of tasks calling rxevent with a VectorTimeOut event
+        self._timeouttasks = set()
+        # the high and low watermarks of the connection write buffer, in bytes, set by set_tx_watermarks
+        self._txhigh = 65536
+        self._txlow = 16384
+
         # self.messages is a deque of (Timestamp, message) tuples
         self.messages = collections.deque(maxlen=8)
 
@@ -111,13 +121,13 @@ class IPyClient(collections.UserDict):
         self.vector_timeout_min = 2
         self.vector_timeout_max = 10
 
-        # idle_timer is set when either data is transmitted or received.
-        # If nothing is sent or received after idle_timeout reached, then a getProperties is transmitted
-        self.idle_timer = time.time()
+        # idle_timer is set to the event loop time, which is monotonic, when either data is transmitted
+        # or received. If nothing is sent or received after idle_timeout reached, then a getProperties is transmitted
+        self.idle_timer = time.monotonic()
         self.idle_timeout = 20
         # self.idle_timeout is set to two times self.vector_timeout_max
 
-        # tx_timer is set when any data is transmitted,
+        # tx_timer is set to the event loop time when any data is transmitted,
         # it is used to check when any data is received,
         # at which point it becomes None again.
         # if there is no answer after self.respond_timeout seconds,
@@ -127,13 +137,56 @@ class IPyClient(collections.UserDict):
         # self.respond_timeout is set to four times self.vector_timeout_max
         ######################
 
+        # set to wake the _check_alive task, which otherwise sleeps until its next timer deadline
+        self._alivewake = asyncio.Event()
+
+        # The delay in seconds before the first attempt to reconnect, multiplied by self._reconnectfactor
+        # after each failed attempt, up to self._reconnectmax, and reduced by up to the fraction
+        # self._reconnectjitter at random, set by set_reconnect
+        self._reconnectdelay = 5.0
+        self._reconnectmax = 5.0
+        self._reconnectfactor = 2.0
+        self._reconnectjitter = 0.0
+        # the delay before the next attempt, before jitter
+        self._retrydelay = 5.0
+
+        # If True, devices are kept when the connection is lost, set by set_resync
+        self._resync = False
+        # seconds after the last definition received, when stale vectors are deleted
+        self._resynctime = 10.0
+        # True while stale vectors are waiting to be redefined after a reconnect
+        self._resyncing = False
+        # the loop time of the connection, or of the last definition received while resyncing
+        self._lastdefine = 0.0
+
         # and shutdown routine sets this to True to stop coroutines
         self._stop = False
+        # and set with it, so tasks waiting on the connection or on queues stop at once
+        self._stopping = asyncio.Event()
+        # the event loop running asyncrun, so shutdown can be called from another thread
+        self._loop = None
         # this is set when asyncrun is finished
         self.stopped = asyncio.Event()
+        # the state of the connection, one of
+        # "stopped", "connecting", "connected", "closing" or "waiting"
+        self._connstate = "stopped"
 
         # Indicates how verbose the debug xml logs will be when created.
         self._verbose = 1
+        # If True, debug logs are taken from the raw bytes received and transmitted
+        self._wirelog = False
+        # If set to a wirelog.WireLog, this passes the wire logs to its handlers in a separate thread
+        self._wirelogger = None
+        # path of a file to record data received and transmitted, and the recorder.Recorder
+        # writing it while asyncrun is running
+        self._recordpath = None
+        self._recorder = None
+        # If set, a coroutine function returning (reader, writer), used instead of
+        # opening a connection to indihost:indiport, set by a recorder.Replayer
+        self._connector = None
+        # If set to a clientstats.ClientStats, counts and times each stage of the client,
+        # if None, the stats are disabled, and the hot path only tests this attribute
+        self._stats = None
 
         # Enables reports, by adding INFO logs to client messages
         self.enable_reports = True
@@ -146,6 +199,60 @@ class IPyClient(collections.UserDict):
         self._blobfolderchanged = False
         # This is the default enableBLOB value
         self._enableBLOBdefault = "Never"
+        # If True, received timestamps are kept as strings, and only parsed
+        # to datetime objects when the timestamp attribute is accessed
+        self.lazytimestamps = False
+
+        # If True, and a BLOBfolder is set, received BLOBs are decoded to files as they arrive
+        self.BLOBstreaming = False
+        # created for each connection, filters received data to stream BLOBs to files
+        self._blobsink = None
+        # If True, received BLOB values are set as memoryviews, over the decoded bytes,
+        # or over a memory map of the file if saved to the BLOBfolder
+        self.BLOBmemoryview = False
+        # If set to a concurrent.futures executor, received BLOBs are decoded
+        # and saved in the executor, rather than in the event loop
+        self.BLOBexecutor = None
+        # dictionary of (devicename, vectorname) to the last task handling received
+        # data for that vector, used to keep events in order while BLOBs are decoded
+        self._rxtasks = {}
+
+        # The receive engine, as default "framing" reads received data up to each '>'
+        # character, and parses each message when it is complete. If set to "pullparser" or
+        # "expat", or to a subclass of rxparser.IncrementalParser, blocks of up to
+        # self._rxblocksize bytes are read and fed to an incremental parser.
+        self._rxengine = "framing"
+        self._rxblocksize = 65536
+        # A read of data already waiting in the reader returns without suspending, so while
+        # data keeps arriving the receive loop yields to other tasks once in each
+        # self._rxslice seconds, self._rxyieldtime being the loop time of the next yield
+        self._rxslice = 0.005
+        self._rxyieldtime = 0.0
+        # If set to a positive integer, received events are passed in lists of up to this
+        # length to the rxevents method, and self._rxbatchtime is the time in seconds
+        # to wait for further data to add to a batch
+        self._rxbatch = 0
+        self._rxbatchtime = 0.0
+        # the list of events of the batch being collected by the receive task, into which the
+        # warning and report methods add their events, so they are given in order, None if no
+        # batch is being collected
+        self._rxcurrent = None
+        # If set to an integer, any received message larger than this number of
+        # bytes is discarded, rather than allowing the received data to grow without limit
+        self._rxmaxsize = None
+        # set of vector types whose set events are conflated, if empty, conflation is disabled
+        self._conflation = frozenset()
+        # When conflating, events waiting for the _run_dispatch task are held in self._rxqueue, a dictionary
+        # of sequence number to event, and self._rxlatest is a dictionary of (devicename, vectorname) to the
+        # sequence number of a waiting set event, which will be replaced by any later set event
+        self._rxqueue = collections.OrderedDict()
+        self._rxlatest = {}
+        self._rxsequence = 0
+        # set when events are added to self._rxqueue
+        self._rxready = asyncio.Event()
+        # set True when the _comms task has ended, after which the _run_dispatch task
+        # stops once the events waiting in self._rxqueue have been passed to rxevent
+        self._commsended = False
 
 
     def create_itemid(self, devicename='', vectorname='', membername='', **kwargs):
@@ -216,6 +323,8 @@ class IPyClient(collections.UserDict):
                         vector._enableBLOB = self._enableBLOBdefault
         self._BLOBfolder = blobpath
         self._blobfolderchanged = True
+        # wake the _check_alive task, which sends the enableBLOBs
+        self._alivewake.set()
 
 
     BLOBfolder = property(
@@ -309,14 +418,241 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
             raise ValueError
         self._verbose = verbose
 
+    def set_wirelog(self, enable=True, handlers=()):
+        """Enables or disables wire logging, used in place of the xml debug logs.
+
+           When enabled, the debug logs are taken directly from the bytes received and transmitted,
+           with the detail set by debug_verbosity, rather than from copies of the xml elements. The logs
+           are made to the logger "indipyclient.wirelog", and each record is only formatted when handled.
+
+           If handlers, a sequence of logging handlers such as logging.FileHandler, is given, then while
+           asyncrun is running, the wire logs are passed through a queue to these handlers, which are called
+           in a separate thread, so formatting and writing the logs does not slow the event loop.
+           This should be called before asyncrun."""
+        if self._wirelogger is not None:
+            self._wirelogger.stop()
+            self._wirelogger = None
+        self._wirelog = enable
+        if enable and handlers:
+            self._wirelogger = wirelog.WireLog(handlers)
+
+    def record_session(self, path):
+        """Records the bytes received and transmitted, with their times, to a file at the given path,
+           which is appended to. The recording is made while asyncrun is running, and can be replayed
+           using an indipyclient.recorder.Replayer. Set path to None to stop recording.
+           This should be called before asyncrun."""
+        self._recordpath = path
+
+    def set_stats(self, enable=True):
+        """Enables or disables the counters and timers for each stage of the client, read with the stats method.
+           When disabled, which is the default, the cost is close to zero. Enabling the stats, if already
+           enabled, resets them."""
+        if enable:
+            self._stats = ClientStats()
+        else:
+            self._stats = None
+
+    def stats(self):
+        """Returns a dictionary of counts and times for each stage of the client, and the number of
+           messages received for each device and vector, or None if the stats are not enabled.
+
+           The dictionary has keys
+
+           |  "seconds" - the time since the stats were enabled or reset
+           |  "stages" - dictionary of stage name to a dictionary with keys "count", "seconds", "mean" and "bytes"
+           |  "devices" - dictionary of devicename to a dictionary with keys "messages", the total received
+              for the device, and "vectors", a dictionary of vectorname to the number received for that vector.
+           |  "latency" - dictionary of devicename to a dictionary of vectorname to the round trip times of
+              new vectors sent, as given by the vector_latency method.
+
+           The stages are
+
+           |  "read" - each block of data read from the port, timed from the read starting, so including
+              any time waiting for the data to arrive, with the number of bytes
+           |  "framing" - splitting the data received into messages, with the framing receive engine
+           |  "parse" - parsing each message, or each block with the pullparser and expat receive engines
+           |  "event" - creating each event, and setting the received values into the vectors
+           |  "blobsave" - saving each received BLOB to a file, with the number of bytes
+           |  "rxevent" - each call to the rxevent method, or the rxevents method with a batch
+           |  "serialize" - converting each transmitted message to bytes, with the number of bytes
+           |  "drain" - waiting for the port to accept the transmitted messages, which are written together
+              when several are waiting, with the number of bytes"""
+        if self._stats is None:
+            return
+        return self._stats.snapshot()
+
+    def vector_latency(self, devicename, vectorname):
+        """If stats are enabled, returns a dictionary of the round trip times of new vectors sent to the given
+           vector, measured from sending the new vector to receiving the vector reply, with keys
+
+           |  "count" - the number of replies received
+           |  "mean", "max" - the mean and maximum time, in seconds
+           |  "p50", "p95", "p99" - percentiles of the times, in seconds, to within about 9%
+           |  "timeouts" - the number of new vectors sent which were not replied to within the vector timeout
+
+           Returns None if stats are not enabled, or nothing has been sent to the vector."""
+        if self._stats is None:
+            return
+        return self._stats.latency(devicename, vectorname)
+
+    def reset_stats(self):
+        "Resets the stats to zero, if they are enabled"
+        if self._stats is not None:
+            self._stats.reset()
+
+    def set_receive_engine(self, engine="framing", blocksize=65536, maxsize=None):
+        """Sets how received data is parsed, this should be called before asyncrun.
+
+           |  "framing" - the default, reads data up to each '>' character, and parses each message when complete.
+           |  "pullparser" - reads blocks of up to blocksize bytes, and feeds them to a persistent incremental parser.
+           |  "expat" - as pullparser, but the parser drives the expat callbacks directly, creating lightweight
+              records rather than an xml.etree.ElementTree element tree.
+
+           The pullparser and expat engines parse each byte only once, and are faster than framing when receiving a
+           high rate of data. Of the two, pullparser is usually the faster, as its element tree is built in C, whereas
+           the expat callbacks run in Python. The pullparser engine is the reference for the expat engine, and both
+           create identical events. With the expat engine, the event root attribute is created as an
+           xml.etree.ElementTree element only when accessed.
+
+           The engine can also be given as a subclass of indipyclient.rxparser.IncrementalParser, providing
+           your own parser backend, which is used in the same way as the pullparser engine. It must define
+           the abstract methods _create and _parse, otherwise a TypeError is raised.
+
+           If maxsize is given as an integer number of bytes, any received message larger than this, typically
+           a setBLOBVector, will be discarded and a warning message raised. If None, there is no limit."""
+        custom = isinstance(engine, type) and issubclass(engine, IncrementalParser)
+        if not (custom or engine in ("framing", "pullparser", "expat")):
+            raise ValueError("The receive engine should be one of framing, pullparser, expat or an IncrementalParser subclass")
+        if (not isinstance(blocksize, int)) or blocksize < 1:
+            raise ValueError("The blocksize should be a positive integer")
+        if (maxsize is not None) and ((not isinstance(maxsize, int)) or maxsize < 1):
+            raise ValueError("The maxsize should be None or a positive integer")
+        if custom:
+            # create a parser now, so a subclass without the abstract methods raises a TypeError here,
+            # rather than when connected
+            engine(maxsize)
+        self._rxengine = engine
+        self._rxblocksize = blocksize
+        self._rxmaxsize = maxsize
+
+    def set_receive_batch(self, maxevents=1000, maxtime=0.0):
+        """Enables batched receive dispatch, this should be called before asyncrun.
+
+           When enabled, received data is applied to the devices and vectors, and the resulting events
+           are passed as a list to the rxevents coroutine method, rather than calling rxevent for each event.
+
+           With the pullparser and expat receive engines, a batch holds the messages parsed from each block read from
+           the port, being all the data buffered when the block is read, together with any further data received within
+           maxtime seconds, up to maxevents events. With the framing receive engine, a batch holds each message together
+           with the complete messages already received and waiting, and any received within maxtime seconds, up to
+           maxevents events. Messages from the warning and report methods are added to the batch being collected, so
+           they are given in order with the received events.
+
+           Set maxevents to zero to disable batching, which is the default."""
+        if (not isinstance(maxevents, int)) or maxevents < 0:
+            raise ValueError("The maxevents should be zero or a positive integer")
+        if maxtime < 0:
+            raise ValueError("The maxtime should not be negative")
+        self._rxbatch = maxevents
+        self._rxbatchtime = maxtime
+
+    def set_conflation(self, vectortypes=("NumberVector",)):
+        """Enables conflation of received events, this must be called before asyncrun, otherwise a
+           RuntimeError is raised.
+
+           When enabled, received data is still applied to the devices and vectors immediately, but the events
+           are queued, and passed to rxevent (or rxevents if batching is enabled) by a separate task. If a set
+           vector event is waiting in the queue when a further set vector event for the same vector is received,
+           the waiting event is replaced by the latest, which keeps the place of the one replaced, and has its
+           skipped attribute set to the number of events replaced. The members of the replaced events are merged
+           into the latest, with the latest values taking precedence, so a member updated only by a replaced event
+           is still given. So if rxevent is slow, it is given the latest state of each vector, rather than every
+           update. The root attribute of the event remains the received data of the latest event only.
+
+           A set vector event with a message is never replaced, and does not replace a waiting event, so each
+           message is given, with the values received with it. A later event for the same vector is then
+           queued after it.
+
+           vectortypes is a collection of the vector types whose set events are conflated, chosen from
+           "SwitchVector", "LightVector", "TextVector" and "NumberVector". BLOB vector events, messages,
+           definitions and deletions are never conflated.
+
+           Set vectortypes to an empty tuple to disable conflation, which is the default."""
+        if self._loop is not None:
+            # the _run_dispatch task is started, or not, when asyncrun is called
+            raise RuntimeError("Conflation cannot be set while asyncrun is running")
+        vectortypes = frozenset(vectortypes)
+        if not vectortypes.issubset(("SwitchVector", "LightVector", "TextVector", "NumberVector")):
+            raise ValueError("The vectortypes should be from SwitchVector, LightVector, TextVector and NumberVector")
+        self._conflation = vectortypes
+
     async def hardware(self):
         """This is started when asyncrun is called. As default does nothing so stops immediately.
            It is available to be overriden if required."""
         pass
 
     def shutdown(self):
-        "Shuts down the client, sets the flag self._stop to True"
+        """Shuts down the client, sets the flag self._stop to True, and wakes any
+           task waiting, so the client stops without delay. This may be called from
+           another thread, in which case the wake up is passed to the event loop."""
         self._stop = True
+        loop = self._loop
+        if (loop is not None) and loop.is_running():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is not loop:
+                loop.call_soon_threadsafe(self._wake)
+                return
+        self._wake()
+
+    def _wake(self):
+        "Sets the events waited on by the client tasks, so they can stop"
+        self._stopping.set()
+        # wake the _run_dispatch, _run_tx and _check_alive tasks
+        self._rxready.set()
+        self._txready.set()
+        self._alivewake.set()
+
+    async def wait_stop(self, timeout=None):
+        """Waits for up to timeout seconds, or without limit if timeout is None, returning
+           at once when shutdown() is called. Returns True if the client is shut down, False
+           otherwise. This can be used in place of asyncio.sleep in a hardware method, so a
+           shutdown is not delayed by the sleep."""
+        if not self._stop:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._stop
+
+    async def _untilstop(self, awaitable):
+        """Awaits the given awaitable, unless the client is shut down first, in which case it is cancelled.
+           Returns (True, result) if it completed, or (False, None) if the client is shut down."""
+        task = asyncio.ensure_future(awaitable)
+        if not task.done():
+            stopping = asyncio.ensure_future(self._stopping.wait())
+            try:
+                await asyncio.wait((task, stopping), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stopping.cancel()
+                if not task.done():
+                    task.cancel()
+        if not task.done() or task.cancelled():
+            return False, None
+        return True, task.result()
+
+    @property
+    def connection_state(self):
+        """The state of the connection, one of
+
+           |  "stopped" - the client is not running
+           |  "connecting" - a connection is being attempted
+           |  "connected" - the client is connected
+           |  "closing" - the connection has failed or is being shut down, and its tasks are ending
+           |  "waiting" - waiting before the next attempt to reconnect"""
+        return self._connstate
 
     @property
     def stop(self):
@@ -337,8 +673,9 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
             timestamp = datetime.now(tz=timezone.utc)
             timestamp = timestamp.replace(tzinfo=None)
             xmldata = ET.fromstring(f"<message timestamp=\"{timestamp.isoformat(sep='T')}\" message=\"{message}\" />")
-            # and call the receive handler, as if this was received data
-            await self._rxhandler(xmldata)
+            # and call the receive handler, as if this was received data, adding
+            # the event to any batch being collected, to keep it in order
+            await self._rxhandler(xmldata, self._rxcurrent)
         except Exception :
             logger.exception("Exception report from IPyClient.report method")
 
@@ -354,8 +691,9 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
             timestamp = datetime.now(tz=timezone.utc)
             timestamp = timestamp.replace(tzinfo=None)
             xmldata = ET.fromstring(f"<message timestamp=\"{timestamp.isoformat(sep='T')}\" message=\"{message}\" />")
-            # and call the receive handler, as if this was received data
-            await self._rxhandler(xmldata)
+            # and call the receive handler, as if this was received data, adding
+            # the event to any batch being collected, to keep it in order
+            await self._rxhandler(xmldata, self._rxcurrent)
         except Exception :
             logger.exception("Exception report from IPyClient.warning method")
 
@@ -371,25 +709,66 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
 
 
     async def _comms(self):
-        "Create a connection to an INDI port"
+        """Create a connection to an INDI port, and reconnect when it fails.
+           Each connection runs the tasks _run_rx, _check_alive and _run_tx, when the
+           connection fails, or the client is shut down, any still running are cancelled."""
+        loop = asyncio.get_running_loop()
+        # completes when the client is shut down
+        stopping = asyncio.create_task(self._stopping.wait())
         try:
             while not self._stop:
+                self._connstate = "connecting"
                 self.tx_timer = None
-                self.idle_timer = time.time()
+                self.idle_timer = loop.time()
+                connecting = None
                 t2 = None
                 t3 = None
+                t4 = None
                 try:
                     # start by openning a connection
                     await self.warning(f"Attempting to connect to {self.indihost}:{self.indiport}")
-                    self._reader, self._writer = await asyncio.open_connection(self.indihost, self.indiport)
+                    if self._connector is None:
+                        connecting = asyncio.create_task(asyncio.open_connection(self.indihost, self.indiport))
+                    else:
+                        connecting = asyncio.create_task(self._connector())
+                    await asyncio.wait((connecting, stopping), return_when=asyncio.FIRST_COMPLETED)
+                    if not connecting.done():
+                        # shut down while connecting
+                        connecting.cancel()
+                        await asyncio.gather(connecting, return_exceptions=True)
+                        break
+                    self._reader, self._writer = connecting.result()
+                    # start the writer before any data can be sent
+                    t4 = asyncio.create_task(self._run_tx())
+                    # connected, so the next failure is retried after the initial delay
+                    self._retrydelay = self._reconnectdelay
                     self.messages.clear()
-                    # clear devices etc
-                    self.clear()
+                    self._stopvectortimers()
+                    if self._resync:
+                        # keep the devices, which were marked stale when the connection was lost,
+                        # and are reconciled against the definitions now received
+                        self._resyncing = any(vector.stale for device in self.data.values() for vector in device.values())
+                        self._lastdefine = asyncio.get_running_loop().time()
+                    else:
+                        # clear devices etc
+                        self.clear()
+                    self._connstate = "connected"
                     await self.warning(f"Connected to {self.indihost}:{self.indiport}")
-                    await self.rxevent(events.ConnectionMade())
+                    await self._connectionevent(events.ConnectionMade())
                     t2 = asyncio.create_task(self._run_rx())
                     t3 = asyncio.create_task(self._check_alive())
-                    await asyncio.gather(t2, t3)
+                    # run until the connection ends, or the client is shut down
+                    await asyncio.wait((t2, t3, stopping), return_when=asyncio.FIRST_COMPLETED)
+                    for task in (t2, t3):
+                        if task.done():
+                            # raise any exception which ended the connection
+                            task.result()
+                except asyncio.CancelledError:
+                    # the client is cancelled, rather than shut down, so cancel the connection tasks
+                    for task in (connecting, t2, t3, t4):
+                        if task is not None:
+                            task.cancel()
+                    raise
                 except ConnectionRefusedError:
                     await self.warning(f"Connection refused on {self.indihost}:{self.indiport}")
                 except ConnectionError:
@@ -399,108 +778,493 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
                 except Exception:
                     logger.exception(f"Connection Error on {self.indihost}:{self.indiport}")
                     await self.warning("Connection failed")
+                self._connstate = "closing"
                 await self._clear_connection()
-                # connection has failed, ensure all tasks are done
-                if t2:
-                    while not t2.done():
-                        await asyncio.sleep(0)
-                if t3:
-                    while not t3.done():
-                        await asyncio.sleep(0)
+                # the connection has ended, cancel the tasks if still running, any data
+                # being written by the _run_tx task is not sent
+                for task in (t2, t3, t4):
+                    if task is not None:
+                        task.cancel()
+                await asyncio.gather(*(task for task in (t2, t3, t4) if task is not None), return_exceptions=True)
                 if self._stop:
                     break
                 else:
                     await self.warning("Connection failed, re-trying...")
-                # wait five seconds before re-trying, but keep checking
-                # that self._stop has not been set
-                count = 0
-                while not self._stop:
-                    await asyncio.sleep(0.5)
-                    count += 1
-                    if count >= 10:
-                        break
+                # wait before re-trying, returning early if the client is shut down
+                self._connstate = "waiting"
+                if await self.wait_stop(self._nextretry()):
+                    break
         except Exception:
             logger.exception("Exception report from IPyClient._comms method")
             raise
         finally:
+            stopping.cancel()
+            self._connstate = "closing"
             await self._clear_connection()
+            self._commsended = True
             self.shutdown()
 
 
 
+    async def _connectionevent(self, event):
+        """Passes a ConnectionMade or ConnectionLost event to rxevent, if conflating, through
+           self._rxqueue, so it is given in order with the received events waiting there"""
+        if self._conflation:
+            self._rxenqueue(event)
+        else:
+            await self.rxevent(event)
+
+
+    def _nextretry(self):
+        "Returns the delay in seconds before the next attempt to reconnect, and increases the following delay"
+        delay = self._retrydelay
+        self._retrydelay = min(self._retrydelay * self._reconnectfactor, self._reconnectmax)
+        if self._reconnectjitter:
+            # spread the attempts of many clients
+            delay -= delay * self._reconnectjitter * random.random()
+        return delay
+
+
     async def _clear_connection(self):
         "Clears a connection"
+        writer = self._writer
+        # cleared at once, so the connection is closed only once if this is called by several tasks
+        self.tx_timer = None
+        self._writer = None
+        self._reader = None
         try:
-            if self._writer is not None:
+            if writer is not None:
                 await self.warning(f"Connection closed on {self.indihost}:{self.indiport}")
-                await self.rxevent(events.ConnectionLost())
-                self._writer.close()
-                await self._writer.wait_closed()
+                # give the events of any batch being collected before ConnectionLost
+                await self._rxflush()
+                await self._connectionevent(events.ConnectionLost())
+                transport = getattr(writer, "transport", None)
+                if (transport is not None) and transport.get_write_buffer_size():
+                    # closing waits for the buffered data to be written, which never
+                    # completes if the server has stopped reading, so discard it
+                    transport.abort()
+                else:
+                    writer.close()
+                try:
+                    await asyncio.wait_for(writer.wait_closed(), 0.5)
+                except asyncio.TimeoutError:
+                    if transport is not None:
+                        transport.abort()
+        except ConnectionError:
+            # the connection has already failed
+            pass
         except Exception:
             logger.exception("Exception report from IPyClient._clear_connection method")
-        self.tx_timer = None
-        self._writer = None
-        self._reader = None
+        # wake the _run_tx and _check_alive tasks, so they can stop
+        self._txready.set()
+        self._alivewake.set()
         self.messages.clear()
-        # clear devices etc
-        self.clear()
+        self._stopvectortimers()
+        self._resyncing = False
+        if self._resync:
+            # keep the devices, marking their vectors stale until they are redefined
+            for device in self.data.values():
+                for vector in device.values():
+                    if vector.enable:
+                        vector.stale = True
+        else:
+            # clear devices etc
+            self.clear()
 
 
 
     async def send(self, xmldata):
         """Transmits xmldata, this is an internal method, not normally called by a user.
-           xmldata is an xml.etree.ElementTree object"""
+           xmldata is an xml.etree.ElementTree object
+
+           The data is added to a queue, written to the port by a single writer task, and this
+           returns when the data has been written and drained, or the connection has closed."""
         if not self.connected:
             return
         if self._stop:
             return
+        stats = self._stats
+        if stats is not None:
+            start = time.perf_counter()
         try:
             # send it out on the port
             binarydata = ET.tostring(xmldata)
-            # Send to the port
-            self._writer.write(binarydata)
-            await self._writer.drain()
-            if self.timeout_enable:
-                # data has been transmitted set timers going, do not set timer
-                # for enableBLOB as no answer is expected for that
-                if (self.tx_timer is None) and (xmldata.tag != "enableBLOB"):
-                    self.tx_timer = time.time()
-            self.idle_timer = time.time()
-            if logger.isEnabledFor(logging.DEBUG):
-                self._logtx(xmldata)
         except Exception:
-            await self.warning(f"Sending Error on {self.indihost}:{self.indiport}")
-            await self._clear_connection()
+            await self._txerror()
+            return
+        if stats is not None:
+            stats.add("serialize", time.perf_counter() - start, len(binarydata))
+        if xmldata.tag.startswith("new"):
+            await self._transmit(binarydata, xmldata, (xmldata.get("device"), xmldata.get("name")))
+        else:
+            await self._transmit(binarydata, xmldata)
 
 
-    async def _check_alive(self):
-        "Checks timers, drops connection on error"
+    async def _transmit(self, binarydata, xmldata=None, key=None):
+        """Transmits binarydata, the bytes of xmldata, or if xmldata is None, the bytes of a new vector
+           rendered from a vector template. binarydata can also be an asynchronous iterator of bytes,
+           used to stream a newBLOBVector, in which case xmldata is logged in its place.
+           key is the (devicename, vectorname) of a new vector, or None"""
+        if not self.connected:
+            return
+        if self._stop:
+            return
+        try:
+            # queue it for the _run_tx task, and wait for it to be written
+            flushed = self._txenqueue(binarydata, key)
+            if await flushed:
+                self._txsent(binarydata, xmldata)
+            # otherwise the connection closed before the data was written
+        except Exception:
+            await self._txerror()
+
+
+    def _txenqueue(self, binarydata, key=None):
+        "Adds binarydata to self._txqueues, and returns a future, set to True when written, or False if not sent"
+        flushed = asyncio.get_running_loop().create_future()
+        priority = self._txpriority.get(key)
+        if priority is None:
+            # BLOBs streamed are bulk, anything else is normal
+            priority = "normal" if isinstance(binarydata, bytes) else "bulk"
+        self._txqueues[priority].append((binarydata, flushed, key))
+        if isinstance(binarydata, bytes):
+            self._txqueuedbytes += len(binarydata)
+        self._txready.set()
+        return flushed
+
+
+    def _txsent(self, binarydata, xmldata):
+        "Sets the timers, and logs the data, once it has been written"
+        if self.timeout_enable:
+            # data has been transmitted set timers going, do not set timer
+            # for enableBLOB as no answer is expected for that
+            if (self.tx_timer is None) and ((xmldata is None) or (xmldata.tag != "enableBLOB")):
+                self.tx_timer = asyncio.get_running_loop().time()
+        self.idle_timer = asyncio.get_running_loop().time()
+        if not self._txlogged():
+            return
+        if not isinstance(binarydata, bytes):
+            # a stream, log xmldata instead, which is None if logging was enabled after it was queued
+            if xmldata is None:
+                return
+            if self._wirelog:
+                binarydata = ET.tostring(xmldata)
+        if self._wirelog:
+            wirelog.logwire("TX:: ", binarydata, self._verbose)
+        else:
+            if xmldata is None:
+                xmldata = ET.fromstring(binarydata)
+            self._logtx(xmldata)
+
+
+    def _txlogged(self):
+        "Returns True if transmitted data is logged, so a stream sender need only build its log xml if this is True"
+        if self._wirelog:
+            return bool(self._verbose) and wirelog.logger.isEnabledFor(logging.DEBUG)
+        return logger.isEnabledFor(logging.DEBUG)
+
+
+    async def _txerror(self):
+        "Called if writing to the port fails, closes the connection"
+        await self.warning(f"Sending Error on {self.indihost}:{self.indiport}")
+        await self._clear_connection()
+
+
+    def _txdone(self, flushed, binarydata, xmldata):
+        "Done callback of the future of data queued by send_newVector_nowait, as no sender awaits it"
+        if flushed.cancelled():
+            return
+        if flushed.exception() is not None:
+            asyncio.create_task(self._txerror())
+        elif flushed.result():
+            try:
+                self._txsent(binarydata, xmldata)
+            except Exception:
+                logger.exception("Exception report from IPyClient._txdone method")
+
+
+    @property
+    def txbuffered(self):
+        """The number of bytes waiting to be written to the port, being those queued by the client, and
+           those in the write buffer of the connection"""
+        if self._writer is None:
+            return 0
+        transport = getattr(self._writer, "transport", None)
+        if transport is None:
+            return self._txqueuedbytes
+        return self._txqueuedbytes + transport.get_write_buffer_size()
+
+
+    def set_tx_watermarks(self, high=65536, low=None):
+        """Sets the high and low watermarks, in bytes, of data waiting to be written to the port.
+
+           If the data buffered by the connection rises above high, writing pauses until it falls to low,
+           and send_newVector_nowait applies its policy, and wait_tx_ready waits, while the bytes given by
+           txbuffered are above high.
+           If low is None, it is set to a quarter of high. The defaults are those of asyncio, and can be
+           set before or while the client is running."""
+        if low is None:
+            low = high // 4
+        if (not isinstance(high, int)) or (not isinstance(low, int)) or low < 0 or high < low:
+            raise ValueError("The watermarks should be integers, with 0 <= low <= high")
+        self._txhigh = high
+        self._txlow = low
+        self._set_write_limits()
+
+
+    def _set_write_limits(self):
+        "Sets the watermarks into the transport of the connection"
+        if self._writer is None:
+            return
+        transport = getattr(self._writer, "transport", None)
+        if transport is not None:
+            transport.set_write_buffer_limits(high=self._txhigh, low=self._txlow)
 
+
+    def send_newVector_nowait(self, devicename, vectorname, timestamp=None, members={}, policy="reject"):
+        """Queues a new vector to be sent, and returns at once, without waiting for it to be written to the port.
+           This is not a coroutine, so can be called from synchronous code running in the event loop.
+           Returns True if the vector is queued, False if it is not.
+
+           members is a membername to value dictionary, as send_newVector, but BLOB vectors cannot be
+           sent with this method, and raise a ValueError.
+
+           If the bytes waiting to be written, given by txbuffered, are above the high watermark set by
+           set_tx_watermarks, then policy decides what happens:
+
+           |  "reject" - the vector is not sent, and this returns False.
+           |  "drop" - any earlier vectors for the same vector, queued and not yet written, are dropped,
+              and the vector is queued in place of them.
+
+           So a control loop could send with policy "drop", and if the connection is slow, a
+           stale value waiting to be sent is replaced by the latest value. To wait for the data
+           to be written instead, await the wait_tx_ready method before calling this."""
+        if policy not in ("reject", "drop"):
+            raise ValueError("The policy should be one of reject or drop")
+        device = self.data.get(devicename)
+        if device is None:
+            return False
+        propertyvector = device.get(vectorname)
+        if propertyvector is None:
+            return False
+        if propertyvector.vectortype == "BLOBVector":
+            raise ValueError("BLOB vectors cannot be sent with send_newVector_nowait")
+        if (not self.connected) or self._stop:
+            return False
+        key = (devicename, vectorname)
+        if self.txbuffered > self._txhigh:
+            if policy == "reject":
+                return False
+            self._txdrop(key)
+        binarydata, xmldata = self._newvectordata(propertyvector, timestamp, members)
+        if binarydata is None:
+            return False
+        propertyvector._starttimer()
+        flushed = self._txenqueue(binarydata, key)
+        flushed.add_done_callback(lambda f: self._txdone(f, binarydata, xmldata))
+        return True
+
+
+    async def wait_tx_ready(self):
+        """Waits until the bytes waiting to be written, given by txbuffered, are no longer above the high
+           watermark set by set_tx_watermarks, so send_newVector_nowait will queue a vector without applying
+           its policy. Returns True, or False if the client is not connected or is shutting down."""
+        while self.txbuffered > self._txhigh:
+            if (not self.connected) or self._stop:
+                return False
+            self._txdrained.clear()
+            await self._txdrained.wait()
+        return self.connected and (not self._stop)
+
+
+    def _newvectordata(self, propertyvector, timestamp, members):
+        """Returns (binarydata, xmldata) of a new switch, text or number vector, setting the vector state
+           to Busy. xmldata is None unless the bytes are created by ET.tostring, and binarydata is None
+           if the vector cannot be sent"""
+        if propertyvector.vectortype == "SwitchVector":
+            return propertyvector._newSwitchBytes(timestamp, members), None
+        if propertyvector.vectortype == "NumberVector":
+            return propertyvector._newNumberBytes(timestamp, members), None
+        if all(isinstance(value, str) for value in members.values()):
+            return propertyvector._newTextBytes(timestamp, members), None
+        # values which are not strings are left to ET.tostring to handle
+        xmldata = propertyvector._newTextVector(timestamp, members)
+        if xmldata is None:
+            return None, None
+        return ET.tostring(xmldata), xmldata
+
+
+    def _txdrop(self, key):
+        "Removes data with the given key from self._txqueues, setting their futures to False, as not sent"
+        for priority, txqueue in self._txqueues.items():
+            kept = collections.deque()
+            for item in txqueue:
+                binarydata, flushed, itemkey = item
+                if (itemkey == key) and isinstance(binarydata, bytes):
+                    self._txqueuedbytes -= len(binarydata)
+                    if not flushed.done():
+                        flushed.set_result(False)
+                else:
+                    kept.append(item)
+            self._txqueues[priority] = kept
+
+
+    def set_tx_priority(self, devicename, vectorname, priority="normal"):
+        """Sets the priority with which new vectors sent to the given vector are transmitted, one of
+           "control", "normal" or "bulk", or None to return to the default, which is "bulk" for
+           BLOB vectors, and "normal" for all others. Other messages, such as getProperties, are
+           always "normal".
+
+           Waiting messages are written in priority order, so a control message, such as an
+           emergency stop, is written ahead of any normal or bulk messages waiting, and normal
+           messages are written ahead of BLOBs waiting to be uploaded. Messages are always
+           written whole, so a BLOB already being written completes before anything else is
+           written. Messages of the same priority are written in the order sent."""
+        if priority is None:
+            self._txpriority.pop((devicename, vectorname), None)
+            return
+        if priority not in PRIORITIES:
+            raise ValueError("The priority should be one of control, normal, bulk or None")
+        self._txpriority[(devicename, vectorname)] = priority
+
+
+    async def _run_tx(self):
+        """Writes the data waiting in self._txqueues to the port, in priority order, and in the order
+           queued within each priority. Bytes waiting are written together with one call to writelines,
+           followed by one drain, and a stream is written a chunk at a time, draining after each chunk,
+           with nothing else written until it is complete"""
+        writer = self._writer
+        self._set_write_limits()
+        # the items taken from the queues, and being written
+        items = []
+        try:
+            while self.connected and (not self._stop):
+                items = self._txnext()
+                if not items:
+                    # all data has been written, wake any senders waiting for the data to drain
+                    self._txdrained.set()
+                    self._txready.clear()
+                    await self._txready.wait()
+                    continue
+                try:
+                    if isinstance(items[0][0], bytes):
+                        await self._txwrite(writer, items)
+                    else:
+                        await self._txstream(writer, items[0][0], items[0][1])
+                except Exception as e:
+                    # each sender handles the error
+                    for binarydata, flushed, key in items:
+                        if not flushed.done():
+                            flushed.set_exception(e)
+                    return
+        finally:
+            # if this task is cancelled while writing, the items taken from the queues are not sent
+            for binarydata, flushed, key in items:
+                if not flushed.done():
+                    flushed.set_result(False)
+            # the connection is closed, so any data waiting is not sent
+            for txqueue in self._txqueues.values():
+                while txqueue:
+                    binarydata, flushed, key = txqueue.popleft()
+                    if not isinstance(binarydata, bytes):
+                        # a stream not started, closed so its sources are closed now
+                        await binarydata.aclose()
+                    if not flushed.done():
+                        flushed.set_result(False)
+            self._txqueuedbytes = 0
+            self._txdrained.set()
+
+
+    def _txnext(self):
+        """Removes and returns the next items to be written from self._txqueues, being the bytes waiting,
+           in priority order, up to the first stream, or if a stream is first, that stream alone"""
+        items = []
+        for txqueue in self._txqueues.values():
+            while txqueue and isinstance(txqueue[0][0], bytes):
+                item = txqueue.popleft()
+                self._txqueuedbytes -= len(item[0])
+                items.append(item)
+            if txqueue:
+                # a stream, written after any bytes already taken, which have higher priority
+                if not items:
+                    items.append(txqueue.popleft())
+                break
+        return items
+
+
+    async def _txwrite(self, writer, batch):
+        "Writes the bytes of a batch of (bytes, future, key) items with one writelines and drain, then sets each future result"
+        if not batch:
+            return
+        binarylist = [item[0] for item in batch]
+        writer.writelines(binarylist)
+        if self._recorder is not None:
+            for binarydata in binarylist:
+                self._recorder.transmitted(binarydata)
+        if self._stats is None:
+            await writer.drain()
+        else:
+            start = time.perf_counter()
+            await writer.drain()
+            self._stats.add("drain", time.perf_counter() - start, sum(len(binarydata) for binarydata in binarylist))
+        for binarydata, flushed, key in batch:
+            if not flushed.done():
+                flushed.set_result(True)
+
+
+    async def _txstream(self, writer, stream, flushed):
+        """Writes each chunk of bytes from the asynchronous generator stream, draining after each, then sets
+           the future result. The stream is closed, closing its sources, even if cancelled or failed partway"""
+        try:
+            async for chunk in stream:
+                writer.write(chunk)
+                if self._recorder is not None:
+                    self._recorder.transmitted(chunk)
+                if self._stats is None:
+                    await writer.drain()
+                else:
+                    start = time.perf_counter()
+                    await writer.drain()
+                    self._stats.add("drain", time.perf_counter() - start, len(chunk))
+        finally:
+            await stream.aclose()
+        if not flushed.done():
+            flushed.set_result(True)
+
+
+    async def _check_alive(self):
+        """Checks timers, drops connection on error. This sleeps until the next timer deadline,
+           or until woken by self._alivewake, and as the idle and respond timers are moved on as
+           data is sent and received, on waking each deadline is recalculated, and if not yet
+           reached, the sleep continues until the new deadline"""
+        loop = asyncio.get_running_loop()
+        # the loop time at which a getProperties is sent, if no devices have been learnt
+        retrytime = loop.time()
         try:
-            count = -1 # increases by 1 every 0.1 seconds, after 5 seconds, goes to zero
             while self.connected and not self._stop:
-                await asyncio.sleep(0.1)
-                if self._stop:
-                    break
+                nowtime = loop.time()
+
+                if self._resyncing and (nowtime >= self._lastdefine + self._resynctime):
+                    # after a reconnect, definitions have stopped arriving, delete the vectors not redefined
+                    await self._reconcile()
+                    continue
 
-                count += 1
-                if count >= 50:      # 50 x 0.1 is 5 seconds
-                    count = 0
-                devices = list(device for device in self.data.values() if device.enable)
+                # devices kept stale from a previous connection are not counted, until they are redefined
+                devices = list(device for device in self.data.values() if device.enable and not device.stale)
 
                 # send a getProperties every five seconds if no devices have been learnt
-                if not count:
-                    # count is zero, on startup and every five seconds
-                    if not devices:
+                if not devices:
+                    if nowtime >= retrytime:
                         # no devices, send a getProperties
+                        retrytime = nowtime + 5.0
                         await self.send_getProperties()
                         await self.report("getProperties sent")
-
-                if not devices:
-                    # no point doing any further tests, continue while loop
+                    # no point doing any further tests, wait until the next retry
+                    await self._alivewait(loop, self._resyncdeadline(retrytime))
                     continue
 
-                # devices exist
+                # devices exist, so a getProperties is sent at once if they are all removed
+                retrytime = nowtime
 
                 # connection is up and devices exist
                 if self._blobfolderchanged:
@@ -508,36 +1272,25 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
                     # when the BLOBfolder changed, this ensures an
                     # enableBLOB is sent with that value
                     self._blobfolderchanged = False
+                    # these are queued together, so are written with a single drain
+                    resends = []
                     for device in devices:
-                        await self.resend_enableBLOB(device.devicename)
-                        if self._stop:
-                            break
+                        resends.append(self.resend_enableBLOB(device.devicename))
                         for vector in device.values():
                             if vector.enable and (vector.vectortype == "BLOBVector"):
-                                await self.resend_enableBLOB(device.devicename, vector.name)
-                                if self._stop:
-                                    break
-                        if self._stop:
-                            break
-                    # as enableBLOBs have been sent, leave
-                    # checking timeouts for the next count (0.1 second)
+                                resends.append(self.resend_enableBLOB(device.devicename, vector.name))
+                    await asyncio.gather(*resends)
                     continue
 
                 if not self.timeout_enable:
-                    # only test timeouts if this is True
+                    # only test timeouts if this is True, wait until woken
+                    await self._alivewait(loop, self._resyncdeadline(None))
                     continue
 
-                # test these timers every 0.5 seconds
-                if count % 5 :
-                    continue
-
-                nowtime = time.time()
-
                 # if nothing received after self.respond_timeout, break out
-                if self.tx_timer:
+                if self.tx_timer is not None:
                     # data has been sent, waiting for reply
-                    telapsed = nowtime - self.tx_timer
-                    if telapsed > self.respond_timeout:
+                    if nowtime >= self.tx_timer + self.respond_timeout:
                         # no response to transmission self.respond_timeout seconds ago
                         if not self._stop:
                             await self.warning("Error: Connection timed out")
@@ -545,19 +1298,20 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
 
                 # If nothing has been sent or received
                 # for self.idle_timeout seconds, send a getProperties
-                telapsed = nowtime - self.idle_timer
-                if telapsed > self.idle_timeout:
+                if nowtime >= self.idle_timer + self.idle_timeout:
                     await self.send_getProperties()
+                    if nowtime >= self.idle_timer + self.idle_timeout:
+                        # the getProperties was not sent, the connection has closed
+                        continue
 
-                # check if any vectors have timed out
-                for device in devices:
-                    for vector in device.values():
-                        if not vector.enable:
-                            continue
-                        if vector.checktimedout(nowtime):
-                            # Creat a VectorTimeOut event
-                            event = events.VectorTimeOut(device, vector)
-                            await self.rxevent(event)
+                # vector timeouts are not checked here, as each vector schedules
+                # its own timeout when a new vector is sent, see _vectortimedout
+
+                # sleep until the earliest deadline
+                deadline = self.idle_timer + self.idle_timeout
+                if self.tx_timer is not None:
+                    deadline = min(deadline, self.tx_timer + self.respond_timeout)
+                await self._alivewait(loop, self._resyncdeadline(deadline))
 
         except Exception:
             logger.exception("Error in IPyClient._check_alive method")
@@ -566,6 +1320,60 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
             await self._clear_connection()
 
 
+    def _resyncdeadline(self, deadline):
+        "Returns the earlier of deadline and the time stale vectors are deleted, if resyncing after a reconnect"
+        if not self._resyncing:
+            return deadline
+        resynctime = self._lastdefine + self._resynctime
+        if deadline is None:
+            return resynctime
+        return min(deadline, resynctime)
+
+
+    async def _alivewait(self, loop, deadline):
+        "Waits until the loop time deadline, or if deadline is None, until woken by self._alivewake"
+        self._alivewake.clear()
+        if deadline is None:
+            await self._alivewake.wait()
+            return
+        handle = loop.call_at(deadline, self._alivewake.set)
+        try:
+            await self._alivewake.wait()
+        finally:
+            handle.cancel()
+
+
+    def _vectortimedout(self, vector):
+        "Called by a vector when its timer expires, creates a task to pass a VectorTimeOut event to rxevent"
+        if (not self.connected) or self._stop:
+            return
+        device = self.data.get(vector.devicename)
+        if (device is None) or (not device.enable) or (not vector.enable):
+            return
+        if device.get(vector.name) is not vector:
+            # the vector has been replaced
+            return
+        task = asyncio.create_task(self._rxtimeout(events.VectorTimeOut(device, vector)))
+        # keep a reference to the task until it is done
+        self._timeouttasks.add(task)
+        task.add_done_callback(self._timeouttasks.discard)
+
+
+    async def _rxtimeout(self, event):
+        "Calls rxevent with a VectorTimeOut event"
+        try:
+            await self.rxevent(event)
+        except Exception:
+            logger.exception("Exception report from IPyClient.rxevent method")
+
+
+    def _stopvectortimers(self):
+        "Stops all vector timers, cancelling their scheduled timeouts, called as devices are cleared"
+        for device in self.data.values():
+            for vector in device.values():
+                vector._stoptimer()
+
+
     def _logtx(self, txdata):
         "log tx data with level debug, and detail depends on self._verbose"
         if not self._verbose:
@@ -597,6 +1405,9 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
         if not self._verbose:
             return
         startlog = "RX:: "
+        if isinstance(rxdata, Record):
+            # created by the expat receive engine
+            rxdata = rxdata.element()
         if self._verbose == 3:
             binarydata = ET.tostring(rxdata)
             logger.debug(startlog + binarydata.decode())
@@ -618,40 +1429,335 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
 
     async def _run_rx(self):
         "pass xml.etree.ElementTree data receive handler"
+        # the BLOBSink filters received data, streaming BLOBs to files if enabled
+        self._blobsink = BLOBSink(self)
+        try:
+            if self._rxengine != "framing":
+                await self._run_pullrx()
+            else:
+                await self._run_framingrx()
+        finally:
+            self._blobsink.close()
+            # cancel any tasks waiting for BLOBs to be decoded
+            for task in list(self._rxtasks.values()):
+                task.cancel()
+            self._rxtasks.clear()
+
+
+    async def _run_framingrx(self):
+        "Parse each message received by self._xmlinput and pass it to the receive handler"
+        loop = asyncio.get_running_loop()
+        # a task of self._xmlinput, still framing a message when a batch was dispatched,
+        # it is not cancelled, as the part of the message framed so far would be lost
+        pending = None
         try:
             # get block of xml.etree.ElementTree data
             # from self._xmlinput
             while self.connected and (not self._stop):
-                rxdata = await self._xmlinput()
+                if pending is None:
+                    rxdata = await self._xmlinput()
+                else:
+                    rxdata = await pending
+                    pending = None
                 if rxdata is None:
                     return
-                # and call the receive handler
-                await self._rxhandler(rxdata)
-                # log it, then continue with next block
-                if logger.isEnabledFor(logging.DEBUG):
-                    self._logrx(rxdata)
+                if not self._rxbatch:
+                    # call the receive handler
+                    await self._rxhandler(rxdata)
+                    # log it, then continue with next block
+                    if logger.isEnabledFor(logging.DEBUG) and not self._wirelog:
+                        self._logrx(rxdata)
+                    continue
+                # a batch is made from this message, the messages already received
+                # and waiting in the reader, and those received within self._rxbatchtime
+                batch = []
+                self._rxcurrent = batch
+                endtime = loop.time() + self._rxbatchtime
+                while True:
+                    await self._rxhandler(rxdata, batch)
+                    if logger.isEnabledFor(logging.DEBUG) and not self._wirelog:
+                        self._logrx(rxdata)
+                    if len(batch) >= self._rxbatch:
+                        break
+                    if pending is None:
+                        pending = asyncio.ensure_future(self._xmlinput())
+                    # the task frames a message already received in the reader without
+                    # suspending, otherwise it waits for further data, for the rest of
+                    # self._rxbatchtime, or only for that single step if it has passed
+                    remaining = max(endtime - loop.time(), 0)
+                    done, notdone = await asyncio.wait((pending,), timeout=remaining)
+                    if not done:
+                        # the message is given in the next batch
+                        break
+                    rxdata = pending.result()
+                    pending = None
+                    if rxdata is None:
+                        break
+                self._rxcurrent = None
+                if batch:
+                    await self._rxdispatch(batch)
         except ConnectionError:
             raise
         except Exception:
-            logger.exception("Exception report from IPyClient._run_rx")
+            logger.exception("Exception report from IPyClient._run_framingrx")
             raise
+        finally:
+            self._rxcurrent = None
+            if pending is not None:
+                pending.cancel()
+
+
+    async def _rxflush(self):
+        "Dispatches the events of the batch being collected, which continues to collect further events"
+        batch = self._rxcurrent
+        if batch:
+            events = batch[:]
+            batch.clear()
+            await self._rxdispatch(events)
+
+
+    async def _run_pullrx(self):
+        "Feed blocks of received data to an incremental parser, and pass each element to the receive handler"
+        try:
+            if self._rxengine == "pullparser":
+                parser = PullParser(self._rxmaxsize)
+            elif self._rxengine == "expat":
+                parser = ExpatParser(self._rxmaxsize)
+            else:
+                parser = self._rxengine(self._rxmaxsize)
+            while self.connected and (not self._stop):
+                data = await self._blockinput()
+                if data is None:
+                    return
+                if not self._rxbatch:
+                    await self._rxelements(parser, data, None)
+                    continue
+                # a batch is made from the messages in this block, and from further
+                # blocks received within self._rxbatchtime
+                batch = []
+                self._rxcurrent = batch
+                await self._rxelements(parser, data, batch)
+                if self._rxbatchtime:
+                    endtime = time.monotonic() + self._rxbatchtime
+                    while len(batch) < self._rxbatch:
+                        remaining = endtime - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        try:
+                            data = await asyncio.wait_for(self._blockinput(), remaining)
+                        except asyncio.TimeoutError:
+                            break
+                        if data is None:
+                            break
+                        await self._rxelements(parser, data, batch)
+                self._rxcurrent = None
+                if batch:
+                    await self._rxdispatch(batch)
+        except ConnectionError:
+            raise
+        except Exception:
+            logger.exception("Exception report from IPyClient._run_pullrx")
+            raise
+        finally:
+            self._rxcurrent = None
+
+
+    async def _rxelements(self, parser, data, batch):
+        """Feeds data to the parser, and passes each element parsed to the receive handler.
+           If batch is a list, events are added to it, and dispatched whenever it
+           reaches the maximum batch size."""
+        if self._stats is None:
+            rxlist = parser.feed(data)
+        else:
+            start = time.perf_counter()
+            rxlist = parser.feed(data)
+            self._stats.add("parse", time.perf_counter() - start, len(data))
+        while parser.discarded:
+            tag = parser.discarded.pop(0)
+            await self.warning(f"Received {tag} exceeds the maximum message size and has been discarded")
+        for rxdata in rxlist:
+            if not self.connected or self._stop:
+                return
+            await self._rxhandler(rxdata, batch)
+            if logger.isEnabledFor(logging.DEBUG) and not self._wirelog:
+                self._logrx(rxdata)
+            if (batch is not None) and (len(batch) >= self._rxbatch):
+                # cleared before dispatching, so events added meanwhile are kept for the next dispatch
+                events = batch[:]
+                batch.clear()
+                await self._rxdispatch(events)
+
+
+    def _rxenqueue(self, event):
+        "Adds the event to self._rxqueue, replacing any waiting set event for the same vector"
+        if (event.eventtype == "Set") and (event.vector.vectortype in self._conflation):
+            key = (event.devicename, event.vectorname)
+            if event.message:
+                # an event with a message is queued, and not replaced, so the message is not lost
+                self._rxlatest.pop(key, None)
+                self._rxsequence += 1
+                self._rxqueue[self._rxsequence] = event
+                return
+            sequence = self._rxlatest.get(key)
+            if sequence is not None:
+                # replace the waiting event, keeping its place in the queue, and
+                # keeping any of its members not updated by this event
+                event._merge(self._rxqueue[sequence])
+                self._rxqueue[sequence] = event
+                return
+            self._rxsequence += 1
+            self._rxqueue[self._rxsequence] = event
+            self._rxlatest[key] = self._rxsequence
+        else:
+            if event.eventtype.startswith("Define") or (event.eventtype == "Delete"):
+                # a later set event must follow this event, so should not replace one waiting before it
+                if event.vectorname is None:
+                    for key in [key for key in self._rxlatest if key[0] == event.devicename]:
+                        del self._rxlatest[key]
+                else:
+                    self._rxlatest.pop((event.devicename, event.vectorname), None)
+            self._rxsequence += 1
+            self._rxqueue[self._rxsequence] = event
+        self._rxready.set()
+
+
+    async def _run_dispatch(self):
+        """If conflation is enabled, this passes events waiting in self._rxqueue to rxevent or rxevents.
+           When the client is shut down, this continues until the _comms task has ended, and the
+           events waiting, ending with ConnectionLost, have been passed on."""
+        if not self._conflation:
+            return
+        try:
+            while True:
+                if not self._rxqueue:
+                    if self._stop and self._commsended:
+                        break
+                    self._rxready.clear()
+                    await self._rxready.wait()
+                    continue
+                if self._rxbatch:
+                    batch = []
+                    while self._rxqueue and (len(batch) < self._rxbatch):
+                        batch.append(self._rxdequeue())
+                    await self._rxdispatch(batch)
+                    continue
+                event = self._rxdequeue()
+                try:
+                    if self._stats is None:
+                        await self.rxevent(event)
+                    else:
+                        start = time.perf_counter()
+                        await self.rxevent(event)
+                        self._stats.add("rxevent", time.perf_counter() - start)
+                except Exception:
+                    logger.exception("Exception report from IPyClient.rxevent method")
+        finally:
+            self._rxqueue.clear()
+            self._rxlatest.clear()
+
+
+    def _rxdequeue(self):
+        "Removes and returns the first event in self._rxqueue"
+        sequence, event = self._rxqueue.popitem(last=False)
+        if event.eventtype == "Set":
+            key = (event.devicename, event.vectorname)
+            if self._rxlatest.get(key) == sequence:
+                del self._rxlatest[key]
+        return event
+
+
+    async def _rxdispatch(self, batch):
+        "Calls the user rxevents method with a batch of events"
+        try:
+            if self._stats is None:
+                await self.rxevents(batch)
+            else:
+                start = time.perf_counter()
+                await self.rxevents(batch)
+                self._stats.add("rxevent", time.perf_counter() - start)
+        except Exception:
+            logger.exception("Exception report from IPyClient.rxevents method")
+
+
+    async def _rxyield(self):
+        "Yields to other tasks if the receive loop has run for self._rxslice seconds since it last did"
+        now = asyncio.get_running_loop().time()
+        if now >= self._rxyieldtime:
+            await asyncio.sleep(0)
+            self._rxyieldtime = now + self._rxslice
+
+
+    async def _blockinput(self):
+        """Waits for a block of data from the port, of up to self._rxblocksize bytes
+           Returns None if notconnected/stop flags arises"""
+        while self.connected and (not self._stop):
+            await self._rxyield()
+            readstart = time.perf_counter() if self._stats is not None else None
+            try:
+                data = await self._reader.read(self._rxblocksize)
+            except ConnectionError:
+                raise
+            except Exception:
+                # the connection has failed
+                return
+            if not data:
+                # the connection has been closed by the server
+                return
+            # data received
+            if (readstart is not None) and (self._stats is not None):
+                self._stats.add("read", time.perf_counter() - readstart, len(data))
+            if self._recorder is not None:
+                self._recorder.received(data)
+            self.tx_timer = None
+            self.idle_timer = asyncio.get_running_loop().time()
+            # remove any BLOB content being streamed to a file
+            data = self._blobsink.filter(data)
+            if self._blobsink.congested():
+                # wait for the files to be written, rather than holding the content in memory
+                await self._blobsink.drain()
+            if data:
+                if self._wirelog and self._verbose and wirelog.logger.isEnabledFor(logging.DEBUG):
+                    wirelog.logwire("RX:: ", data, self._verbose)
+                return data
 
 
     async def _xmlinput(self):
         """get received data, parse it, and return it as xml.etree.ElementTree object
            Returns None if notconnected/stop flags arises"""
-        message = b''
+        # message is a bytearray, so each received chunk is added without copying
+        # the message received so far
+        message = bytearray()
         messagetagnumber = None
+        # set to the endtag of a message which exceeds self._rxmaxsize, following data
+        # is discarded until this endtag is received
+        discardto = None
+        # if stats are enabled, the time at which framing of the data received started
+        framingstart = None
         while self.connected and (not self._stop):
-            await asyncio.sleep(0)
+            if framingstart is not None:
+                self._stats.add("framing", time.perf_counter() - framingstart)
+                framingstart = None
             data = await self._datainput()
-            # data is either None, or binary data ending in b">"
+            # data is either None, or binary data ending in b">", or binary data
+            # which has exceeded self._rxmaxsize
             if data is None:
                 return
             if not self.connected:
                 return
             if self._stop:
                 return
+            if self._stats is not None:
+                framingstart = time.perf_counter()
+            if discardto:
+                # discarding an oversized message, only the last bytes are kept
+                # in case the endtag has been split between chunks
+                message.extend(data)
+                if message.endswith(discardto):
+                    discardto = None
+                    message = bytearray()
+                else:
+                    del message[:-len(discardto)]
+                continue
             if not message:
                 # data is expected to start with <tag, first strip any newlines
                 data = data.strip()
@@ -670,71 +1776,188 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
                     # and continue waiting for a valid message start
                     continue
                 # set this data into the received message
-                message = data
+                message.extend(data)
                 # either further children of this tag are coming, or maybe its a single tag ending in "/>"
                 if message.endswith(b'/>'):
                     # the message is complete, handle message here
+                    if framingstart is not None:
+                        framingstart = self._parsetime(framingstart)
                     try:
                         root = ET.fromstring(message.decode("utf-8"))
                     except ET.ParseError:
                        # failed to parse the message, continue at beginning
-                        message = b''
+                        message = bytearray()
                         messagetagnumber = None
                         continue
+                    if framingstart is not None:
+                        self._stats.add("parse", time.perf_counter() - framingstart, len(message))
                     # xml datablock done, return it
+                    if self._wirelog and self._verbose and wirelog.logger.isEnabledFor(logging.DEBUG):
+                        wirelog.logwire("RX:: ", message, self._verbose)
+                    return root
+            else:
+                # To reach this point, the message is in progress, with a messagetagnumber set
+                # keep adding the received data to message, until an endtag is reached
+                message.extend(data)
+                # only the end of the message, which includes the newly received data, is tested
+                if message.endswith(_ENDTAGS[messagetagnumber]):
+                    # the message is complete, handle message here
+                    if framingstart is not None:
+                        framingstart = self._parsetime(framingstart)
+                    try:
+                        root = ET.fromstring(message.decode("utf-8"))
+                    except ET.ParseError:
+                        # failed to parse the message, continue at beginning
+                        message = bytearray()
+                        messagetagnumber = None
+                        continue
+                    if framingstart is not None:
+                        self._stats.add("parse", time.perf_counter() - framingstart, len(message))
+                    # xml datablock done, return it
+                    if self._wirelog and self._verbose and wirelog.logger.isEnabledFor(logging.DEBUG):
+                        wirelog.logwire("RX:: ", message, self._verbose)
                     return root
-                # and read either the next message, or the children of this tag
-                continue
-            # To reach this point, the message is in progress, with a messagetagnumber set
-            # keep adding the received data to message, until an endtag is reached
-            message += data
-            if message.endswith(_ENDTAGS[messagetagnumber]):
-                # the message is complete, handle message here
-                try:
-                    root = ET.fromstring(message.decode("utf-8"))
-                except ET.ParseError:
-                    # failed to parse the message, continue at beginning
-                    message = b''
-                    messagetagnumber = None
-                    continue
-                # xml datablock done, return it
-                return root
             # so message is in progress, with a messagetagnumber set
-            # but no valid endtag received yet, so continue the loop
+            # but no valid endtag received yet, check its size and continue the loop
+            if self._rxmaxsize and (len(message) > self._rxmaxsize):
+                await self.warning(f"Received {TAGS[messagetagnumber].decode()} exceeds the maximum message size and has been discarded")
+                discardto = _ENDTAGS[messagetagnumber]
+                message = bytearray()
+                messagetagnumber = None
+
+
+    def _parsetime(self, framingstart):
+        "Adds the framing time of a message, and returns the time its parsing starts"
+        start = time.perf_counter()
+        self._stats.add("framing", start - framingstart)
+        return start
 
 
     async def _datainput(self):
         """Waits for binary string of data ending in > from the port
-           Returns None if notconnected/stop flags arises"""
-        binarydata = b""
+           Returns None if notconnected/stop flags arises.
+           If more than self._rxmaxsize bytes are received without a >
+           the data received so far is returned."""
+        binarydata = bytearray()
         while self.connected and (not self._stop):
-            await asyncio.sleep(0)
+            await self._rxyield()
+            readstart = time.perf_counter() if self._stats is not None else None
             try:
                 data = await self._reader.readuntil(separator=b'>')
             except asyncio.LimitOverrunError:
                 data = await self._reader.read(n=32000)
+            except ConnectionError:
+                raise
             except Exception:
-                binarydata = b""
-                await asyncio.sleep(0.1)
-                continue
+                # the connection has failed, or has been closed by the server
+                return
             if not data:
-                await asyncio.sleep(0.01)
-                continue
+                # the connection has been closed by the server
+                return
             # data received
+            if (readstart is not None) and (self._stats is not None):
+                self._stats.add("read", time.perf_counter() - readstart, len(data))
+            if self._recorder is not None:
+                self._recorder.received(data)
             self.tx_timer = None
-            self.idle_timer = time.time()
+            self.idle_timer = asyncio.get_running_loop().time()
+            # remove any BLOB content being streamed to a file
+            data = self._blobsink.filter(data)
+            if self._blobsink.congested():
+                # wait for the files to be written, rather than holding the content in memory
+                await self._blobsink.drain()
+            if not data:
+                continue
             if b">" in data:
-                binarydata = binarydata + data
-                return binarydata
+                if binarydata:
+                    binarydata.extend(data)
+                    return binarydata
+                return data
             # data has content but no > found
-            binarydata += data
-            # could put a max value here to stop this increasing indefinetly
+            binarydata.extend(data)
+            if self._rxmaxsize and (len(binarydata) > self._rxmaxsize):
+                return binarydata
+
+
+    async def _rxhandler(self, xmldata, batch=None):
+        """Populates the events using received data.
+           If batch is a list, the event is appended to it, rather than calling rxevent.
+           If self.BLOBexecutor is set, a setBLOBVector is decoded in the executor, and if
+           BLOBs are streamed to files, a setBLOBVector waits for its files to be written.
+           This data, and any further data for the same vector, is then handled in a task once
+           the decoding is done, so events for each vector remain in order."""
+        if (self.BLOBexecutor is None) and (not self._rxtasks) and (xmldata.tag != "setBLOBVector"):
+            await self._rxapply(xmldata, None, batch)
+            return
+        devicename = xmldata.get("device")
+        if devicename is None:
+            # system wide message, not associated with any vector
+            await self._rxapply(xmldata, None, batch)
+            return
+        vectorname = xmldata.get("name")
+        if vectorname:
+            previous = [task for key, task in self._rxtasks.items() if key == (devicename, vectorname) or key == (devicename, None)]
+        else:
+            # applies to the whole device, so wait for any vector of the device
+            previous = [task for key, task in self._rxtasks.items() if key[0] == devicename]
+        decoding = None
+        if xmldata.tag == "setBLOBVector":
+            contents = []
+            for member in xmldata:
+                if member.tag != "oneBLOB" or not member.text:
+                    continue
+                if member.text.startswith("#"):
+                    # streamed to a file, wait for it to be written
+                    complete = self._blobsink.complete(member.text)
+                    if complete is not None:
+                        previous.append(complete)
+                elif self.BLOBexecutor is not None:
+                    contents.append((member.get("name"), member.text))
+            if contents:
+                # start decoding now, though the result may wait for previous tasks to complete
+                loop = asyncio.get_running_loop()
+                decoding = loop.run_in_executor(self.BLOBexecutor, events.decodeBLOBs, contents)
+        if (not previous) and (decoding is None):
+            await self._rxapply(xmldata, None, batch)
+            return
+        key = (devicename, vectorname or None)
+        task = asyncio.create_task(self._rxordered(xmldata, previous, decoding))
+        self._rxtasks[key] = task
+        task.add_done_callback(lambda t: self._rxtasks.pop(key) if self._rxtasks.get(key) is t else None)
+
+
+    async def _rxordered(self, xmldata, previous, decoding):
+        "Waits for previous tasks, and files being written, and any BLOB decoding, then handles the received data"
+        try:
+            if previous:
+                await asyncio.wait(previous)
+            decoded = None
+            if decoding is not None:
+                decoded = await decoding
+            if self._rxbatch:
+                # this event is handled later than the batch it arrived in, so is given
+                # to rxevents as a batch of one
+                batch = []
+                await self._rxapply(xmldata, decoded, batch)
+                if batch:
+                    await self._rxdispatch(batch)
+            else:
+                await self._rxapply(xmldata, decoded)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Exception report from IPyClient._rxordered method")
 
 
-    async def _rxhandler(self, xmldata):
-        """Populates the events using received data"""
+    async def _rxapply(self, xmldata, decoded=None, batch=None):
+        """Populates the events using received data, decoded is an optional
+           dictionary of BLOB membername to bytes, which have already been decoded.
+           If batch is a list, the event is appended to it, otherwise rxevent is called."""
         try:
             devicename = xmldata.get("device")
+            stats = self._stats
+            if stats is not None:
+                start = time.perf_counter()
             try:
                 if devicename is None:
                     if xmldata.tag == "message":
@@ -749,7 +1972,7 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
                 elif devicename in self:
                     # device is known about
                     device = self[devicename]
-                    event = device.rxvector(xmldata)
+                    event = device.rxvector(xmldata, decoded)
                 elif xmldata.tag == "getProperties":
                     # device is not known about, but this is a getProperties, so raise an event
                     event = events.getProperties(xmldata, None, self)
@@ -767,42 +1990,119 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
                 await self.warning(str(pe))
                 return
 
+            if stats is not None:
+                stats.add("event", time.perf_counter() - start)
+                stats.received(devicename, xmldata.get("name"))
+
+            if self._resyncing and event.eventtype.startswith("Define"):
+                # a vector kept from the previous connection is redefined
+                event.vector.stale = False
+                self._lastdefine = asyncio.get_running_loop().time()
+
             if event.eventtype == "DefineBLOB":
                 # every time a defBLOBVector is received, send an enable BLOB instruction
                 await self.resend_enableBLOB(event.devicename, event.vectorname)
-            elif self._BLOBfolder and (event.eventtype == "SetBLOB"):
-                # If this event is a setblob, and if blobfolder has been defined, then save the blob to
-                # a file in blobfolder, and set the member.filename to the filename saved
-                loop = asyncio.get_running_loop()
-                # save the BLOB to a file, make filename from timestamp
-                timestampstring = event.timestamp.strftime('%Y%m%d_%H_%M_%S')
-                for membername, membervalue in event.items():
-                    if not membervalue:
-                        return
-                    sizeformat = event.sizeformat[membername]
-                    filename =  membername + "_" + timestampstring + sizeformat[1]
-                    counter = 0
-                    while True:
-                        filepath = self._BLOBfolder / filename
-                        if filepath.exists():
-                            # append a digit to the filename
-                            counter += 1
-                            filename = membername + "_" + timestampstring + "_" + str(counter) + sizeformat[1]
-                        else:
-                            # filepath does not exist, so a new file with this filepath can be created
-                            break
-                    await loop.run_in_executor(None, filepath.write_bytes, membervalue)
-                    # add filename to member
-                    memberobj = event.vector.member(membername)
-                    memberobj.filename = filename
+            elif event.eventtype == "Delete":
+                # wake the _check_alive task, which sends a getProperties if no devices remain
+                self._alivewake.set()
+            elif event.eventtype == "SetBLOB":
+                # dictionary of membername to path of saved files
+                savedpaths = {}
+                if self._BLOBfolder:
+                    # If blobfolder has been defined, then save the blob to
+                    # a file in blobfolder, and set the member.filename to the filename saved
+                    loop = asyncio.get_running_loop()
+                    for membername, membervalue in event.items():
+                        if not membervalue:
+                            return
+                        memberobj = event.vector.member(membername)
+                        if isinstance(membervalue, BLOBFile):
+                            # already streamed to a file
+                            memberobj.filename = membervalue.filename
+                            continue
+                        # save the BLOB to a file, make filename from timestamp
+                        filepath = self._BLOBfilepath(self._BLOBfolder, membername, event.timestamp, event.sizeformat[membername][1])
+                        if stats is not None:
+                            start = time.perf_counter()
+                        await loop.run_in_executor(self.BLOBexecutor, filepath.write_bytes, membervalue)
+                        if stats is not None:
+                            stats.add("blobsave", time.perf_counter() - start, len(membervalue))
+                        # add filename to member
+                        memberobj.filename = filepath.name
+                        savedpaths[membername] = filepath
+                if self.BLOBmemoryview:
+                    self._setBLOBviews(event, savedpaths)
+
+            if self._conflation:
+                # rxevent will be called by the _run_dispatch task
+                self._rxenqueue(event)
+                return
+
+            if batch is not None:
+                # the user rxevents method will be called with the batch
+                batch.append(event)
+                return
 
             # call the user event handling function
-            await self.rxevent(event)
+            if stats is None:
+                await self.rxevent(event)
+            else:
+                start = time.perf_counter()
+                await self.rxevent(event)
+                stats.add("rxevent", time.perf_counter() - start)
 
         except Exception:
-            logger.exception("Exception report from IPyClient._rxhandler method")
+            logger.exception("Exception report from IPyClient._rxapply method")
+
+
+
+    def _setBLOBviews(self, event, savedpaths):
+        """Replaces the BLOB values of the event, and of the vector members, with memoryviews.
+           Where the BLOB has been saved to a file, the view is of a memory map of the file,
+           so the decoded bytes are released."""
+        for membername, membervalue in event.items():
+            if isinstance(membervalue, BLOBFile):
+                view = membervalue.view()
+            elif membername in savedpaths:
+                view = mapfile(savedpaths[membername])
+            else:
+                view = memoryview(membervalue)
+            # the event mapping cannot be set with event[membername], so set its data dictionary
+            event.data[membername] = view
+            event.vector.member(membername).membervalue = view
+
+
+    def _BLOBfilepath(self, blobfolder, membername, timestamp, blobformat):
+        "Returns a path in blobfolder, which does not already exist, for a received BLOB"
+        timestampstring = timestamp.strftime('%Y%m%d_%H_%M_%S')
+        filename =  membername + "_" + timestampstring + blobformat
+        counter = 0
+        while True:
+            filepath = blobfolder / filename
+            if filepath.exists():
+                # append a digit to the filename
+                counter += 1
+                filename = membername + "_" + timestampstring + "_" + str(counter) + blobformat
+            else:
+                # filepath does not exist, so a new file with this filepath can be created
+                return filepath
 
 
+    def _streamedpath(self, reference):
+        """Called by the setBLOBVector event, given the reference which replaced the BLOB content
+           returns the path of the temporary file streamed by the BLOBSink, or None on failure"""
+        if self._blobsink is None:
+            return
+        return self._blobsink.pop(reference)
+
+
+    def _streamedBLOB(self, path, membername, timestamp, blobformat):
+        """Called by the setBLOBVector event, once all its members are valid, this renames
+           the file streamed by the BLOBSink, and returns a BLOBFile"""
+        filepath = self._BLOBfilepath(path.parent, membername, timestamp, blobformat)
+        path.replace(filepath)
+        return BLOBFile(filepath)
+
 
     def snapshot(self):
         """Take a snapshot of the client and returns an object which is a restricted copy
@@ -853,6 +2153,67 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
             raise
 
 
+    async def send_newVectors(self, entries, timestamp=None):
+        """Sends several new vectors together, entries is a list of (devicename, vectorname, members)
+           tuples, where members is a membername to value dictionary, as send_newVector, so a slew,
+           focus and exposure can be commanded at the same moment.
+
+           All entries are checked before any are sent, then all are created with the same timestamp,
+           and written to the port together, with a single drain. Each vector sent is set to Busy,
+           and its timeout timer started, as send_newVector. BLOB vectors cannot be sent with this
+           method, nor text vectors with values which are not strings, and as with send_newVector,
+           unknown devices and vectors are not sent.
+
+           Returns a list of results, one for each entry, True if the vector was sent, False if not."""
+        results = [False] * len(entries)
+        if (not self.connected) or self._stop:
+            return results
+        if timestamp is None:
+            timestamp = datetime.now(tz=timezone.utc)
+        # list of (index, propertyvector, members) to send
+        valid = []
+        for index, (devicename, vectorname, members) in enumerate(entries):
+            device = self.data.get(devicename)
+            if device is None:
+                continue
+            propertyvector = device.get(vectorname)
+            if (propertyvector is None) or (not propertyvector.enable):
+                continue
+            if propertyvector.vectortype not in ("SwitchVector", "TextVector", "NumberVector"):
+                continue
+            if (propertyvector._newtimestamp(timestamp) is None) or (not isinstance(members, dict)):
+                continue
+            if (propertyvector.vectortype == "TextVector") and (not all(isinstance(value, str) for value in members.values())):
+                # text values should be strings
+                continue
+            valid.append((index, propertyvector, members))
+        # list of (index, binarydata, xmldata, key) created
+        created = []
+        try:
+            for index, propertyvector, members in valid:
+                binarydata, xmldata = self._newvectordata(propertyvector, timestamp, members)
+                if binarydata is None:
+                    continue
+                propertyvector._starttimer()
+                created.append((index, binarydata, xmldata, (propertyvector.devicename, propertyvector.name)))
+        except Exception:
+            logger.exception("Exception report from IPyClient.send_newVectors method")
+            raise
+        # queue them all, without awaiting, so the _run_tx task writes them together
+        futures = [self._txenqueue(binarydata, key) for index, binarydata, xmldata, key in created]
+        flushed = await asyncio.gather(*futures, return_exceptions=True)
+        error = False
+        for (index, binarydata, xmldata, key), result in zip(created, flushed):
+            if isinstance(result, Exception):
+                error = True
+            elif result:
+                self._txsent(binarydata, xmldata)
+                results[index] = True
+        if error:
+            await self._txerror()
+        return results
+
+
     def set_vector_timeouts(self, timeout_enable=None, timeout_min=None, timeout_max=None):
         """The INDI protocol allows the server to suggest a timeout for each vector. This
            method allows you to set minimum and maximum timeouts which restricts the
@@ -873,6 +2234,75 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
             self.vector_timeout_max = timeout_max
             self.idle_timeout = 2 * timeout_max
             self.respond_timeout = 4 * timeout_max
+        # the _check_alive task recalculates its deadlines
+        self._alivewake.set()
+        # reschedule the timeouts of any running vector timers with the new values
+        for device in self.data.values():
+            for vector in device.values():
+                if vector._timer:
+                    vector._scheduletimeout()
+
+
+    def set_reconnect(self, delay=5.0, maxdelay=None, factor=2.0, jitter=0.0):
+        """Sets the delay in seconds before attempting to reconnect after the connection fails.
+           After each failed attempt, the delay is multiplied by factor, up to maxdelay seconds,
+           and returns to delay once connected. If maxdelay is None, it is set to delay, so every
+           attempt waits the same time.
+
+           jitter is a fraction from 0 to 1, and each delay is reduced by up to this fraction at
+           random, so many clients of a restarted server do not all reconnect at the same moment.
+
+           As default, every attempt waits five seconds."""
+        if maxdelay is None:
+            maxdelay = delay
+        if delay <= 0 or maxdelay < delay or factor < 1:
+            raise ValueError("The delay should be positive, maxdelay at least delay, and factor at least 1")
+        if not 0 <= jitter <= 1:
+            raise ValueError("The jitter should be between 0 and 1")
+        self._reconnectdelay = delay
+        self._reconnectmax = maxdelay
+        self._reconnectfactor = factor
+        self._reconnectjitter = jitter
+        self._retrydelay = delay
+
+
+    def set_resync(self, enable=True, resynctime=10.0):
+        """If enabled, devices and vectors are kept when the connection is lost, rather than cleared,
+           so a user interface showing them does not have to rebuild them after a reconnect.
+
+           When the connection is lost, each enabled vector has its attribute stale set True. After
+           reconnecting, the definitions received update the existing vectors in place, keeping their
+           itemid values, and set stale to False. Once no definition has been received for resynctime
+           seconds, any vectors still stale are deleted, as if a delProperty had been received, so
+           a Delete event is given for each vector, or for each device if all its vectors are stale.
+
+           As default this is disabled, and all devices are cleared when the connection is lost."""
+        if resynctime <= 0:
+            raise ValueError("The resynctime should be positive")
+        self._resync = enable
+        self._resynctime = resynctime
+
+
+    async def _reconcile(self):
+        "Deletes stale vectors, which have not been redefined since the client reconnected"
+        self._resyncing = False
+        for device in list(self.data.values()):
+            if not device.enable:
+                continue
+            if device.stale:
+                # delete the whole device
+                xmldata = ET.Element('delProperty', {"device":device.devicename})
+                await self._rxhandler(xmldata)
+                device.disable()
+                continue
+            for vector in list(device.values()):
+                if vector.enable and vector.stale:
+                    xmldata = ET.Element('delProperty', {"device":device.devicename, "name":vector.name})
+                    await self._rxhandler(xmldata)
+                    vector.enable = False
+        for device in self.data.values():
+            for vector in device.values():
+                vector.stale = False
 
 
     async def send_getProperties(self, devicename=None, vectorname=None):
@@ -978,15 +2408,38 @@ Setting it to None will transmit an enableBLOB for all devices set to the enable
         pass
 
 
+    async def rxevents(self, eventlist):
+        """If batched receive dispatch is enabled with the set_receive_batch method, this is called
+           with a list of events, after all of them have been applied to the devices and vectors.
+           As default it calls rxevent for each event in turn. It is available to be overridden
+           to handle the batch together, for example to redraw a display once for each batch."""
+        for event in eventlist:
+            await self.rxevent(event)
+
+
     async def asyncrun(self):
         "Await this method to run the client."
         self._stop = False
+        self._commsended = False
+        self._stopping.clear()
+        self._loop = asyncio.get_running_loop()
+        if self._wirelogger is not None:
+            self._wirelogger.start()
+        if self._recordpath is not None:
+            self._recorder = recorder.Recorder(self._recordpath)
         try:
-            await asyncio.gather(self._comms(), self.hardware())
+            await asyncio.gather(self._comms(), self.hardware(), self._run_dispatch())
         except asyncio.CancelledError:
             self._stop = True
             raise
         finally:
+            if self._wirelogger is not None:
+                self._wirelogger.stop()
+            if self._recorder is not None:
+                self._recorder.close()
+                self._recorder = None
+            self._connstate = "stopped"
+            self._loop = None
             self.stopped.set()
             self._stop = True
 
@@ -1182,9 +2635,19 @@ class Device(_ParentDevice):
         raise KeyError
 
 
-    def rxvector(self, root):
+    @property
+    def stale(self):
+        """Returns True if this device is enabled, but none of its enabled vectors have been
+           redefined since the client reconnected, see IPyClient.set_resync"""
+        enabled = [vector for vector in self.data.values() if vector.enable]
+        return bool(enabled) and all(vector.stale for vector in enabled)
+
+
+    def rxvector(self, root, decoded=None):
         """Handle received data, sets new propertyvector into self.data,
-           or updates existing property vector and returns an event"""
+           or updates existing property vector and returns an event.
+           decoded is an optional dictionary of BLOB membername to bytes, used
+           if a setBLOBVector has already been decoded"""
 
         if (root.tag in DEFTAGS) and (not self.enable):
             # if this device is disabled, but about to become enabled
@@ -1217,7 +2680,7 @@ class Device(_ParentDevice):
             elif root.tag == "defBLOBVector":
                 return events.defBLOBVector(root, self, self._client)
             elif root.tag == "setBLOBVector":
-                return events.setBLOBVector(root, self, self._client)
+                return events.setBLOBVector(root, self, self._client, decoded)
             elif root.tag == "getProperties":
                 return events.getProperties(root, self, self._client)
             else:
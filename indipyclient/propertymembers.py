@@ -1,7 +1,9 @@
 
 import xml.etree.ElementTree as ET
 
-import pathlib
+import pathlib, mmap, functools
+
+from datetime import datetime, timezone
 
 from base64 import standard_b64encode
 
@@ -58,6 +60,150 @@ def getfloat(value):
     return floatvalue
 
 
+@functools.lru_cache(maxsize=64)
+def _parse_seconds(timestamp_string):
+    """Parse the whole seconds part of a timestamp string, returning a tuple of
+       (year, month, day, hour, minute, second, microsecond).
+       This is cached, since a server sends the same second many times."""
+    t = datetime.fromisoformat(timestamp_string)
+    return (t.year, t.month, t.day, t.hour, t.minute, t.second, t.microsecond)
+
+
+def _parse_timestamp(timestamp_string):
+    """Parse a timestamp string and return a datetime object
+       If the given timestamp_string cannot be parsed, returns
+       the datetime for the current time. Everything is UTC"""
+    if timestamp_string:
+        try:
+            # the fractional part is not supported by datetime.fromisoformat,
+            # and changes with every message, so only the whole seconds are cached
+            timestamp_string, point, remainder = timestamp_string.rpartition('.')
+            if not point:
+                return datetime(*_parse_seconds(remainder), tzinfo=timezone.utc)
+            year, month, day, hour, minute, second, microsecond = _parse_seconds(timestamp_string)
+            if remainder:
+                # microseconds, padded or truncated to six digits
+                microsecond = int(remainder[:6].ljust(6, '0'))
+            else:
+                microsecond = 0
+            return datetime(year, month, day, hour, minute, second, microsecond, timezone.utc)
+        except Exception:
+            pass
+    return datetime.now(tz=timezone.utc)
+
+
+def mapfile(path):
+    """Returns a read-only memoryview over a memory map of the file at path, so the file
+       contents are shared by all users of the view rather than copied into memory."""
+    with open(path, "rb") as fp:
+        try:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            return memoryview(b'')
+    return memoryview(mapped)
+
+
+class BLOBFile:
+    """If the client BLOBstreaming attribute is True, and a BLOBfolder is set, received BLOBs
+       are decoded directly to files, and the BLOB value is an instance of this class
+       rather than a bytes object.
+
+       Attribute path is the pathlib.Path of the saved file, and filename its name.
+       The read() method loads and returns the file contents as bytes, the view() method
+       returns a memoryview over a memory map of the file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.filename = path.name
+        self._view = None
+
+    def read(self):
+        "Returns the contents of the file as bytes"
+        return self.path.read_bytes()
+
+    def view(self):
+        """Returns a read-only memoryview of the file contents. The file is memory mapped
+           on the first call, and the same view returned to further calls, so is shared
+           rather than copied."""
+        if self._view is None:
+            self._view = mapfile(self.path)
+        return self._view
+
+    def __fspath__(self):
+        return str(self.path)
+
+    def __repr__(self):
+        return f"BLOBFile({self.filename!r})"
+
+
+class BLOBSource:
+    """Reads a BLOB value being sent, in chunks of base64 encoded bytes, so a file is sent
+       without being read into memory. The value can be bytes, a bytearray or memoryview,
+       a BLOBFile, a pathlib.Path or string path to a file, or a file-like object opened
+       in binary mode, which is read from its start, and closed by the close method.
+       As these read files, it should be created, and its read method called, in an executor."""
+
+    # a multiple of three bytes, so each chunk is encoded without padding, and
+    # the encoded chunks join to give the encoding of the whole value
+    CHUNKSIZE = 3 * 65536
+
+    def __init__(self, value):
+        if not value:
+            raise ValueError("The BLOB value is empty")
+        self._view = None
+        self._fp = None
+        self._position = 0
+        self.size = 0
+        try:
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                self._view = memoryview(value).cast("B")
+                self.size = self._view.nbytes
+            else:
+                if hasattr(value, "seek") and hasattr(value, "read") and callable(value.read):
+                    # a file-like object
+                    self._fp = value
+                else:
+                    # could be a BLOBFile, or a path to a file
+                    self._fp = open(value, "rb")
+                self.size = self._fp.seek(0, 2)
+                self._fp.seek(0)
+                if not isinstance(self._fp.read(0), bytes):
+                    raise TypeError
+        except Exception:
+            self.close()
+            raise ValueError("Unable to read the given BLOB value")
+        if not self.size:
+            self.close()
+            raise ValueError("The BLOB value is empty")
+
+    def read(self):
+        "Returns the next chunk of the value, base64 encoded, or an empty bytes object when all has been read"
+        if self._view is not None:
+            chunk = self._view[self._position:self._position+self.CHUNKSIZE]
+            self._position += len(chunk)
+        elif self._fp is not None:
+            chunk = self._fp.read(self.CHUNKSIZE)
+            # a raw stream may return less than requested before the end of the file
+            while chunk and len(chunk) < self.CHUNKSIZE:
+                more = self._fp.read(self.CHUNKSIZE - len(chunk))
+                if not more:
+                    break
+                chunk += more
+        else:
+            return b''
+        if not chunk:
+            return b''
+        return standard_b64encode(chunk)
+
+    def close(self):
+        "Closes any file being read"
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        self._view = None
+
+
 class Member():
     """This class is the parent of further member classes."""
 
@@ -522,6 +668,10 @@ class BLOBMember(ParentBLOBMember):
         try:
             if isinstance(value, bytes):
                 bytescontent = value
+            elif isinstance(value, BLOBFile):
+                bytescontent = value.read()
+            elif isinstance(value, (memoryview, bytearray)):
+                bytescontent = bytes(value)
             elif isinstance(value, pathlib.Path):
                 bytescontent = value.read_bytes()
             elif hasattr(value, "seek") and hasattr(value, "read") and callable(value.read):
@@ -5,7 +5,64 @@ from datetime import datetime, timezone
 
 import xml.etree.ElementTree as ET
 
-from .propertymembers import SwitchMember, LightMember, TextMember, NumberMember, BLOBMember, ParseException
+from .propertymembers import SwitchMember, LightMember, TextMember, NumberMember, BLOBMember, BLOBSource, ParseException, _parse_timestamp
+
+
+# marks where the timestamp and member values are spliced into a NewTemplate,
+# the NUL character cannot occur in received device, vector or member names
+_SPLICE = "\x00"
+
+
+def _escapetext(value):
+    "Returns the string value as bytes, escaped and encoded as ET.tostring encodes element text"
+    if ("&" in value) or ("<" in value) or (">" in value):
+        value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return value.encode("ascii", "xmlcharrefreplace")
+
+
+class NewTemplate:
+
+    """Pre-rendered bytes of a new vector, created by ET.tostring from an xml skeleton of the vector,
+       into which the timestamp and member values are spliced when sending, giving the same bytes as
+       ET.tostring of the xml created by the _newSwitchVector, _newTextVector and _newNumberVector methods."""
+
+    __slots__ = ('_start', '_members', '_end')
+
+    def __init__(self, tag, devicename, vectorname, membertag, membernames):
+        xmldata = ET.Element(tag)
+        xmldata.set("device", devicename)
+        xmldata.set("name", vectorname)
+        xmldata.set("timestamp", _SPLICE)
+        # the bytes up to the timestamp value
+        self._start = ET.tostring(xmldata).split(_SPLICE.encode())[0]
+        self._end = b'</' + tag.encode() + b'>'
+        # dictionary of membername to (start, end, empty) bytes, where start and end surround the
+        # member value, and empty is the whole member element if the value is an empty string
+        self._members = {}
+        for membername in membernames:
+            member = ET.Element(membertag)
+            member.set("name", membername)
+            member.text = _SPLICE
+            start, end = ET.tostring(member).split(_SPLICE.encode())
+            member.text = ""
+            self._members[membername] = (start, end, ET.tostring(member))
+
+    def render(self, timestamp, items):
+        "Returns the bytes of the new vector, given the timestamp string and a list of (membername, value string)"
+        if not items:
+            return self._start + timestamp.encode() + b'" />'
+        parts = [self._start, timestamp.encode(), b'">']
+        members = self._members
+        for membername, value in items:
+            start, end, empty = members[membername]
+            if value:
+                parts.append(start)
+                parts.append(_escapetext(value))
+                parts.append(end)
+            else:
+                parts.append(empty)
+        parts.append(self._end)
+        return b''.join(parts)
 
 
 class Vector(collections.UserDict):
@@ -26,9 +83,10 @@ class Vector(collections.UserDict):
         self.label = label
         self.group = group
         self._state = state
-        self.timestamp = timestamp
+        # timestamps may be held as received strings, parsed when accessed
+        self._timestamp = timestamp
         self.message = message
-        self.message_timestamp = timestamp
+        self._message_timestamp = timestamp
         self.vectortype = self.__class__.__name__
         self.devicename = None
         self._rule = None
@@ -37,6 +95,26 @@ class Vector(collections.UserDict):
         # if self.enable is False, this property is 'deleted'
         self.enable = True
 
+    @property
+    def timestamp(self):
+        if isinstance(self._timestamp, str):
+            self._timestamp = _parse_timestamp(self._timestamp)
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._timestamp = value
+
+    @property
+    def message_timestamp(self):
+        if isinstance(self._message_timestamp, str):
+            self._message_timestamp = _parse_timestamp(self._message_timestamp)
+        return self._message_timestamp
+
+    @message_timestamp.setter
+    def message_timestamp(self, value):
+        self._message_timestamp = value
+
     @property
     def state(self):
         return self._state
@@ -187,6 +265,15 @@ class PropertyVector(Vector):
         self._timer = False   # Set true when a timer is going after a newvector is sent
                               # set False when a setvector is received
         self._newtimer = 0    # Set to time.time() when a new vector is sent
+        # asyncio.TimerHandle, scheduled to call self._timedout when the timer expires
+        self._timerhandle = None
+
+        # set True when the connection is lost, if the client is set to resync, and set False
+        # again when the vector is redefined after the client reconnects
+        self.stale = False
+
+        # a NewTemplate, created when a new vector is first sent after the vector is defined
+        self._template = None
 
         # the user_string is available to be any string a user of
         # this device may wish to set
@@ -207,26 +294,105 @@ class PropertyVector(Vector):
         await self._client.rxevent(event)
 
 
+    def _timeoutseconds(self):
+        "Returns the vector timeout, limited to the client vector_timeout_min and vector_timeout_max"
+        if self.timeout > self._client.vector_timeout_max:
+            return self._client.vector_timeout_max
+        if self.timeout < self._client.vector_timeout_min:
+            return self._client.vector_timeout_min
+        return self.timeout
+
     def checktimedout(self, nowtime):
         "Returns True if a timedout has occured, False otherwise"
 
         if not self._client.timeout_enable:
-            self._timer = False
+            self._stoptimer()
         if not self._timer:
             return False
         # so timer is running
-        if self.timeout > self._client.vector_timeout_max:
-            t = self._client.vector_timeout_max
-        elif self.timeout < self._client.vector_timeout_min:
-            t = self._client.vector_timeout_min
-        else:
-            t = self.timeout
-        if nowtime > self._newtimer + t:
+        if nowtime > self._newtimer + self._timeoutseconds():
             # timed out
-            self._timer = False
+            self._stoptimer()
+            if self._client._stats is not None:
+                self._client._stats.timedout(self.devicename, self.name)
             return True
         return False
 
+    def _starttimer(self):
+        "Called as a new vector is sent, starts the timer, and schedules its timeout"
+        self._timer = True
+        self._newtimer = time.time()
+        self._scheduletimeout()
+
+    def _scheduletimeout(self):
+        """Schedules self._timedout to be called by the event loop when the running timer expires,
+           replacing any earlier schedule, so no polling is needed to detect a timeout"""
+        if self._timerhandle is not None:
+            self._timerhandle.cancel()
+            self._timerhandle = None
+        if self._timer and self._client.timeout_enable:
+            delay = self._newtimer + self._timeoutseconds() - time.time()
+            self._timerhandle = asyncio.get_running_loop().call_later(max(delay, 0.0), self._timedout)
+
+    def _stoptimer(self):
+        "Stops the timer, and cancels its scheduled timeout"
+        self._timer = False
+        if self._timerhandle is not None:
+            self._timerhandle.cancel()
+            self._timerhandle = None
+
+    def _timedout(self):
+        "Called by the event loop when the timer expires, as no reply has been received"
+        self._timerhandle = None
+        if not self._timer:
+            return
+        self._timer = False
+        if self._client._stats is not None:
+            self._client._stats.timedout(self.devicename, self.name)
+        self._client._vectortimedout(self)
+
+    def _replied(self):
+        "Called as a set vector is received, turns off the timer, and if stats are enabled, records the round trip time"
+        if self._timer:
+            stats = self._client._stats
+            if stats is not None:
+                stats.roundtrip(self.devicename, self.name, max(time.time() - self._newtimer, 0.0))
+        self._stoptimer()
+
+    def _newtimestamp(self, timestamp):
+        "Returns the timestamp string for a new vector, creating it if timestamp is None, or None if the timestamp is invalid"
+        if timestamp is None:
+            timestamp = datetime.now(tz=timezone.utc)
+        if not isinstance(timestamp, datetime):
+            # invalid timestamp given
+            return
+        if timestamp.tzinfo is not None:
+            if timestamp.tzinfo == timezone.utc:
+                timestamp = timestamp.replace(tzinfo = None)
+            else:
+                # invalid timestamp
+                return
+        # timestamp has no tzinfo so isoformat does not include timezone info
+        return timestamp.isoformat(sep='T')
+
+    def _newbytes(self, timestamp, items):
+        """Returns the bytes of a new vector, given the timestamp string, and a list of (membername, value string),
+           rendered by the vector template, which is created if the vector has been defined since the last send"""
+        stats = self._client._stats
+        if stats is not None:
+            start = time.perf_counter()
+        if self._template is None:
+            self._template = NewTemplate(self._newtag, self.devicename, self.name, self._onetag, self.data.keys())
+        binarydata = self._template.render(timestamp, items)
+        if stats is not None:
+            stats.add("serialize", time.perf_counter() - start, len(binarydata))
+        return binarydata
+
+    async def _sendbytes(self, binarydata):
+        "Transmits the bytes of a new vector, and starts the vector timer"
+        self._starttimer()
+        await self._client._transmit(binarydata, None, (self.devicename, self.name))
+
     def checkvalue(self, value, allowed):
         "allowed is a list of values, checks if value is in it"
         if value not in allowed:
@@ -256,20 +422,21 @@ class PropertyVector(Vector):
             return
         if event.state:
             self.state = event.state
-        if event.timestamp:
-            self.timestamp = event.timestamp
+        if event._timestamp:
+            self._timestamp = event._timestamp
         if event.message:
             self.message = event.message
-            self.message_timestamp = event.timestamp
+            self._message_timestamp = event._timestamp
         if hasattr(event, 'timeout'):
-            if self.timeout is not None:
+            # a set vector without a timeout leaves the timeout unchanged
+            if (self.timeout is not None) and (event.timeout is not None):
                 self.timeout = event.timeout
-        for membername, membervalue in event.items():
+        for membername, membervalue in event._memberitems():
             if membername in self.data:
                 member = self.data[membername]
                 member.membervalue = membervalue
         # turn off timer if all updates are successful
-        self._timer = False
+        self._replied()
 
 
     def snapshot(self):
@@ -306,9 +473,13 @@ class SwitchVector(PropertyVector):
 
        """
 
+    # tags of the new vector, and its members, sent by this vector
+    _newtag = "newSwitchVector"
+    _onetag = "oneSwitch"
+
     def __init__(self, event):
         super().__init__(event.vectorname, event.label, event.group, event.state,
-                         event.timestamp, event.message, event.device, event._client)
+                         event._timestamp, event.message, event.device, event._client)
         self._perm = event.perm
         self._rule = event.rule
         self.timeout = event.timeout
@@ -339,7 +510,9 @@ class SwitchVector(PropertyVector):
 
     def _defvector(self, event):
         "Updates this vector with new values after a def... vector has been received"
-        self._timer = False
+        self._stoptimer()
+        # members may have changed, so any template is re-created when next sent
+        self._template = None
         if event.label:
             self.label = event.label
         if event.group:
@@ -350,11 +523,11 @@ class SwitchVector(PropertyVector):
             self.rule = event.rule
         if event.state:
             self.state = event.state
-        if event.timestamp:
-            self.timestamp = event.timestamp
+        if event._timestamp:
+            self._timestamp = event._timestamp
         if event.message:
             self.message = event.message
-            self.message_timestamp = event.timestamp
+            self._message_timestamp = event._timestamp
         self.timeout = event.timeout
         # create  members
         for membername, membervalue in event.items():
@@ -415,6 +588,28 @@ class SwitchVector(PropertyVector):
             xmldata.append(switch.oneswitch(value))
         return xmldata
 
+    def _newSwitchBytes(self, timestamp=None, members={}):
+        "Returns the bytes of a newSwitchVector, the same as ET.tostring of the xmldata created by _newSwitchVector"
+        if not self.enable:
+            return
+        timestamp = self._newtimestamp(timestamp)
+        if timestamp is None:
+            return
+        self.state = 'Busy'
+        # for rule 'OneOfMany' the standard indicates 'Off' should precede 'On'
+        # so make all 'On' values last
+        Offswitches = []
+        Onswitches = []
+        for membername, value in members.items():
+            # check this membername exists
+            if membername not in self:
+                continue
+            if value == 'Off':
+                Offswitches.append((membername, value))
+            elif value == 'On':
+                Onswitches.append((membername, value))
+        return self._newbytes(timestamp, Offswitches + Onswitches)
+
 
     async def send_newSwitchVector(self, timestamp=None, members={}):
         """Transmits the vector (newSwitchVector) and the members given in the members
@@ -422,12 +617,10 @@ class SwitchVector(PropertyVector):
            The values should be strings of either On or Off.
            This method will encode and transmit the xml, and change the vector state to busy.
            If no timestamp is given, a current UTC time will be created."""
-        xmldata = self._newSwitchVector(timestamp, members)
-        if xmldata is None:
+        binarydata = self._newSwitchBytes(timestamp, members)
+        if binarydata is None:
             return
-        self._timer = True
-        self._newtimer = time.time()
-        await self._client.send(xmldata)
+        await self._sendbytes(binarydata)
 
 
 class LightVector(PropertyVector):
@@ -443,7 +636,7 @@ class LightVector(PropertyVector):
 
     def __init__(self, event):
         super().__init__(event.vectorname, event.label, event.group, event.state,
-                         event.timestamp, event.message, event.device, event._client)
+                         event._timestamp, event.message, event.device, event._client)
         self._perm = "ro"
         self.timeout = None
         # self.data is a dictionary of light name : lightmember
@@ -475,11 +668,11 @@ class LightVector(PropertyVector):
             self.group = event.group
         if event.state:
             self.state = event.state
-        if event.timestamp:
-            self.timestamp = event.timestamp
+        if event._timestamp:
+            self._timestamp = event._timestamp
         if event.message:
             self.message = event.message
-            self.message_timestamp = event.timestamp
+            self._message_timestamp = event._timestamp
         # create  members
         for membername, membervalue in event.items():
             if membername in self.data:
@@ -518,9 +711,13 @@ class TextVector(PropertyVector):
        is the string received."""
 
 
+    # tags of the new vector, and its members, sent by this vector
+    _newtag = "newTextVector"
+    _onetag = "oneText"
+
     def __init__(self, event):
         super().__init__(event.vectorname, event.label, event.group, event.state,
-                         event.timestamp, event.message, event.device, event._client)
+                         event._timestamp, event.message, event.device, event._client)
         self._perm = event.perm
         self.timeout = event.timeout
         # self.data is a dictionary of text name : textmember
@@ -541,7 +738,9 @@ class TextVector(PropertyVector):
 
     def _defvector(self, event):
         "Updates this vector with new values after a def... vector has been received"
-        self._timer = False
+        self._stoptimer()
+        # members may have changed, so any template is re-created when next sent
+        self._template = None
         if event.label:
             self.label = event.label
         if event.group:
@@ -550,11 +749,11 @@ class TextVector(PropertyVector):
             self.perm = event.perm
         if event.state:
             self.state = event.state
-        if event.timestamp:
-            self.timestamp = event.timestamp
+        if event._timestamp:
+            self._timestamp = event._timestamp
         if event.message:
             self.message = event.message
-            self.message_timestamp = event.timestamp
+            self._message_timestamp = event._timestamp
         self.timeout = event.timeout
         # create  members
         for membername, membervalue in event.items():
@@ -600,6 +799,23 @@ class TextVector(PropertyVector):
                 xmldata.append(textmember.onetext(textmember.membervalue))
         return xmldata
 
+    def _newTextBytes(self, timestamp=None, members={}):
+        """Returns the bytes of a newTextVector, the same as ET.tostring of the xmldata created by _newTextVector.
+           All values should be strings."""
+        if not self.enable:
+            return
+        timestamp = self._newtimestamp(timestamp)
+        if timestamp is None:
+            return
+        self.state = 'Busy'
+        items = []
+        for membername, textmember in self.data.items():
+            if membername in members:
+                items.append((membername, members[membername]))
+            else:
+                items.append((membername, textmember.membervalue))
+        return self._newbytes(timestamp, items)
+
 
     async def send_newTextVector(self, timestamp=None, members={}):
         """Transmits the vector (newTextVector) with members and values.
@@ -609,11 +825,17 @@ class TextVector(PropertyVector):
            unchanged values will still be sent.
            This method will transmit the vector and change the vector state to busy.
            If no timestamp is given, a current UTC time will be created."""
+        if all(isinstance(value, str) for value in members.values()):
+            binarydata = self._newTextBytes(timestamp, members)
+            if binarydata is None:
+                return
+            await self._sendbytes(binarydata)
+            return
+        # values which are not strings are left to ET.tostring to handle
         xmldata = self._newTextVector(timestamp, members)
         if xmldata is None:
             return
-        self._timer = True
-        self._newtimer = time.time()
+        self._starttimer()
         await self._client.send(xmldata)
 
 
@@ -647,9 +869,13 @@ class NumberVector(PropertyVector):
        The member objects contain further information label, format spec, minimum, maximum and step size.
        To obtain the member object, as opposed to the member value, use the members() method."""
 
+    # tags of the new vector, and its members, sent by this vector
+    _newtag = "newNumberVector"
+    _onetag = "oneNumber"
+
     def __init__(self, event):
         super().__init__(event.vectorname, event.label, event.group, event.state,
-                         event.timestamp, event.message, event.device, event._client)
+                         event._timestamp, event.message, event.device, event._client)
         self._perm = event.perm
         self.timeout = event.timeout
         # self.data is a dictionary of number name : numbermember
@@ -684,7 +910,9 @@ class NumberVector(PropertyVector):
 
     def _defvector(self, event):
         "Updates this vector with new values after a def... vector has been received"
-        self._timer = False
+        self._stoptimer()
+        # members may have changed, so any template is re-created when next sent
+        self._template = None
         if event.label:
             self.label = event.label
         if event.group:
@@ -693,11 +921,11 @@ class NumberVector(PropertyVector):
             self.perm = event.perm
         if event.state:
             self.state = event.state
-        if event.timestamp:
-            self.timestamp = event.timestamp
+        if event._timestamp:
+            self._timestamp = event._timestamp
         if event.message:
             self.message = event.message
-            self.message_timestamp = event.timestamp
+            self._message_timestamp = event._timestamp
         self.timeout = event.timeout
         # create  members
         for membername, membervalue in event.items():
@@ -754,6 +982,25 @@ class NumberVector(PropertyVector):
                 xmldata.append(numbermember.onenumber(numbermember.membervalue))
         return xmldata
 
+    def _newNumberBytes(self, timestamp=None, members={}):
+        "Returns the bytes of a newNumberVector, the same as ET.tostring of the xmldata created by _newNumberVector"
+        if not self.enable:
+            return
+        timestamp = self._newtimestamp(timestamp)
+        if timestamp is None:
+            return
+        self.state = 'Busy'
+        items = []
+        for membername, numbermember in self.data.items():
+            if membername in members:
+                value = members[membername]
+            else:
+                value = numbermember.membervalue
+            if not isinstance(value, str):
+                value = str(value)
+            items.append((membername, value))
+        return self._newbytes(timestamp, items)
+
     async def send_newNumberVector(self, timestamp=None, members={}):
         """Transmits the vector (newNumberVector) with members and values.
            members is a dictionary of membernames:number values, the values can be
@@ -763,12 +1010,10 @@ class NumberVector(PropertyVector):
            unchanged values will still be sent.
            This method will transmit the vector and change the vector state to busy.
            If no timestamp is given, a current UTC time will be created."""
-        xmldata = self._newNumberVector(timestamp, members)
-        if xmldata is None:
+        binarydata = self._newNumberBytes(timestamp, members)
+        if binarydata is None:
             return
-        self._timer = True
-        self._newtimer = time.time()
-        await self._client.send(xmldata)
+        await self._sendbytes(binarydata)
 
     def snapshot(self):
         """Take a snapshot of the vector and returns an object which is a restricted copy
@@ -796,7 +1041,7 @@ class BLOBVector(PropertyVector):
 
     def __init__(self, event):
         super().__init__(event.vectorname, event.label, event.group, event.state,
-                         event.timestamp, event.message, event.device, event._client)
+                         event._timestamp, event.message, event.device, event._client)
         self._perm = event.perm
         self._enableBLOB = event.device._enableBLOB  # can be set to one of Never, Also or Only
         self.timeout = event.timeout
@@ -836,7 +1081,7 @@ class BLOBVector(PropertyVector):
 
     def _defvector(self, event):
         "Updates this vector with new values after a def... vector has been received"
-        self._timer = False
+        self._stoptimer()
         if event.label:
             self.label = event.label
         if event.group:
@@ -845,11 +1090,11 @@ class BLOBVector(PropertyVector):
             self.perm = event.perm
         if event.state:
             self.state = event.state
-        if event.timestamp:
-            self.timestamp = event.timestamp
+        if event._timestamp:
+            self._timestamp = event._timestamp
         if event.message:
             self.message = event.message
-            self.message_timestamp = event.timestamp
+            self._message_timestamp = event._timestamp
         self.timeout = event.timeout
         # create  members
         for membername, label in event.memberlabels.items():
@@ -869,7 +1114,7 @@ class BLOBVector(PropertyVector):
 
     def _setvector(self, event):
         "Updates this vector with new values after a setBLOBvector has been received"
-        self._timer = False
+        self._replied()
         if not self.enable:
             # this property does not exist
             return
@@ -908,6 +1153,45 @@ class BLOBVector(PropertyVector):
                 xmldata.append(blobmember.oneblob(*members[membername]))
         return xmldata
 
+    def _newBLOBParts(self, timestamp, members):
+        """Returns the xml of a newBLOBVector as a list of bytes, split where the contents of each member
+           should be inserted, members is a dictionary of membername to (blobsize, blobformat).
+           Joined with the base64 encoded contents, this is the same as ET.tostring of the
+           xmldata created by _newBLOBVector"""
+        xmldata = ET.Element('newBLOBVector')
+        xmldata.set("device", self.devicename)
+        xmldata.set("name", self.name)
+        xmldata.set("timestamp", timestamp)
+        for membername, (blobsize, blobformat) in members.items():
+            member = ET.SubElement(xmldata, 'oneBLOB')
+            member.set("name", membername)
+            if blobformat:
+                member.set("format", blobformat)
+            elif self.data[membername].blobformat:
+                member.set("format", self.data[membername].blobformat)
+            member.set("size", str(blobsize))
+            member.text = _SPLICE
+        return ET.tostring(xmldata).split(_SPLICE.encode())
+
+    async def _newBLOBChunks(self, parts, sources):
+        """After a first step yielding None, yields the bytes of a newBLOBVector, being the xml parts, with the
+           encoded contents of each source between them, and closes the sources when complete, or when closed"""
+        loop = asyncio.get_running_loop()
+        try:
+            # the first step only enters this try, so once started, closing the generator closes the sources
+            yield
+            yield parts[0]
+            for source, part in zip(sources, parts[1:]):
+                while True:
+                    chunk = await loop.run_in_executor(None, source.read)
+                    if not chunk:
+                        break
+                    yield chunk
+                yield part
+        finally:
+            for source in sources:
+                source.close()
+
     async def send_newBLOBVector(self, timestamp=None, members={}):
         """Transmits the vector (newBLOBVector) with new BLOB members
            This method will transmit the vector and change the vector state to busy.
@@ -918,29 +1202,54 @@ class BLOBVector(PropertyVector):
            before any compression, therefore if you are sending a compressed file, you
            should set the blobsize prior to compression.
            blobformat should be a file extension, such as '.png'. If it is an empty string
-           and value is a filename, the extension will be taken from the filename."""
+           and value is a filename, the extension will be taken from the filename.
+
+           The BLOB contents are read, and base64 encoded, in chunks in an executor as they are
+           written to the port, waiting for the port to drain between chunks, so a large file
+           is sent without being read into memory."""
         if not self.enable:
             return
-        # set members as bytes
-        newmembers = {}
-        loop = asyncio.get_running_loop()
-        for membername, blobmember in self.data.items():
-            if membername in members:
-                value, blobsize, blobformat = members[membername]
-                bytescontent = await loop.run_in_executor(None, blobmember.getbytes, value)
-                if not blobsize:
-                    blobsize = len(bytescontent)
-                if not blobformat:
-                    if isinstance(value, pathlib.Path):
-                        blobformat = "".join(value.suffixes)
-                    elif isinstance(value, str):
-                        blobformat = "".join(pathlib.Path(value).suffixes)
-                    else:
-                        blobformat = ""
-                newmembers[membername] = (bytescontent, blobsize, blobformat)
-        xmldata = self._newBLOBVector(timestamp, newmembers)
-        if xmldata is None:
+        timestamp = self._newtimestamp(timestamp)
+        if timestamp is None:
             return
-        self._timer = True
-        self._newtimer = time.time()
-        await self._client.send(xmldata)
+        loop = asyncio.get_running_loop()
+        # dictionary of membername to (blobsize, blobformat)
+        newmembers = {}
+        sources = []
+        # set True when the stream is queued to be written
+        queued = False
+        try:
+            for membername, blobmember in self.data.items():
+                if membername in members:
+                    value, blobsize, blobformat = members[membername]
+                    source = await loop.run_in_executor(None, BLOBSource, value)
+                    sources.append(source)
+                    if not blobsize:
+                        blobsize = source.size
+                    if not blobformat:
+                        if isinstance(value, pathlib.Path):
+                            blobformat = "".join(value.suffixes)
+                        elif isinstance(value, str):
+                            blobformat = "".join(pathlib.Path(value).suffixes)
+                        else:
+                            blobformat = ""
+                    newmembers[membername] = (blobsize, blobformat)
+            self.state = 'Busy'
+            parts = self._newBLOBParts(timestamp, newmembers)
+            self._starttimer()
+            # the xml logged, with the BLOB contents elided, only parsed if it will be logged
+            logdata = ET.fromstring(b'NOT LOGGED'.join(parts)) if self._client._txlogged() else None
+            chunks = self._newBLOBChunks(parts, sources)
+            # started, so if it is queued but never written, it is closed with its sources
+            await chunks.asend(None)
+            queued = True
+            await self._client._transmit(chunks, logdata, (self.devicename, self.name))
+        except asyncio.CancelledError:
+            if queued:
+                # the stream may still be written, and closes the sources when complete
+                sources = []
+            raise
+        finally:
+            # close the sources if the stream has not been written
+            for source in sources:
+                source.close()
@@ -73,18 +73,14 @@ class QueClient(IPyClient):
                 try:
                     rxque.put_nowait(item)
                 except queue.Full:
-                    await asyncio.sleep(0.02)
+                    # poll the queue, until the client is shut down
+                    await self.wait_stop(0.02)
                 else:
                     break
         elif isinstance(rxque, asyncio.Queue):
-            while not self._stop:
-                try:
-                    await asyncio.wait_for(rxque.put(item), 0.1)
-                except asyncio.TimeoutError:
-                    # queue is full, continue while loop, checking stop flag
-                    continue
-                else:
-                    break
+            if not self._stop:
+                # if the queue is full, wait for space, unless the client is shut down
+                await self._untilstop(rxque.put(item))
         elif isinstance(rxque, collections.deque):
             # append item to right side of rxque
             rxque.append(item)
@@ -129,19 +125,20 @@ class QueClient(IPyClient):
                 try:
                     item = txque.get_nowait()
                 except queue.Empty:
-                    await asyncio.sleep(0.02)
+                    # poll the queue, the wait ends at once if the client is shut down
+                    await self.wait_stop(0.02)
                     continue
             elif isinstance(txque, asyncio.Queue):
-                try:
-                    item = await asyncio.wait_for(txque.get(), timeout=0.1)
-                except asyncio.TimeoutError:
-                    continue
+                received, item = await self._untilstop(txque.get())
+                if not received:
+                    # the client is shut down
+                    return
                 txque.task_done()
             elif isinstance(txque, collections.deque):
                 try:
                     item = txque.popleft()
                 except IndexError:
-                    await asyncio.sleep(0.02)
+                    await self.wait_stop(0.02)
                     continue
             else:
                 raise TypeError("txque should be either a queue.Queue, asyncio.Queue, or collections.deque")
@@ -0,0 +1,202 @@
+"""
+This module records the bytes received and transmitted by an IPyClient, and
+replays a recording back into a client, so performance measurements and
+regression checks can be repeated with real traffic, without an INDI service.
+
+A recording is made with the IPyClient record_session method. A recording file
+is appended to, and consists of records, each a header giving the record type,
+the monotonic time in seconds since the recording session started, and the
+length of the following data, then the data itself. Each session starts with a
+record holding the ISO format wall clock time at which the session started.
+
+A recording is replayed by a Replayer, either as a local INDI server socket, or
+as an in-memory connection attached to a client.
+"""
+
+import asyncio, struct, time, pathlib
+
+from datetime import datetime, timezone
+
+
+# record types
+SESSION = b'S'
+RX = b'R'
+TX = b'T'
+
+# record type, time in seconds since the session started, and data length
+_HEADER = struct.Struct("<cdI")
+
+
+def read_recording(path):
+    """Generator of (recordtype, seconds, data) read from a recording file, where recordtype is one
+       of SESSION, RX or TX, and seconds is the time since the start of the recording session"""
+    with open(path, "rb") as fp:
+        while True:
+            header = fp.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                # end of file, or a final record truncated by a crash
+                return
+            recordtype, seconds, length = _HEADER.unpack(header)
+            data = fp.read(length)
+            if len(data) < length:
+                return
+            yield recordtype, seconds, data
+
+
+class Recorder:
+
+    """Appends the data received and transmitted by a client to a recording file.
+       The file is opened when the recorder is created, and a SESSION record written."""
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self._start = time.monotonic()
+        self._fp = open(self.path, "ab")
+        timestamp = datetime.now(tz=timezone.utc).isoformat(sep='T')
+        self._write(SESSION, timestamp.encode())
+
+    def _write(self, recordtype, data):
+        self._fp.write(_HEADER.pack(recordtype, time.monotonic() - self._start, len(data)))
+        self._fp.write(data)
+
+    def received(self, data):
+        "Records data read from the port"
+        if self._fp is not None:
+            self._write(RX, data)
+
+    def transmitted(self, data):
+        "Records data written to the port"
+        if self._fp is not None:
+            self._write(TX, data)
+
+    def close(self):
+        "Flushes and closes the file"
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+class _MemoryWriter:
+
+    "Used in place of an asyncio.StreamWriter for an in-memory connection, transmitted data is counted and discarded"
+
+    def __init__(self, reader, task):
+        self._reader = reader
+        self._task = task
+        self.transmitted = 0
+
+    def write(self, data):
+        self.transmitted += len(data)
+
+    def writelines(self, data):
+        for item in data:
+            self.transmitted += len(item)
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return self._task.done()
+
+    def close(self):
+        self._task.cancel()
+        # so the client reading the connection sees it closed
+        self._reader.feed_eof()
+
+    async def wait_closed(self):
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class Replayer:
+
+    """Replays the received data from a recording file.
+
+       speed sets the replay rate, 1.0 replays at the recorded rate, 2.0 at twice the rate and so on,
+       and None replays the data as fast as it can be accepted.
+
+       The attribute finished is an asyncio.Event, set when a replay has sent all the recorded data.
+       A client does not close its connection at the end of the data, so should be shut down
+       when the replay is finished, and the received data has been handled."""
+
+    def __init__(self, path, speed=1.0):
+        if (speed is not None) and (speed <= 0):
+            raise ValueError("The speed should be None or a positive number")
+        self.path = pathlib.Path(path)
+        self.speed = speed
+        self.finished = asyncio.Event()
+        # the port of a server started by the serve method
+        self.port = None
+
+
+    async def _play(self, write, drain):
+        "Calls write with each block of received data, at the replay speed"
+        self.finished.clear()
+        start = time.monotonic()
+        offset = 0.0
+        previous = 0.0
+        for recordtype, seconds, data in read_recording(self.path):
+            if recordtype == SESSION:
+                # times in a further session start again from zero, so continue from the previous time
+                offset += previous
+                previous = 0.0
+                continue
+            previous = seconds
+            if recordtype != RX:
+                continue
+            if self.speed:
+                delay = (offset + seconds)/self.speed - (time.monotonic() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            write(data)
+            await drain()
+        self.finished.set()
+
+
+    async def serve(self, host="localhost", port=0):
+        """Starts a server on host and port, and returns the asyncio.Server. The port, if zero is
+           chosen by the system, is set in attribute port. For each client connecting,
+           the recording is replayed, and any data transmitted by the client is discarded."""
+        server = await asyncio.start_server(self._handle, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        return server
+
+
+    async def _handle(self, reader, writer):
+        "Replays the recording to a connected client"
+        async def discard():
+            while await reader.read(65536):
+                pass
+        discarding = asyncio.create_task(discard())
+        try:
+            await self._play(writer.write, writer.drain)
+            await discarding
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            discarding.cancel()
+            writer.close()
+
+
+    async def connect(self):
+        """Returns (reader, writer) of an in-memory connection, the reader being an asyncio.StreamReader
+           fed with the recording, and the writer discards and counts transmitted bytes"""
+        reader = asyncio.StreamReader()
+
+        async def drain():
+            if not self.speed:
+                # let the client read, rather than buffering the whole recording
+                await asyncio.sleep(0)
+
+        async def play():
+            await self._play(reader.feed_data, drain)
+
+        task = asyncio.create_task(play())
+        return reader, _MemoryWriter(reader, task)
+
+
+    def attach(self, client):
+        "Sets the client, an IPyClient or QueClient, to connect to this replay in memory, rather than to its host and port"
+        client._connector = self.connect
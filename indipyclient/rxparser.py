@@ -0,0 +1,696 @@
+"""
+This module contains the incremental parser backends used by the IPyClient
+'pullparser' and 'expat' receive engines.
+
+Rather than reading the port up to each '>' character, and re-parsing each
+message once it is complete, blocks of received data are fed into a persistent
+parser, and each top level element is returned as soon as its end tag has been
+parsed. So each received byte is parsed only once.
+
+PullParser uses xml.etree.ElementTree.XMLPullParser and returns elements,
+ExpatParser drives xml.parsers.expat directly, and returns lightweight Record
+objects, skipping the intermediate element tree. As the expat callbacks are
+Python functions, while the XMLPullParser element tree is built in C,
+PullParser is usually the faster of the two, ExpatParser is an alternative
+backend, and an example of providing one.
+
+It also contains BLOBSink, which can filter the received data, streaming BLOB
+contents to files.
+"""
+
+
+import os, pathlib, tempfile, binascii, logging, abc, asyncio, collections, concurrent.futures
+
+import xml.etree.ElementTree as ET
+
+from xml.parsers import expat
+
+logger = logging.getLogger(__name__)
+
+# All xml data received from the driver should be contained in one of the following tags
+TAGS = (b'message',
+        b'delProperty',
+        b'defSwitchVector',
+        b'setSwitchVector',
+        b'defLightVector',
+        b'setLightVector',
+        b'defTextVector',
+        b'setTextVector',
+        b'defNumberVector',
+        b'setNumberVector',
+        b'defBLOBVector',
+        b'setBLOBVector',
+        b'getProperties'       # for snooping
+       )
+
+# _STARTTAGS is a tuple of ( b'<defTextVector', ...  ) used to find the start of a message
+_STARTTAGS = tuple(b'<' + tag for tag in TAGS)
+
+# _TAGNAMES is the set of the above as strings, to check parsed element tags
+_TAGNAMES = frozenset(tag.decode() for tag in TAGS)
+
+# length of the longest start tag, if data ends without a start tag, this
+# much of the data is kept in case a start tag has been split between blocks
+_TAILLEN = max(len(st) for st in _STARTTAGS)
+
+# The INDI stream is a sequence of xml elements with no enclosing root, so
+# the parser is given this dummy root element before any received data
+_ROOT = b'<indi>'
+
+
+def _findstart(data, position=0):
+    """Returns the index of the first start tag in data, at or after position,
+       or -1 if no start tag is present"""
+    found = -1
+    for st in _STARTTAGS:
+        index = data.find(st, position)
+        if index == -1:
+            continue
+        if (found == -1) or (index < found):
+            found = index
+    return found
+
+
+def _startpositions(data):
+    "Returns a sorted list of the indexes of every start tag in data"
+    positions = []
+    for st in _STARTTAGS:
+        index = data.find(st)
+        while index != -1:
+            positions.append(index)
+            index = data.find(st, index+1)
+    positions.sort()
+    return positions
+
+
+class _ParserError(Exception):
+    "Raised by a parser backend when data is malformed, with the parser line and column of the error"
+
+    def __init__(self, line, column):
+        super().__init__(f"Parse error at line {line}, column {column}")
+        self.position = (line, column)
+
+
+class IncrementalParser(abc.ABC):
+
+    """The parent of the parser backends used by the IPyClient 'pullparser' and 'expat' receive
+       engines. Call feed(data) with each block of data received, and it returns a list of
+       the complete top level elements parsed so far.
+
+       If the data is malformed, the element being parsed is discarded, and the parser
+       restarts at the next recognised start tag, in the same way as the default
+       receive engine ignores data which cannot be parsed.
+
+       If maxsize is given, any message larger than maxsize bytes is discarded, and its
+       tag appended to the list attribute 'discarded'.
+
+       A backend inherits from this class, and provides the abstract methods _create, which creates
+       a new parser, and _parse, which parses data, appending each completed top level
+       element to a list. _parse maintains the attributes _depth, _tag and _completed, and on
+       malformed data raises _ParserError with the parser line and column of the error."""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        # tags of oversized messages which have been discarded
+        self.discarded = []
+        # tag of the top level element currently being parsed
+        self._tag = None
+        # set to the endtag of a discarded message, data is skipped until it is found
+        self._skipto = None
+        # depth of the element currently being parsed, the dummy root is depth 1
+        self._depth = 0
+        # list of data blocks fed since the parser was last between messages,
+        # kept so that the parser can be restarted if an error occurs
+        self._pending = []
+        # number of bytes in self._pending
+        self._pendingsize = 0
+        # the parser line and column at the start of self._pending
+        self._line = 1
+        self._column = 0
+        # number of messages completed since the start of self._pending
+        self._completed = 0
+        # data kept when waiting for a start tag which may have been split between blocks
+        self._tail = b''
+        self._reset()
+
+
+    @abc.abstractmethod
+    def _create(self):
+        "Create a new parser, and feed it with the dummy root element"
+
+
+    @abc.abstractmethod
+    def _parse(self, data, elements):
+        "Parse data, appending each complete top level element to the list elements"
+
+
+    def _reset(self):
+        "Create a new parser"
+        self._depth = 0
+        self._tag = None
+        self._create()
+        self._pending = []
+        self._pendingsize = 0
+        self._line = 1
+        self._column = len(_ROOT)
+        self._completed = 0
+
+
+    def _offset(self, data, line, column):
+        "Given a parser line and column, return the index into data, being the joined self._pending"
+        if line == self._line:
+            return max(column - self._column, 0)
+        index = -1
+        for _ in range(line - self._line):
+            index = data.find(b'\n', index+1)
+            if index == -1:
+                return len(data)
+        return index + 1 + column
+
+
+    def _resync(self, error):
+        """Called when the parser raises an error, discards the failed message
+           and restarts the parser, returning the data to be parsed from the next
+           start tag, or None if there is no further start tag"""
+        data = b''.join(self._pending)
+        # messages already returned from self._pending are skipped
+        starts = _startpositions(data)[self._completed:]
+        try:
+            errorindex = self._offset(data, *error.position)
+        except Exception:
+            errorindex = 0
+        # the failed message starts at the last start tag before the error,
+        # if there is none, the error is in data preceding the next message
+        failed = [st for st in starts if st <= errorindex]
+        if failed:
+            restart = _findstart(data, failed[-1]+1)
+        else:
+            restart = _findstart(data, errorindex)
+        self._reset()
+        if restart == -1:
+            # no further start tag, keep the tail in case a start tag has been split
+            self._tail = data[-_TAILLEN:]
+            return
+        self._tail = b''
+        data = data[restart:]
+        self._pending.append(data)
+        self._pendingsize = len(data)
+        return data
+
+
+    def feed(self, data):
+        """Feed received data into the parser, returns a list of complete elements,
+           which may be empty if no message has been completed."""
+        elements = []
+        if self._skipto:
+            # skipping an oversized message until its endtag is found
+            data = self._tail + data
+            index = data.find(self._skipto)
+            if index == -1:
+                self._tail = data[-len(self._skipto):]
+                return elements
+            data = data[index+len(self._skipto):]
+            self._skipto = None
+            self._tail = b''
+            if not data:
+                return elements
+        if self._tail:
+            data = self._tail + data
+            self._tail = b''
+            if self._depth <= 1:
+                # between messages, drop any data preceding a start tag
+                index = _findstart(data)
+                if index == -1:
+                    self._tail = data[-_TAILLEN:]
+                    return elements
+                data = data[index:]
+        self._pending.append(data)
+        self._pendingsize += len(data)
+        while data is not None:
+            try:
+                self._parse(data, elements)
+            except _ParserError as e:
+                # continue parsing with a restarted parser
+                data = self._resync(e)
+                continue
+            break
+        if self.maxsize and (self._depth > 1) and (self._pendingsize > self.maxsize):
+            # the message in progress is too large, discard it, and skip data until its endtag
+            self.discarded.append(self._tag)
+            self._skipto = b'</' + self._tag.encode() + b'>'
+            self._reset()
+            return elements
+        if self._depth <= 1:
+            # between messages, the pending data is no longer needed
+            # so record the parser position and discard it
+            for block in self._pending:
+                newlines = block.count(b'\n')
+                if newlines:
+                    self._line += newlines
+                    self._column = len(block) - block.rfind(b'\n') - 1
+                else:
+                    self._column += len(block)
+            self._pending = []
+            self._pendingsize = 0
+            self._completed = 0
+        return elements
+
+
+class PullParser(IncrementalParser):
+
+    """The parser backend used by the 'pullparser' receive engine, which feeds data into
+       an xml.etree.ElementTree.XMLPullParser, and returns xml.etree.ElementTree elements."""
+
+    def _create(self):
+        "Create a new parser, and feed it with the dummy root element"
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._parser.feed(_ROOT)
+        # the dummy root element
+        self._root = None
+
+
+    def _parse(self, data, elements):
+        "Parse data, appending each complete top level element to the list elements"
+        self._parser.feed(data)
+        try:
+            for event, elem in self._parser.read_events():
+                if event == 'start':
+                    self._depth += 1
+                    if self._depth == 1:
+                        self._root = elem
+                    elif self._depth == 2:
+                        self._tag = elem.tag
+                    continue
+                # an end event
+                self._depth -= 1
+                if self._depth == 1:
+                    # a top level element is complete
+                    if elem.tag in _TAGNAMES:
+                        self._completed += 1
+                        elements.append(elem)
+                    self._root.remove(elem)
+        except ET.ParseError as e:
+            raise _ParserError(*e.position)
+
+
+class Record:
+
+    """A lightweight replacement for an xml.etree.ElementTree.Element, created by the
+       ExpatParser. It has the attributes tag, attrib and text, the get method, and
+       iterates over its child records, as used when creating events."""
+
+    __slots__ = ('tag', 'attrib', 'text', '_children')
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.text = None
+        self._children = []
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def append(self, child):
+        self._children.append(child)
+
+    def __iter__(self):
+        return iter(self._children)
+
+    def __len__(self):
+        return len(self._children)
+
+    def element(self):
+        "Returns an equivalent xml.etree.ElementTree.Element"
+        elem = ET.Element(self.tag, self.attrib)
+        elem.text = self.text
+        for child in self._children:
+            elem.append(child.element())
+        return elem
+
+    def __str__(self):
+        return ET.tostring(self.element(), encoding='unicode')
+
+
+class ExpatParser(IncrementalParser):
+
+    """The parser backend used by the 'expat' receive engine, which drives the
+       xml.parsers.expat callbacks directly, creating a Record for each message,
+       rather than building an xml.etree.ElementTree element tree."""
+
+    def _create(self):
+        "Create a new parser, and feed it with the dummy root element"
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._chardata
+        self._parser = parser
+        # the top level record being built, and the child record being built
+        self._record = None
+        self._child = None
+        # the elements list given to self._parse
+        self._elements = None
+        parser.Parse(_ROOT, False)
+
+
+    def _start(self, tag, attrib):
+        self._depth += 1
+        if self._depth == 2:
+            self._tag = tag
+            self._record = Record(tag, attrib)
+        elif self._depth == 3:
+            self._child = Record(tag, attrib)
+            self._record.append(self._child)
+
+
+    def _end(self, tag):
+        self._depth -= 1
+        if self._depth == 1:
+            # a top level element is complete
+            if tag in _TAGNAMES:
+                self._completed += 1
+                self._elements.append(self._record)
+            self._record = None
+        elif self._depth == 2:
+            self._child = None
+
+
+    def _chardata(self, text):
+        if self._child is not None:
+            # with buffer_text set, text is normally given in a single call
+            if self._child.text is None:
+                self._child.text = text
+            else:
+                self._child.text += text
+
+
+    def _parse(self, data, elements):
+        "Parse data, appending each complete top level element to the list elements"
+        self._elements = elements
+        try:
+            self._parser.Parse(data, False)
+        except expat.ExpatError as e:
+            raise _ParserError(e.lineno, e.offset)
+        finally:
+            self._elements = None
+
+
+# states of the BLOBSink
+_SCAN = 0       # searching for a oneBLOB start tag
+_INTAG = 1      # passing a oneBLOB start tag, waiting for its closing '>'
+_CONTENT = 2    # decoding oneBLOB content to a file
+
+_ONEBLOB = b'<oneBLOB'
+
+
+class BLOBSink:
+
+    """Filters the received byte stream. If the client BLOBstreaming attribute is True and
+       a BLOBfolder is set, the base64 content of each oneBLOB element is decoded as it
+       arrives, and written to a temporary file in the BLOBfolder, rather than being held
+       in memory.
+
+       In the filtered stream, the content is replaced by a reference '#n' which is then used
+       when the setBLOBVector event is created, to obtain the file path with the pop method.
+
+       The files are created, decoded into, and closed in a thread of a single worker, so in
+       the order received, and without blocking the event loop. The complete method gives a
+       future of each file being closed, which should be awaited before the file is popped."""
+
+    # bytes of content waiting to be written, above which the congested method returns True
+    MAXQUEUED = 16*1024*1024
+
+    # content is collected into blocks of this size before being passed to the worker
+    BLOCKSIZE = 1024*1024
+
+    def __init__(self, client):
+        self._client = client
+        self._state = _SCAN
+        # data kept when a oneBLOB start tag may have been split between blocks
+        self._tail = b''
+        # the last byte of a start tag passed so far, to test for a closing '/>'
+        self._lastbyte = b''
+        # incrementing integer used as the reference of each file
+        self._serial = 0
+        # the single worker, created when the first file is opened
+        self._executor = None
+        # content collected, not yet passed to the worker
+        self._content = bytearray()
+        # deque of (future, number of bytes) of content submitted to the worker
+        self._writes = collections.deque()
+        # dictionary of reference to the future of each file being closed, its result
+        # is the path of the completed file, or None if decoding failed
+        self._files = {}
+        # used only in the worker thread, dictionary of reference to [file, path, undecoded characters]
+        # of each file being written, or to None if it could not be created or decoding failed
+        self._handles = {}
+
+
+    def filter(self, data):
+        "Returns data with the content of streamed oneBLOB elements removed"
+        if (self._state == _SCAN) and (not self._tail):
+            if (not self._client.BLOBstreaming) or (self._client.BLOBfolder is None):
+                # not streaming, so the data is unchanged
+                return data
+        if self._tail:
+            data = self._tail + data
+            self._tail = b''
+        output = []
+        position = 0
+        length = len(data)
+        while position < length:
+            if self._state == _CONTENT:
+                # base64 content has no '<', so this is the start of the endtag
+                index = data.find(b'<', position)
+                if index == -1:
+                    self._write(data[position:])
+                    break
+                self._write(data[position:index])
+                self._close()
+                self._state = _SCAN
+                position = index
+                continue
+            if self._state == _INTAG:
+                index = data.find(b'>', position)
+                if index == -1:
+                    output.append(data[position:])
+                    self._lastbyte = data[-1:]
+                    break
+                output.append(data[position:index+1])
+                if index > position:
+                    self._lastbyte = data[index-1:index]
+                position = index+1
+                self._state = _SCAN
+                if self._lastbyte != b'/':
+                    # not an empty element, so content follows
+                    self._open(output)
+                continue
+            # self._state is _SCAN
+            index = data.find(_ONEBLOB, position)
+            if index == -1:
+                # keep any partial start tag at the end of the data
+                for taillength in range(min(len(_ONEBLOB)-1, length-position), 0, -1):
+                    if data.endswith(_ONEBLOB[:taillength]):
+                        output.append(data[position:length-taillength])
+                        self._tail = data[length-taillength:]
+                        break
+                else:
+                    output.append(data[position:])
+                break
+            nextbyte = data[index+len(_ONEBLOB):index+len(_ONEBLOB)+1]
+            if not nextbyte:
+                # the tag may continue in the next block
+                output.append(data[position:index])
+                self._tail = data[index:]
+                break
+            output.append(data[position:index+len(_ONEBLOB)])
+            position = index+len(_ONEBLOB)
+            if nextbyte in b' \t\r\n/>':
+                self._state = _INTAG
+                self._lastbyte = b''
+        return b''.join(output)
+
+
+    def _open(self, output):
+        "Called at the start of oneBLOB content, opens a file if BLOBs are being streamed"
+        blobfolder = self._client.BLOBfolder
+        if (not self._client.BLOBstreaming) or (blobfolder is None):
+            # content is passed through unchanged
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="BLOBSink")
+        self._serial += 1
+        self._executor.submit(self._create, self._serial, blobfolder)
+        self._state = _CONTENT
+        output.append(b'#%d' % self._serial)
+
+
+    def _write(self, content):
+        "Collects base64 content, and passes each block of it to the worker, to be decoded and written to the file"
+        self._content.extend(content)
+        if len(self._content) >= self.BLOCKSIZE:
+            self._submit()
+
+
+    def _submit(self):
+        "Passes the content collected to the worker"
+        content = self._content
+        self._content = bytearray()
+        self._writes.append((self._executor.submit(self._decode, self._serial, content), len(content)))
+
+
+    def _close(self):
+        "Called at the end of the content, passes any remaining content, and the closing of the file, to the worker"
+        if self._content:
+            self._submit()
+        self._files[self._serial] = self._executor.submit(self._complete, self._serial)
+
+
+    def congested(self):
+        "Returns True if more than MAXQUEUED bytes of content are waiting to be written"
+        writes = self._writes
+        while writes and writes[0][0].done():
+            writes.popleft()
+        if not writes:
+            return False
+        return sum(size for future, size in writes) > self.MAXQUEUED
+
+
+    async def drain(self):
+        "Waits until no more than MAXQUEUED bytes of content are waiting to be written"
+        while self.congested():
+            await asyncio.wrap_future(self._writes[0][0])
+
+
+    def complete(self, reference):
+        """Given the reference text from a oneBLOB element, returns an asyncio future done when the
+           file is closed, or None if the reference is unknown"""
+        serial = self._reference(reference)
+        if serial not in self._files:
+            return
+        return asyncio.wrap_future(self._files[serial])
+
+
+    def _reference(self, reference):
+        "Returns the integer serial number of a reference, or None if invalid"
+        try:
+            return int(reference.strip().lstrip('#'))
+        except Exception:
+            return
+
+
+    def pop(self, reference):
+        """Given the reference text from a oneBLOB element, returns the path of the decoded
+           file, or None if the file failed to decode, is not yet complete, or the reference
+           is unknown. Any older files, which have not been claimed because their message
+           failed to parse, are deleted."""
+        serial = self._reference(reference)
+        if serial is None:
+            return
+        for older in [key for key in self._files if key < serial]:
+            self._discard(self._files.pop(older))
+        future = self._files.pop(serial, None)
+        if future is None:
+            return
+        if not future.done():
+            self._discard(future)
+            return
+        return future.result()
+
+
+    def _discard(self, future):
+        "Removes the file given by the future of its closing, once it is closed"
+        if future.done():
+            path = future.result()
+            if path is not None:
+                path.unlink(missing_ok=True)
+        else:
+            self._executor.submit(self._remove, future)
+
+
+    def close(self):
+        "Called when the connection closes, removes any partial or unclaimed files"
+        for future in self._files.values():
+            self._discard(future)
+        self._files.clear()
+        self._content.clear()
+        self._writes.clear()
+        if self._executor is not None:
+            # runs after any writes already submitted
+            self._executor.submit(self._removeall)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+    # The following methods are called in the worker thread
+
+    def _create(self, serial, blobfolder):
+        "Creates the temporary file for the content of reference serial"
+        try:
+            fd, filepath = tempfile.mkstemp(suffix=".partial", prefix=".blob_", dir=blobfolder)
+            self._handles[serial] = [os.fdopen(fd, "wb"), pathlib.Path(filepath), b'']
+        except Exception:
+            logger.exception("Unable to create a file in the BLOBfolder")
+            self._handles[serial] = None
+
+
+    def _decode(self, serial, content):
+        "Decodes base64 content, and writes it to the file"
+        handle = self._handles.get(serial)
+        if handle is None:
+            # decoding has failed, content is discarded
+            return
+        content = handle[2] + content.translate(None, b' \t\r\n')
+        # only whole groups of four characters are decoded, the remainder is kept
+        decodelength = len(content) - len(content) % 4
+        handle[2] = content[decodelength:]
+        if not decodelength:
+            return
+        try:
+            handle[0].write(binascii.a2b_base64(content[:decodelength]))
+        except Exception:
+            self._fail(serial)
+
+
+    def _complete(self, serial):
+        "Closes the file, and returns its path, or None if decoding failed"
+        handle = self._handles.pop(serial, None)
+        if handle is None:
+            return
+        file, path, remainder = handle
+        try:
+            if remainder:
+                file.write(binascii.a2b_base64(remainder))
+            file.close()
+        except Exception:
+            self._handles[serial] = handle
+            self._fail(serial)
+            return
+        return path
+
+
+    def _fail(self, serial):
+        "Decoding has failed, remove the file"
+        handle = self._handles.get(serial)
+        self._handles[serial] = None
+        if handle is None:
+            return
+        try:
+            handle[0].close()
+            handle[1].unlink()
+        except Exception:
+            pass
+
+
+    def _remove(self, future):
+        "Removes the file given by the future of its closing"
+        path = future.result()
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+
+    def _removeall(self):
+        "Removes any files still being written when the connection closed"
+        for serial in list(self._handles):
+            self._fail(serial)
+        self._handles.clear()
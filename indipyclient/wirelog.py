@@ -0,0 +1,148 @@
+"""
+This module provides the debug wire logging used by IPyClient when enabled
+with its set_wirelog method.
+
+Rather than copying each received or transmitted xml element, and converting
+it back to a string, the log is taken from the raw bytes already read from,
+or written to, the port. The bytes are wrapped in a WireMessage, which is only
+formatted, according to the verbosity, when the log record is handled. Handlers
+given to WireLog are called in a separate thread, fed by a queue, so
+formatting and writing the log is done outside the event loop.
+"""
+
+import logging, queue
+
+from logging.handlers import QueueHandler, QueueListener
+
+from .rxparser import _startpositions
+
+logger = logging.getLogger(__name__)
+
+
+_BLOBSTART = b'<oneBLOB'
+_BLOBEND = b'</oneBLOB>'
+_NOTLOGGED = b'NOT LOGGED'
+
+
+def _elideblobs(data):
+    "Returns data with any BLOB content replaced by NOT LOGGED"
+    parts = []
+    start = 0
+    first = data.find(b'<')
+    if first == -1:
+        # no tags, so this is the middle of a BLOB received in blocks
+        return _NOTLOGGED if data.strip() else data
+    if first and data.startswith(_BLOBEND, first):
+        # data starts with the end of a BLOB received in blocks
+        parts.append(_NOTLOGGED)
+        start = first
+    while True:
+        index = data.find(_BLOBSTART, start)
+        if index == -1:
+            break
+        contentstart = data.find(b'>', index)
+        if contentstart == -1:
+            break
+        contentstart += 1
+        if data[contentstart-2] == 47:
+            # b'/', an empty element
+            parts.append(data[start:contentstart])
+            start = contentstart
+            continue
+        contentend = data.find(_BLOBEND, contentstart)
+        if contentend == -1:
+            # the content continues in further blocks
+            contentend = len(data)
+        parts.append(data[start:contentstart])
+        parts.append(_NOTLOGGED)
+        start = contentend
+    parts.append(data[start:])
+    return b''.join(parts)
+
+
+def wiretext(data, verbose):
+    """Returns a string of the given bytes, as used in the log, with detail set by verbose
+
+       |  1 the start tag of each message only
+       |  2 all the data, apart from BLOB contents
+       |  3 all the data"""
+    if verbose == 1:
+        tags = []
+        for index in _startpositions(data):
+            end = data.find(b'>', index)
+            if end == -1:
+                tags.append(data[index:] + b'...')
+            else:
+                tags.append(data[index:end+1])
+        data = b' '.join(tags)
+    elif verbose == 2:
+        data = _elideblobs(data)
+    return data.decode('utf-8', errors='replace')
+
+
+class WireMessage:
+
+    """The message of a wire log record, holding the bytes transmitted or received,
+       which are only formatted when the record is handled."""
+
+    __slots__ = ('startlog', 'data', 'verbose', '_text')
+
+    def __init__(self, startlog, data, verbose):
+        self.startlog = startlog
+        self.data = data
+        self.verbose = verbose
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self.startlog + wiretext(self.data, self.verbose)
+            # the data is no longer needed
+            self.data = None
+        return self._text
+
+
+def logwire(startlog, data, verbose):
+    """Logs the bytes data at level DEBUG, startlog is a string such as "RX:: ".
+       data should not be altered after this call."""
+    logger.debug(WireMessage(startlog, data, verbose))
+
+
+class _WireQueueHandler(QueueHandler):
+
+    "A QueueHandler which leaves the record to be formatted by the QueueListener thread"
+
+    def prepare(self, record):
+        return record
+
+
+class WireLog:
+
+    """Passes wire log records through a queue to the given logging handlers,
+       which are called in a separate thread. While started, the records are not
+       passed on to the handlers of parent loggers."""
+
+    def __init__(self, handlers):
+        self._queue = queue.SimpleQueue()
+        self._handler = _WireQueueHandler(self._queue)
+        self._listener = QueueListener(self._queue, *handlers, respect_handler_level=True)
+        self._started = False
+
+    def start(self):
+        "Starts the listener thread, and enables wire logging at level DEBUG"
+        if self._started:
+            return
+        self._started = True
+        logger.addHandler(self._handler)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        self._listener.start()
+
+    def stop(self):
+        "Stops the listener thread, after handling any records waiting in the queue"
+        if not self._started:
+            return
+        self._started = False
+        logger.removeHandler(self._handler)
+        logger.setLevel(logging.NOTSET)
+        logger.propagate = True
+        self._listener.stop()